@@ -0,0 +1,171 @@
+"""
+音频分析：波形峰值与响度计算
+
+在独立进程池中运行，只依赖标准库（解码优先使用 ffmpeg，没有时退回到 wave 模块读取 WAV）。
+"""
+
+import math
+import sys
+import wave
+import array
+import shutil
+import asyncio
+import logging
+import operator
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from config import ANALYSIS_SAMPLE_RATE, ANALYSIS_MAX_WORKERS, WAVEFORM_POINTS, LOUDNESS_TARGET
+
+logger = logging.getLogger(__name__)
+
+# 增益调整范围（dB）
+MIN_GAIN_DB = -20.0
+MAX_GAIN_DB = 12.0
+
+
+def decode_pcm(file_path: str, sample_rate: int = ANALYSIS_SAMPLE_RATE) -> Optional[array.array]:
+    """将音频解码为单声道16位PCM采样，无法解码时返回None"""
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg:
+        try:
+            result = subprocess.run(
+                [ffmpeg, "-v", "error", "-i", file_path, "-f", "s16le", "-ac", "1", "-ar", str(sample_rate), "-"],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                check=True,
+            )
+            samples = array.array("h")
+            samples.frombytes(result.stdout[:len(result.stdout) // 2 * 2])
+            if sys.byteorder == "big":
+                samples.byteswap()
+            return samples
+        except Exception as e:
+            logger.warning(f"ffmpeg解码失败 {file_path}: {e}")
+
+    if file_path.lower().endswith(".wav"):
+        return decode_wav(file_path, sample_rate)
+    return None
+
+
+def decode_wav(file_path: str, sample_rate: int) -> Optional[array.array]:
+    """使用wave模块读取16位WAV，取第一个声道并按步长抽样到目标采样率附近"""
+    try:
+        with wave.open(file_path, "rb") as wav:
+            if wav.getsampwidth() != 2:
+                logger.warning(f"不支持的WAV采样位宽: {wav.getsampwidth() * 8} bit, 文件: {file_path}")
+                return None
+            channels = wav.getnchannels()
+            step = max(1, wav.getframerate() // sample_rate)
+            frames = array.array("h")
+            frames.frombytes(wav.readframes(wav.getnframes()))
+    except Exception as e:
+        logger.warning(f"读取WAV失败 {file_path}: {e}")
+        return None
+
+    if sys.byteorder == "big":
+        frames.byteswap()
+    return frames[::channels * step]
+
+
+def compute_waveform(samples: array.array, points: int = WAVEFORM_POINTS) -> bytes:
+    """计算降采样峰值波形，每个点为0-255的无符号字节"""
+    if not samples:
+        return b""
+
+    bucket = math.ceil(len(samples) / points)
+    peaks = bytearray()
+    for start in range(0, len(samples), bucket):
+        chunk = samples[start:start + bucket]
+        peak = max(max(chunk), -min(chunk))
+        peaks.append(min(255, peak * 255 // 32767))
+    return bytes(peaks)
+
+
+def compute_loudness(samples: array.array, sample_rate: int = ANALYSIS_SAMPLE_RATE) -> Optional[float]:
+    """
+    计算整体响度（近似EBU R128门限算法，未做K加权）
+
+    400ms块、75%重叠，先做-70绝对门限，再做相对门限(-10)。
+    """
+    sub_size = max(1, sample_rate // 10)
+    scale = 32768.0 * 32768.0
+
+    # 每100ms的均方值
+    sub_ms = []
+    for start in range(0, len(samples) - sub_size + 1, sub_size):
+        chunk = samples[start:start + sub_size]
+        sub_ms.append(sum(map(operator.mul, chunk, chunk)) / (sub_size * scale))
+
+    blocks = [sum(sub_ms[i:i + 4]) / 4 for i in range(len(sub_ms) - 3)]
+    if not blocks:
+        return None
+
+    def block_loudness(ms: float) -> float:
+        return -0.691 + 10 * math.log10(ms) if ms > 0 else -float("inf")
+
+    gated = [ms for ms in blocks if block_loudness(ms) > -70]
+    if not gated:
+        return None
+
+    relative_gate = block_loudness(sum(gated) / len(gated)) - 10
+    gated = [ms for ms in gated if block_loudness(ms) > relative_gate]
+    return round(block_loudness(sum(gated) / len(gated)), 2)
+
+
+def analyze_audio_file(file_path: str, points: int = WAVEFORM_POINTS,
+                       target: float = LOUDNESS_TARGET) -> Optional[Dict[str, Any]]:
+    """分析单个音频文件（在工作进程中执行），返回波形、响度和建议增益"""
+    samples = decode_pcm(file_path)
+    if not samples:
+        return None
+
+    peak = max(max(samples), -min(samples)) / 32768.0
+    loudness = compute_loudness(samples)
+
+    gain_db = 0.0
+    if loudness is not None:
+        gain_db = max(MIN_GAIN_DB, min(MAX_GAIN_DB, target - loudness))
+        # 增益不能让峰值超过0dBFS
+        if peak > 0:
+            gain_db = min(gain_db, -20 * math.log10(peak))
+
+    return {
+        "waveform": compute_waveform(samples, points),
+        "loudness": loudness,
+        "gain_db": round(gain_db, 2),
+        "peak": round(peak, 4),
+    }
+
+
+class TrackAnalyzer:
+    """有界CPU进程池，后台分析上传的音频"""
+
+    def __init__(self, max_workers: int = ANALYSIS_MAX_WORKERS):
+        self.max_workers = max_workers
+        self.executor: Optional[ProcessPoolExecutor] = None
+
+    def get_executor(self) -> ProcessPoolExecutor:
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self.executor
+
+    async def analyze(self, file_path: Path) -> Optional[Dict[str, Any]]:
+        """在进程池中分析文件，失败时返回None"""
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self.get_executor(), analyze_audio_file, str(file_path))
+        except Exception as e:
+            logger.error(f"音频分析失败 {file_path}: {e}")
+            return None
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+
+# 创建全局分析器实例
+track_analyzer = TrackAnalyzer()
@@ -149,4 +149,4 @@ if __name__ == "__main__":
     backups = backup_manager.list_backups()
     for backup in backups:
         size_mb = backup["size"] / (1024 * 1024)
-        print(f"  - {backup['name']} ({size_mb:.2f} MB}")
\ No newline at end of file
+        print(f"  - {backup['name']} ({size_mb:.2f} MB)")
\ No newline at end of file
@@ -0,0 +1,74 @@
+"""
+基准测试公用函数
+"""
+
+import io
+import math
+import wave
+import shutil
+import struct
+import tempfile
+import subprocess
+from pathlib import Path
+from typing import Dict, List, Optional
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+# 复制到临时目录运行时需要的程序目录
+APP_DIRS = ["admin", "display"]
+
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    """延迟分位数（毫秒）"""
+    if not values:
+        return {"count": 0, "mean": None, "p50": None, "p90": None, "p95": None, "p99": None, "max": None}
+    ordered = sorted(values)
+
+    def pick(q: float) -> float:
+        position = (len(ordered) - 1) * q
+        lower = math.floor(position)
+        upper = min(lower + 1, len(ordered) - 1)
+        return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered) * 1000, 3),
+        "p50": round(pick(0.50) * 1000, 3),
+        "p90": round(pick(0.90) * 1000, 3),
+        "p95": round(pick(0.95) * 1000, 3),
+        "p99": round(pick(0.99) * 1000, 3),
+        "max": round(ordered[-1] * 1000, 3),
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def make_wav(seconds: float = 5.0, rate: int = 8000, frequency: float = 440.0) -> bytes:
+    """生成一段正弦波WAV"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        frames = bytearray()
+        for i in range(int(seconds * rate)):
+            frames += struct.pack("<h", int(12000 * math.sin(2 * math.pi * frequency * i / rate)))
+        wav.writeframes(bytes(frames))
+    return buffer.getvalue()
+
+
+def make_sandbox(prefix: str) -> Path:
+    """把程序复制到临时目录（程序的数据、上传、备份目录都以源码目录为基准，这样不会碰到真实曲库）"""
+    workdir = Path(tempfile.mkdtemp(prefix=prefix))
+    for path in ROOT_DIR.glob("*.py"):
+        shutil.copy2(path, workdir / path.name)
+    for name in APP_DIRS:
+        shutil.copytree(ROOT_DIR / name, workdir / name)
+    (workdir / "static").mkdir(exist_ok=True)
+    return workdir
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+曲库/持久化规模基准测试
+
+为每个规模（默认 100、1000、10000、50000 首）在临时目录生成一份合成曲库（数据库记录 + 极短的WAV文件 +
+少量孤立文件），然后在独立进程中计时：
+- 导入 persistence（即启动时加载数据库）、get_all_music_tracks
+- 逐条添加/删除曲目（每次都写数据库）
+- 媒体文件打开（MediaServer.build_response，随机曲目）
+- 上传文件回收（UploadCollector：标记一代、再清除一代，不设宽限期）、repair_music_durations
+- AutoBackup.backup_now 与 restore_backup
+最后输出规模报告（每项耗时及随规模增长的指数，>1 表示超线性），并把结果写入 JSON。
+
+用法:
+    python benchmarks/library_bench.py
+    python benchmarks/library_bench.py --sizes 100,1000,5000 --skip repair,backup --output library.json
+    python benchmarks/library_bench.py --compare library.json
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import argparse
+import platform
+import subprocess
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from bench_utils import git_commit, make_wav, make_sandbox
+
+# 可跳过的测试项
+OPERATIONS = ["load", "add_delete", "media", "cleanup", "repair", "backup"]
+
+RESULT_PREFIX = "RESULT:"
+
+
+# ---------- 生成合成曲库（父进程） ----------
+
+def generate_library(workdir: Path, size: int, orphan_ratio: float, seed: int) -> Dict:
+    """在临时目录生成 size 首曲目的数据库和文件"""
+    rng = random.Random(seed)
+    music_dir = workdir / "uploads" / "music"
+    covers_dir = workdir / "uploads" / "covers"
+    data_dir = workdir / "data"
+    for path in (music_dir, covers_dir, data_dir):
+        path.mkdir(parents=True, exist_ok=True)
+    (covers_dir / "default-cover.jpg").write_bytes(b"\xff\xd8\xff\xd9")
+
+    audio = make_wav(seconds=0.05)
+    tracks = []
+    for i in range(size):
+        track_id = f"{i:08x}"
+        filename = f"{track_id}_track-{i}.wav"
+        (music_dir / filename).write_bytes(audio)
+        tracks.append({
+            "id": track_id,
+            "title": f"测试曲目 {i}",
+            "artist": f"艺术家 {rng.randint(1, max(1, size // 10))}",
+            "duration": 0,  # 故意写错，让 repair 有事可做
+            "url": f"/uploads/music/{filename}",
+            "cover_url": "/uploads/covers/default-cover.jpg",
+            "lyrics_url": None,
+            "created_at": datetime.now().isoformat(),
+        })
+
+    orphans = int(size * orphan_ratio)
+    for i in range(orphans):
+        (music_dir / f"orphan{i:06d}_unused.wav").write_bytes(audio)
+
+    with open(data_dir / "music_database.json", "w", encoding="utf-8") as f:
+        json.dump(tracks, f, ensure_ascii=False, indent=2)
+    with open(data_dir / "slides_database.json", "w", encoding="utf-8") as f:
+        json.dump([], f)
+
+    return {
+        "tracks": size,
+        "orphans": orphans,
+        "database_bytes": (data_dir / "music_database.json").stat().st_size,
+        "upload_bytes": (size + orphans) * len(audio),
+    }
+
+
+# ---------- 计时（子进程，在临时目录中运行） ----------
+
+def run_worker(args) -> Dict:
+    import resource
+
+    results: Dict[str, Dict] = {}
+    skip = set(filter(None, args.skip.split(",")))
+
+    def record(name: str, seconds: float, items: int = 1):
+        results[name] = {"seconds": round(seconds, 6), "items": items,
+                         "per_item_us": round(seconds / items * 1e6, 3) if items else None}
+
+    start = time.perf_counter()
+    import persistence
+    record("import_persistence", time.perf_counter() - start, args.size)
+    manager = persistence.persistence_manager
+
+    if "load" not in skip:
+        start = time.perf_counter()
+        manager.load_database(manager.music_db_file)
+        record("load_database", time.perf_counter() - start, args.size)
+
+        start = time.perf_counter()
+        tracks = manager.get_all_music_tracks()
+        record("get_all_music_tracks", time.perf_counter() - start, len(tracks))
+
+    if "add_delete" not in skip:
+        ids = [f"bench{i:05d}" for i in range(args.add_count)]
+        start = time.perf_counter()
+        for track_id in ids:
+            manager.add_music_track({
+                "id": track_id, "title": track_id, "artist": "benchmark", "duration": 1,
+                "url": f"/uploads/music/{track_id}.wav", "cover_url": "/uploads/covers/default-cover.jpg",
+            })
+        record("add_music_track", time.perf_counter() - start, len(ids))
+
+        start = time.perf_counter()
+        for track_id in ids:
+            manager.delete_music_track(track_id)
+        record("delete_music_track", time.perf_counter() - start, len(ids))
+
+    if "media" not in skip and args.size:
+        from config import UPLOAD_FOLDER
+        from streaming import MediaServer, RangeFileResponse
+
+        media = MediaServer(UPLOAD_FOLDER, ["music"])
+        rng = random.Random(args.seed)
+        filenames = [track["url"].split("/")[-1] for track in manager.music_database]
+        start = time.perf_counter()
+        for _ in range(args.media_requests):
+            path = media.resolve("music", rng.choice(filenames))
+            response = media.build_response(path, "bench", "bytes=0-1023", None)
+            if isinstance(response, RangeFileResponse):
+                media.file_cache.release(response.entry)
+        record("media_build_response", time.perf_counter() - start, args.media_requests)
+        results["media_build_response"]["fd_cache_hits"] = media.file_cache.hits
+        results["media_build_response"]["fd_cache_misses"] = media.file_cache.misses
+        media.file_cache.clear()
+
+    if "cleanup" not in skip:
+        import asyncio
+        from config import UPLOAD_FOLDER
+        from collector import UploadCollector
+
+        collector = UploadCollector(UPLOAD_FOLDER, grace_period=0, sweep_interval=0)
+        start = time.perf_counter()
+        asyncio.run(collector.collect())
+        record("collect_uploads_mark", time.perf_counter() - start, args.size)
+
+        start = time.perf_counter()
+        report = asyncio.run(collector.collect())
+        record("collect_uploads_sweep", time.perf_counter() - start, args.size)
+        results["collect_uploads_sweep"]["deleted"] = report["deleted"]
+
+    if "repair" not in skip:
+        start = time.perf_counter()
+        repaired = manager.repair_music_durations()
+        record("repair_music_durations", time.perf_counter() - start, args.size)
+        results["repair_music_durations"]["repaired"] = repaired
+
+    if "backup" not in skip:
+        from backup import AutoBackup
+
+        backup = AutoBackup()
+        start = time.perf_counter()
+        ok = backup.backup_now()
+        record("backup_now", time.perf_counter() - start, args.size)
+        results["backup_now"]["success"] = ok
+
+        backups = backup.list_backups()
+        if backups:
+            start = time.perf_counter()
+            ok = backup.restore_backup(backups[0]["name"])
+            record("restore_backup", time.perf_counter() - start, args.size)
+            results["restore_backup"]["success"] = ok
+
+    results["max_rss_mb"] = {"value": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2)}
+    return results
+
+
+# ---------- 报告 ----------
+
+def scaling_exponent(sizes: List[int], seconds: List[float]) -> Optional[float]:
+    """最大两个规模之间的增长指数: log(t2/t1) / log(n2/n1)"""
+    points = [(n, t) for n, t in zip(sizes, seconds) if n and t]
+    if len(points) < 2:
+        return None
+    (n1, t1), (n2, t2) = points[-2], points[-1]
+    return round(math.log(t2 / t1) / math.log(n2 / n1), 2)
+
+
+def build_report(runs: List[Dict]) -> Dict:
+    sizes = [run["size"] for run in runs]
+    operations = []
+    for run in runs:
+        for name in run["results"]:
+            if name not in operations and "seconds" in run["results"][name]:
+                operations.append(name)
+
+    report = {}
+    for name in operations:
+        seconds = [run["results"].get(name, {}).get("seconds") for run in runs]
+        report[name] = {
+            "seconds": dict(zip(map(str, sizes), seconds)),
+            "scaling_exponent": scaling_exponent(sizes, [s or 0 for s in seconds]),
+        }
+    return report
+
+
+def print_report(result: Dict, baseline: Dict = None):
+    sizes = [run["size"] for run in result["runs"]]
+    print(f"\n{'项目':<26}" + "".join(f"{size:>12}" for size in sizes) + f"{'增长指数':>10}")
+    for name, row in result["report"].items():
+        cells = []
+        for size in sizes:
+            value = row["seconds"].get(str(size))
+            cells.append(f"{value * 1000:>10.1f}ms" if value is not None else f"{'-':>12}")
+        exponent = row["scaling_exponent"]
+        flag = " 超线性" if exponent is not None and exponent > 1.2 else ""
+        print(f"{name:<26}" + "".join(cells) + f"{exponent if exponent is not None else '-':>10}{flag}")
+    print(f"{'max_rss_mb':<26}" + "".join(f"{run['results']['max_rss_mb']['value']:>12}" for run in result["runs"]))
+
+    if baseline:
+        print(f"\n与基线对比 ({baseline['meta'].get('git_commit')} -> {result['meta'].get('git_commit')}):")
+        for name, row in result["report"].items():
+            old_row = baseline.get("report", {}).get(name)
+            if not old_row:
+                continue
+            parts = []
+            for size in sizes:
+                new_value, old_value = row["seconds"].get(str(size)), old_row["seconds"].get(str(size))
+                if new_value is not None and old_value:
+                    parts.append(f"{size}: {(new_value - old_value) / old_value * 100:+.1f}%")
+            if parts:
+                print(f"  {name:<24}" + ", ".join(parts))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="曲库/持久化规模基准测试")
+    parser.add_argument("--sizes", default="100,1000,10000,50000", help="曲库规模，逗号分隔")
+    parser.add_argument("--skip", default="", help=f"跳过的测试项，可选: {','.join(OPERATIONS)}")
+    parser.add_argument("--add-count", type=int, default=20, help="逐条添加/删除的曲目数")
+    parser.add_argument("--media-requests", type=int, default=2000, help="媒体文件打开次数")
+    parser.add_argument("--orphan-ratio", type=float, default=0.01, help="孤立文件占曲目数的比例")
+    parser.add_argument("--seed", type=int, default=1, help="随机数种子")
+    parser.add_argument("--timeout", type=float, default=3600, help="每个规模的最长运行秒数")
+    parser.add_argument("--keep", action="store_true", help="保留临时目录")
+    parser.add_argument("--output", default="library_bench_result.json", help="结果JSON文件")
+    parser.add_argument("--compare", help="与之前的结果JSON对比")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--size", type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        # 子进程: 当前目录是临时程序目录
+        sys.path.insert(0, os.getcwd())
+        print(RESULT_PREFIX + json.dumps(run_worker(args)))
+        return
+
+    runs = []
+    for size in [int(value) for value in args.sizes.split(",") if value.strip()]:
+        workdir = make_sandbox(f"pyer-library-{size}-")
+        try:
+            print(f"规模 {size}: 生成曲库...", flush=True)
+            start = time.perf_counter()
+            library = generate_library(workdir, size, args.orphan_ratio, args.seed)
+            library["generate_seconds"] = round(time.perf_counter() - start, 3)
+
+            print(f"规模 {size}: 运行测试...", flush=True)
+            command = [sys.executable, str(Path(__file__).resolve()), "--worker", "--size", str(size),
+                       "--skip", args.skip, "--add-count", str(args.add_count),
+                       "--media-requests", str(args.media_requests), "--seed", str(args.seed)]
+            completed = subprocess.run(command, cwd=workdir, capture_output=True, text=True, timeout=args.timeout,
+                                       env={**os.environ, "PYTHONPATH": str(workdir)})
+            lines = [line for line in completed.stdout.splitlines() if line.startswith(RESULT_PREFIX)]
+            if completed.returncode != 0 or not lines:
+                print(completed.stderr[-3000:])
+                raise RuntimeError(f"规模 {size} 的测试进程失败 (退出码 {completed.returncode})")
+            runs.append({"size": size, "library": library, "results": json.loads(lines[-1][len(RESULT_PREFIX):])})
+        finally:
+            if args.keep:
+                print(f"临时目录: {workdir}")
+            else:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+    result = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "config": {key: getattr(args, key) for key in ("sizes", "skip", "add_count", "media_requests",
+                                                       "orphan_ratio", "seed")},
+        "runs": runs,
+        "report": build_report(runs),
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+    print(f"\n结果已保存到 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
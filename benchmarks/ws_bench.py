@@ -0,0 +1,616 @@
+#!/usr/bin/env python3
+"""
+WebSocket 压力/延迟基准测试
+
+在本机启动 server:app（默认复制程序到临时目录运行，不影响真实曲库），模拟 N 个显示端
+（按真实频率上报 time_update）和 M 个管理端，按命令脚本发送播放、拖动进度、调节音量、
+切歌、上传等操作，统计 管理端发出命令 -> 显示端收到 的延迟分位数、吞吐量以及服务器 CPU/内存，
+结果写入 JSON 便于不同版本之间对比。
+
+用法:
+    python benchmarks/ws_bench.py --displays 50 --admins 3 --scenario show --output result.json
+    python benchmarks/ws_bench.py --scenario seek_storm --binary --compare result.json
+    python benchmarks/ws_bench.py --url http://192.168.1.10:2427 --server-pid 1234 --scenario volume_drag
+    python benchmarks/ws_bench.py --script my_script.json
+
+命令脚本是阶段列表，例如:
+    [{"command": "volume_drag", "count": 200, "rate": 30}, {"command": "skip", "count": 10, "rate": 2}]
+可用命令: play, seek_storm, volume_drag, skip, upload
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import random
+import socket
+import asyncio
+import argparse
+import platform
+import subprocess
+import urllib.request
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from bench_utils import ROOT_DIR, percentiles, git_commit, make_wav, make_sandbox
+
+sys.path.insert(0, str(ROOT_DIR))
+
+import websockets
+
+from wire import BINARY_SUBPROTOCOL, BINARY_CODEC, JSON_CODEC
+
+# 内置场景
+SCENARIOS = {
+    "show": [
+        {"command": "play", "count": 10, "rate": 2},
+        {"command": "volume_drag", "count": 120, "rate": 30},
+        {"command": "seek_storm", "count": 100, "rate": 20},
+        {"command": "skip", "count": 20, "rate": 2},
+        {"command": "upload", "count": 3, "rate": 0.5},
+    ],
+    "play": [{"command": "play", "count": 60, "rate": 4}],
+    "seek_storm": [{"command": "seek_storm", "count": 400, "rate": 50}],
+    "volume_drag": [{"command": "volume_drag", "count": 600, "rate": 60}],
+    "skip": [{"command": "skip", "count": 60, "rate": 5}],
+    "upload": [{"command": "upload", "count": 10, "rate": 1}],
+}
+
+Token = Tuple[str, Any]
+
+
+# ---------- 工具函数 ----------
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def http_json(url: str, timeout: float = 10.0) -> Any:
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def upload_music(base_url: str, filename: str, content: bytes, title: str) -> Dict:
+    """multipart/form-data 上传音乐"""
+    boundary = uuid.uuid4().hex
+    body = bytearray()
+    for name, value in (("title", title), ("artist", "benchmark")):
+        body += (f"--{boundary}\r\nContent-Disposition: form-data; name=\"{name}\"\r\n\r\n{value}\r\n").encode("utf-8")
+    body += (f"--{boundary}\r\nContent-Disposition: form-data; name=\"music_file\"; filename=\"{filename}\"\r\n"
+             f"Content-Type: audio/wav\r\n\r\n").encode("utf-8")
+    body += content + f"\r\n--{boundary}--\r\n".encode("utf-8")
+
+    request = urllib.request.Request(f"{base_url}/api/upload/music", data=bytes(body), method="POST",
+                                     headers={"Content-Type": f"multipart/form-data; boundary={boundary}"})
+    with urllib.request.urlopen(request, timeout=60) as response:
+        return json.loads(response.read())
+
+
+def message_token(message: Dict) -> Optional[Token]:
+    """显示端收到的消息 -> 对应命令的标记"""
+    message_type = message.get("type")
+    data = message.get("data") or {}
+    if message_type in ("play", "seek"):
+        return message_type, data.get("time")
+    if message_type == "pause":
+        return "pause", None
+    if message_type == "volume":
+        return "volume", data.get("volume")
+    if message_type == "track_change":
+        return "track_change", (data.get("track") or {}).get("id")
+    return None
+
+
+# ---------- 服务器进程 ----------
+
+class ServerProcess:
+    """在临时目录（或原目录）启动 uvicorn server:app"""
+
+    def __init__(self, in_place: bool = False, port: Optional[int] = None):
+        self.in_place = in_place
+        self.port = port or free_port()
+        self.workdir: Optional[Path] = None
+        self.process: Optional[subprocess.Popen] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    @property
+    def pid(self) -> Optional[int]:
+        return self.process.pid if self.process else None
+
+    def prepare(self) -> Path:
+        if self.in_place:
+            return ROOT_DIR
+        self.workdir = make_sandbox("pyer-bench-")
+        return self.workdir
+
+    def start(self, timeout: float = 30.0):
+        cwd = self.prepare()
+        (cwd / "static").mkdir(exist_ok=True)
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1", "--port", str(self.port),
+             "--log-level", "warning"],
+            cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        )
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"服务器启动失败:\n{self.process.stderr.read().decode(errors='ignore')}")
+            try:
+                http_json(f"{self.base_url}/health", timeout=1)
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise RuntimeError("服务器启动超时")
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        if self.workdir:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+class ProcessSampler:
+    """通过 /proc 采样服务器进程的 CPU 和常驻内存（非 Linux 系统不可用）"""
+
+    def __init__(self, pid: Optional[int], interval: float = 0.5):
+        self.pid = pid
+        self.interval = interval
+        self.samples: List[Dict[str, float]] = []
+        self.clock_ticks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+    @property
+    def available(self) -> bool:
+        return self.pid is not None and Path(f"/proc/{self.pid}/stat").exists()
+
+    def read(self) -> Optional[Tuple[float, float]]:
+        try:
+            stat = Path(f"/proc/{self.pid}/stat").read_text()
+            fields = stat[stat.rindex(")") + 2:].split()
+            cpu_seconds = (int(fields[11]) + int(fields[12])) / self.clock_ticks
+            rss_kb = 0
+            for line in Path(f"/proc/{self.pid}/status").read_text().splitlines():
+                if line.startswith("VmRSS:"):
+                    rss_kb = int(line.split()[1])
+            return cpu_seconds, rss_kb / 1024
+        except (OSError, ValueError, IndexError):
+            return None
+
+    async def run(self):
+        previous = self.read()
+        previous_time = time.monotonic()
+        while True:
+            await asyncio.sleep(self.interval)
+            current = self.read()
+            now = time.monotonic()
+            if current and previous:
+                self.samples.append({
+                    "cpu_percent": (current[0] - previous[0]) / (now - previous_time) * 100,
+                    "cpu_seconds": current[0],
+                    "rss_mb": current[1],
+                })
+            previous, previous_time = current, now
+
+    def summary(self) -> Optional[Dict]:
+        if not self.samples:
+            return None
+        cpu = [sample["cpu_percent"] for sample in self.samples]
+        rss = [sample["rss_mb"] for sample in self.samples]
+        return {
+            "samples": len(self.samples),
+            "cpu_percent_avg": round(sum(cpu) / len(cpu), 2),
+            "cpu_percent_max": round(max(cpu), 2),
+            "cpu_seconds": round(self.samples[-1]["cpu_seconds"] - self.samples[0]["cpu_seconds"], 3),
+            "rss_mb_avg": round(sum(rss) / len(rss), 2),
+            "rss_mb_max": round(max(rss), 2),
+        }
+
+
+# ---------- 压测 ----------
+
+class PendingCommand:
+    def __init__(self, command: str, sent_at: float, displays: Set[int]):
+        self.command = command
+        self.sent_at = sent_at
+        self.remaining = displays
+
+
+class Benchmark:
+    def __init__(self, args, base_url: str, server_pid: Optional[int], allow_uploads: bool):
+        self.args = args
+        self.base_url = base_url.rstrip("/")
+        self.ws_url = self.base_url.replace("http", "ws", 1)
+        self.room_query = f"?room={args.room}" if args.room else ""
+        self.codec = BINARY_CODEC if args.binary else JSON_CODEC
+        self.allow_uploads = allow_uploads
+        self.random = random.Random(args.seed)
+
+        self.connected_displays: Set[int] = set()
+        self.pending: Dict[Token, PendingCommand] = {}
+        self.latencies: Dict[str, List[float]] = {}
+        self.sent: Dict[str, int] = {}
+        self.lost: Dict[str, int] = {}
+        self.upload_latencies: List[float] = []
+        self.upload_bytes = 0
+        self.track_ids: List[str] = []
+        self.wav = make_wav(args.upload_seconds)
+
+        self.display_messages = 0
+        self.display_bytes = 0
+        self.admin_messages = 0
+        self.time_updates_sent = 0
+        self.client_lag_max = 0.0
+
+        self.sampler = ProcessSampler(server_pid)
+        self.stopping = asyncio.Event()
+
+    # --- 客户端 ---
+
+    def connect(self, path: str):
+        subprotocols = [BINARY_SUBPROTOCOL] if self.args.binary else None
+        return websockets.connect(f"{self.ws_url}{path}{self.room_query}", subprotocols=subprotocols,
+                                  max_size=None, ping_interval=None, open_timeout=30)
+
+    def decode(self, raw) -> Dict:
+        return BINARY_CODEC.decode(raw) if isinstance(raw, bytes) else json.loads(raw)
+
+    async def display_client(self, display_id: int, ready: asyncio.Event):
+        async with self.connect("/ws/display") as ws:
+            self.connected_displays.add(display_id)
+            if len(self.connected_displays) == self.args.displays:
+                ready.set()
+            reporter = asyncio.create_task(self.report_time(ws))
+            try:
+                async for raw in ws:
+                    received_at = time.perf_counter()
+                    self.display_messages += 1
+                    self.display_bytes += len(raw)
+                    token = message_token(self.decode(raw))
+                    if token is not None:
+                        self.match(token, display_id, received_at)
+            except websockets.ConnectionClosed:
+                pass
+            finally:
+                reporter.cancel()
+                self.connected_displays.discard(display_id)
+
+    async def report_time(self, ws):
+        """模拟浏览器 timeupdate 事件（默认每秒4次，带随机抖动）"""
+        if self.args.time_update_hz <= 0:
+            return
+        position = self.random.uniform(0, 60)
+        interval = 1 / self.args.time_update_hz
+        await asyncio.sleep(self.random.uniform(0, interval))
+        while True:
+            position += interval
+            await ws.send(self.codec.encode({"type": "time_update", "data": {"time": round(position, 3)}}))
+            self.time_updates_sent += 1
+            await asyncio.sleep(interval * self.random.uniform(0.8, 1.2))
+
+    async def admin_listener(self):
+        async with self.connect("/ws/admin") as ws:
+            try:
+                async for _ in ws:
+                    self.admin_messages += 1
+            except websockets.ConnectionClosed:
+                pass
+
+    async def monitor_client_lag(self):
+        """压测进程自身的事件循环延迟，过大说明客户端成了瓶颈，结果不可信"""
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + 0.1
+            await asyncio.sleep(0.1)
+            self.client_lag_max = max(self.client_lag_max, loop.time() - expected)
+
+    # --- 命令匹配 ---
+
+    def track(self, token: Token, command: str):
+        previous = self.pending.pop(token, None)
+        if previous is not None:
+            self.lost[previous.command] = self.lost.get(previous.command, 0) + len(previous.remaining)
+        self.pending[token] = PendingCommand(command, time.perf_counter(), set(self.connected_displays))
+        self.sent[command] = self.sent.get(command, 0) + 1
+
+    def match(self, token: Token, display_id: int, received_at: float):
+        pending = self.pending.get(token)
+        if pending is None or display_id not in pending.remaining:
+            return
+        pending.remaining.discard(display_id)
+        self.latencies.setdefault(pending.command, []).append(received_at - pending.sent_at)
+        if not pending.remaining:
+            del self.pending[token]
+
+    def build_command(self, kind: str, seq: int) -> Optional[Tuple[Dict, Token]]:
+        if kind == "play":
+            if seq % 2 == 0:
+                marker = round(0.5 + seq * 0.001, 3)
+                return {"type": "play_music", "data": {"time": marker}}, ("play", marker)
+            return {"type": "pause_music", "data": {}}, ("pause", None)
+        if kind == "seek_storm":
+            marker = round(1 + (seq % 100000) * 0.001, 3)
+            return {"type": "seek_music", "data": {"time": marker}}, ("seek", marker)
+        if kind == "volume_drag":
+            position = seq % 200
+            volume = position if position <= 100 else 200 - position
+            return {"type": "set_volume", "data": {"volume": volume}}, ("volume", volume)
+        if kind == "skip":
+            index = seq % len(self.track_ids)
+            return {"type": "select_track", "data": {"index": index}}, ("track_change", self.track_ids[index])
+        raise ValueError(f"未知命令: {kind}")
+
+    # --- 上传 ---
+
+    async def upload(self, title: str):
+        started = time.perf_counter()
+        await asyncio.to_thread(upload_music, self.base_url, f"{title}.wav", self.wav, title)
+        self.upload_latencies.append(time.perf_counter() - started)
+        self.upload_bytes += len(self.wav)
+
+    async def seed_tracks(self):
+        state = await asyncio.to_thread(http_json, f"{self.base_url}/api/state{self.room_query}")
+        missing = self.args.seed_tracks - len(state["playlist"])
+        if missing > 0 and self.allow_uploads:
+            for i in range(missing):
+                await asyncio.to_thread(upload_music, self.base_url, f"seed-{i}.wav", self.wav, f"seed-{i}")
+            state = await asyncio.to_thread(http_json, f"{self.base_url}/api/state{self.room_query}")
+        self.track_ids = [track["id"] for track in state["playlist"]]
+
+    # --- 运行 ---
+
+    async def run_phase(self, admin, phase: Dict, counter: Dict[str, int]):
+        kind = phase["command"]
+        count = int(phase.get("count", 10))
+        interval = 1 / float(phase.get("rate", 10))
+
+        if kind == "upload" and not self.allow_uploads:
+            print("  跳过 upload 阶段（对外部服务器运行时需要 --allow-uploads）")
+            return
+        if kind == "skip" and len(self.track_ids) < 2:
+            print("  跳过 skip 阶段（曲库少于2首）")
+            return
+
+        print(f"  阶段 {kind}: {count} 条, {phase.get('rate', 10)}/s")
+        uploads = []
+        next_at = time.perf_counter()
+        for _ in range(count):
+            seq = counter[kind] = counter.get(kind, 0) + 1
+            if kind == "upload":
+                uploads.append(asyncio.create_task(self.upload(f"bench-{seq}")))
+            else:
+                message, token = self.build_command(kind, seq)
+                self.track(token, message["type"])
+                await admin.send(self.codec.encode(message))
+            next_at += interval
+            await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+        if uploads:
+            await asyncio.gather(*uploads)
+
+    async def settle(self, timeout: float):
+        deadline = time.perf_counter() + timeout
+        while self.pending and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+        for pending in self.pending.values():
+            self.lost[pending.command] = self.lost.get(pending.command, 0) + len(pending.remaining)
+        self.pending.clear()
+
+    async def run(self, phases: List[Dict]) -> Dict:
+        await self.seed_tracks()
+
+        background = [asyncio.create_task(self.monitor_client_lag())]
+        if self.sampler.available:
+            background.append(asyncio.create_task(self.sampler.run()))
+
+        ready = asyncio.Event()
+        semaphore = asyncio.Semaphore(50)
+
+        async def start_display(display_id: int):
+            async with semaphore:
+                task = asyncio.create_task(self.display_client(display_id, ready))
+                while display_id not in self.connected_displays and not task.done():
+                    await asyncio.sleep(0.01)
+            return task
+
+        display_tasks = await asyncio.gather(*(start_display(i) for i in range(self.args.displays)))
+        admin_tasks = [asyncio.create_task(self.admin_listener()) for _ in range(max(0, self.args.admins - 1))]
+        try:
+            await asyncio.wait_for(ready.wait(), timeout=60)
+        except asyncio.TimeoutError:
+            print(f"警告: 只有 {len(self.connected_displays)}/{self.args.displays} 个显示端连接成功")
+
+        # 让初始状态消息发完
+        await asyncio.sleep(self.args.warmup)
+
+        started = time.perf_counter()
+        counter: Dict[str, int] = {}
+        async with self.connect("/ws/admin") as admin:
+            drain = asyncio.create_task(self.drain(admin))
+            for phase in phases:
+                await self.run_phase(admin, phase, counter)
+            await self.settle(self.args.settle)
+            drain.cancel()
+        elapsed = time.perf_counter() - started
+
+        server_metrics = None
+        try:
+            server_metrics = await asyncio.to_thread(http_json, f"{self.base_url}/api/metrics")
+        except (OSError, ValueError):
+            pass
+
+        for task in display_tasks + admin_tasks + background:
+            task.cancel()
+        await asyncio.gather(*display_tasks, *admin_tasks, *background, return_exceptions=True)
+
+        return self.report(phases, elapsed, server_metrics)
+
+    async def drain(self, admin):
+        try:
+            async for _ in admin:
+                self.admin_messages += 1
+        except websockets.ConnectionClosed:
+            pass
+
+    def report(self, phases: List[Dict], elapsed: float, server_metrics: Optional[Dict]) -> Dict:
+        commands = {}
+        for command, sent in sorted(self.sent.items()):
+            deliveries = len(self.latencies.get(command, []))
+            commands[command] = {
+                "sent": sent,
+                "deliveries": deliveries,
+                "lost": self.lost.get(command, 0),
+                "latency_ms": percentiles(self.latencies.get(command, [])),
+            }
+        all_latencies = [value for values in self.latencies.values() for value in values]
+        upload_seconds = sum(self.upload_latencies)
+
+        result = {
+            "meta": {
+                "timestamp": datetime.now().isoformat(),
+                "git_commit": git_commit(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+            },
+            "config": {
+                "displays": self.args.displays,
+                "admins": self.args.admins,
+                "codec": self.codec.name,
+                "time_update_hz": self.args.time_update_hz,
+                "seed": self.args.seed,
+                "phases": phases,
+            },
+            "commands": commands,
+            "overall_latency_ms": percentiles(all_latencies),
+            "uploads": {
+                "count": len(self.upload_latencies),
+                "bytes": self.upload_bytes,
+                "latency_ms": percentiles(self.upload_latencies),
+                "throughput_mb_s": round(self.upload_bytes / upload_seconds / 1024 / 1024, 3) if upload_seconds else None,
+            },
+            "throughput": {
+                "duration_s": round(elapsed, 3),
+                "commands_per_s": round(sum(self.sent.values()) / elapsed, 2) if elapsed else None,
+                "display_messages_per_s": round(self.display_messages / elapsed, 2) if elapsed else None,
+                "display_bytes_per_s": round(self.display_bytes / elapsed, 2) if elapsed else None,
+                "admin_messages": self.admin_messages,
+                "time_updates_sent": self.time_updates_sent,
+            },
+            "server": self.sampler.summary(),
+            "client": {"loop_lag_ms_max": round(self.client_lag_max * 1000, 3)},
+        }
+        if server_metrics:
+            result["server_metrics"] = {
+                name: server_metrics["metrics"][name]["values"]
+                for name in ("pyer_command_duration_seconds", "pyer_broadcast_duration_seconds",
+                             "pyer_encode_duration_seconds", "pyer_event_loop_lag_seconds_hist")
+                if name in server_metrics.get("metrics", {})
+            }
+        return result
+
+
+# ---------- 输出 ----------
+
+def print_summary(result: Dict):
+    print("\n命令 -> 显示端延迟 (ms):")
+    print(f"  {'命令':<14}{'发送':>6}{'送达':>8}{'丢失':>6}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    for command, stats in result["commands"].items():
+        latency = stats["latency_ms"]
+        print(f"  {command:<14}{stats['sent']:>6}{stats['deliveries']:>8}{stats['lost']:>6}"
+              + "".join(f"{latency[key] if latency[key] is not None else '-':>10}" for key in ("p50", "p95", "p99", "max")))
+    throughput = result["throughput"]
+    print(f"\n用时 {throughput['duration_s']}s, 命令 {throughput['commands_per_s']}/s, "
+          f"显示端消息 {throughput['display_messages_per_s']}/s, time_update {throughput['time_updates_sent']} 条")
+    if result["uploads"]["count"]:
+        print(f"上传 {result['uploads']['count']} 个, p50 {result['uploads']['latency_ms']['p50']} ms, "
+              f"{result['uploads']['throughput_mb_s']} MB/s")
+    if result["server"]:
+        server = result["server"]
+        print(f"服务器 CPU 平均 {server['cpu_percent_avg']}% 峰值 {server['cpu_percent_max']}%, "
+              f"内存峰值 {server['rss_mb_max']} MB")
+    print(f"压测客户端最大事件循环延迟 {result['client']['loop_lag_ms_max']} ms")
+
+
+def print_comparison(result: Dict, baseline: Dict):
+    print(f"\n与基线对比 ({baseline['meta'].get('git_commit')} -> {result['meta'].get('git_commit')}):")
+    for command, stats in result["commands"].items():
+        old = baseline.get("commands", {}).get(command)
+        if not old:
+            continue
+        parts = []
+        for key in ("p50", "p95", "p99"):
+            new_value, old_value = stats["latency_ms"][key], old["latency_ms"][key]
+            if new_value is None or not old_value:
+                continue
+            parts.append(f"{key} {old_value} -> {new_value} ({(new_value - old_value) / old_value * 100:+.1f}%)")
+        print(f"  {command:<14}" + ", ".join(parts))
+
+
+def load_phases(args) -> List[Dict]:
+    if args.script:
+        with open(args.script, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return SCENARIOS[args.scenario]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WebSocket 压力/延迟基准测试")
+    parser.add_argument("--displays", type=int, default=20, help="模拟的显示端数量")
+    parser.add_argument("--admins", type=int, default=2, help="模拟的管理端数量（其中一个发送命令）")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="show", help="内置命令场景")
+    parser.add_argument("--script", help="命令脚本JSON文件（覆盖 --scenario）")
+    parser.add_argument("--time-update-hz", type=float, default=4.0, help="每个显示端每秒上报 time_update 的次数")
+    parser.add_argument("--binary", action="store_true", help="使用二进制（MessagePack）协议")
+    parser.add_argument("--room", default="", help="房间名")
+    parser.add_argument("--seed", type=int, default=1, help="随机数种子")
+    parser.add_argument("--seed-tracks", type=int, default=3, help="曲库不足时上传的测试曲目数")
+    parser.add_argument("--upload-seconds", type=float, default=5.0, help="测试音频时长（秒）")
+    parser.add_argument("--warmup", type=float, default=1.0, help="连接建立后等待的秒数")
+    parser.add_argument("--settle", type=float, default=5.0, help="命令发送完后等待送达的最长秒数")
+    parser.add_argument("--url", help="对已运行的服务器压测（不启动本地服务器）")
+    parser.add_argument("--server-pid", type=int, help="配合 --url 采样服务器CPU/内存")
+    parser.add_argument("--allow-uploads", action="store_true", help="配合 --url 允许上传测试文件")
+    parser.add_argument("--in-place", action="store_true", help="在源码目录启动服务器（使用真实曲库）")
+    parser.add_argument("--output", default="ws_bench_result.json", help="结果JSON文件")
+    parser.add_argument("--compare", help="与之前的结果JSON对比")
+    args = parser.parse_args()
+
+    phases = load_phases(args)
+    server = None
+    if args.url:
+        base_url, server_pid, allow_uploads = args.url, args.server_pid, args.allow_uploads
+    else:
+        server = ServerProcess(in_place=args.in_place)
+        print(f"启动服务器 {server.base_url} ...")
+        server.start()
+        base_url, server_pid, allow_uploads = server.base_url, server.pid, True
+
+    try:
+        print(f"{args.displays} 个显示端, {args.admins} 个管理端, 协议 {'二进制' if args.binary else 'JSON'}")
+        result = asyncio.run(Benchmark(args, base_url, server_pid, allow_uploads).run(phases))
+    finally:
+        if server:
+            server.stop()
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    print_summary(result)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            print_comparison(result, json.load(f))
+    print(f"\n结果已保存到 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
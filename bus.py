@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+状态/广播消息总线
+
+多个 uvicorn 工作进程通过总线共享播放状态和广播消息：
+- LocalBus: 单进程内使用（默认）
+- UnixSocketBus: 多进程，通过 Unix Socket 连接到 BusHub 中转
+
+直接运行本脚本可以启动一个独立的 BusHub。
+"""
+
+import os
+import json
+import uuid
+import asyncio
+import logging
+import threading
+from collections import deque
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from config import BUS_BACKEND, BUS_SOCKET_PATH
+
+logger = logging.getLogger(__name__)
+
+# 消息处理函数
+MessageHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+class MessageBus:
+    """总线基类：publish 不阻塞，收到的其他进程消息交给订阅者处理"""
+
+    def __init__(self):
+        self.node_id = uuid.uuid4().hex[:8]
+        self.handlers: List[MessageHandler] = []
+
+    def subscribe(self, handler: MessageHandler):
+        self.handlers.append(handler)
+
+    def publish(self, message: Dict[str, Any]):
+        raise NotImplementedError
+
+    async def dispatch(self, message: Dict[str, Any]):
+        # 忽略自己发出的消息
+        if message.get("origin") == self.node_id:
+            return
+        for handler in self.handlers:
+            try:
+                await handler(message)
+            except Exception as e:
+                logger.error(f"处理总线消息失败 {message.get('kind')}: {e}")
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+
+class LocalBus(MessageBus):
+    """进程内总线，同一进程中的多个订阅节点共享（单进程时相当于空操作）"""
+
+    def __init__(self, peers: Optional[List["LocalBus"]] = None):
+        super().__init__()
+        self.peers = peers if peers is not None else []
+        self.peers.append(self)
+
+    def publish(self, message: Dict[str, Any]):
+        message = {**message, "origin": self.node_id}
+        for peer in self.peers:
+            if peer is not self and peer.handlers:
+                asyncio.get_running_loop().create_task(peer.dispatch(message))
+
+
+class UnixSocketBus(MessageBus):
+    """通过 Unix Socket 连接 BusHub 的多进程总线，断线自动重连"""
+
+    def __init__(self, socket_path: str = BUS_SOCKET_PATH, max_pending: int = 1000):
+        super().__init__()
+        self.socket_path = socket_path
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.pending: deque = deque(maxlen=max_pending)
+        self.task: Optional[asyncio.Task] = None
+
+    def publish(self, message: Dict[str, Any]):
+        line = (json.dumps({**message, "origin": self.node_id}, ensure_ascii=False) + "\n").encode("utf-8")
+        if self.writer is not None and not self.writer.is_closing():
+            self.writer.write(line)
+        else:
+            self.pending.append(line)
+
+    async def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.socket_path, limit=16 * 1024 * 1024)
+            except OSError as e:
+                logger.warning(f"无法连接总线 {self.socket_path}: {e}，1秒后重试")
+                await asyncio.sleep(1)
+                continue
+
+            logger.info(f"已连接总线: {self.socket_path} (节点 {self.node_id})")
+            self.writer = writer
+            while self.pending:
+                writer.write(self.pending.popleft())
+
+            try:
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    await self.dispatch(json.loads(line))
+            except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+                logger.error(f"总线连接异常: {e}")
+            finally:
+                self.writer = None
+                writer.close()
+
+            logger.warning("总线连接断开，正在重连")
+            await asyncio.sleep(0.5)
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        if self.writer:
+            self.writer.close()
+
+
+class BusHub:
+    """总线中转：把每个连接发来的消息转发给其他所有连接"""
+
+    def __init__(self, socket_path: str = BUS_SOCKET_PATH, max_buffer: int = 8 * 1024 * 1024):
+        self.socket_path = socket_path
+        self.max_buffer = max_buffer
+        self.clients: Set[asyncio.StreamWriter] = set()
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.clients.add(writer)
+        logger.info(f"总线节点已连接，当前 {len(self.clients)} 个")
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                for client in list(self.clients):
+                    if client is writer:
+                        continue
+                    # 跟不上的节点直接断开，由其重连后重新同步
+                    if client.transport.get_write_buffer_size() > self.max_buffer:
+                        logger.warning("总线节点写缓冲过大，断开连接")
+                        self.clients.discard(client)
+                        client.close()
+                        continue
+                    client.write(line)
+        except (OSError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.clients.discard(writer)
+            writer.close()
+            logger.info(f"总线节点已断开，当前 {len(self.clients)} 个")
+
+    async def serve_forever(self):
+        Path(self.socket_path).unlink(missing_ok=True)
+        server = await asyncio.start_unix_server(self.handle_client, self.socket_path, limit=16 * 1024 * 1024)
+        logger.info(f"总线中转已启动: {self.socket_path}")
+        async with server:
+            await server.serve_forever()
+
+    def start_in_thread(self) -> threading.Thread:
+        """在后台线程中运行（供主进程在启动多个工作进程前调用）"""
+        thread = threading.Thread(target=asyncio.run, args=(self.serve_forever(),), daemon=True, name="bus-hub")
+        thread.start()
+        return thread
+
+
+def create_bus() -> MessageBus:
+    """根据配置（环境变量 PYER_BUS_BACKEND 优先）创建总线"""
+    backend = os.environ.get("PYER_BUS_BACKEND", BUS_BACKEND)
+    if backend == "unix":
+        return UnixSocketBus(os.environ.get("PYER_BUS_SOCKET", BUS_SOCKET_PATH))
+    return LocalBus()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    try:
+        asyncio.run(BusHub(os.environ.get("PYER_BUS_SOCKET", BUS_SOCKET_PATH)).serve_forever())
+    except KeyboardInterrupt:
+        print("总线中转已停止")
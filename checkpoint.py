@@ -0,0 +1,109 @@
+"""
+播放状态检查点
+
+播放状态（模式、当前曲目/幻灯片、播放/暂停、进度、音量、待播队列）只在内存中，重启后会回到第一首暂停。
+这里把每个房间的状态快照以追加方式写入 JSON Lines 文件：
+- 状态变化时只记下最新的快照，合并一小段时间后一次写入（拖动进度条、连续调音量只写一行）
+- 每行带记下快照时的墙上时间，启动时取每个房间最后一条完整的记录，正在播放时按经过的时间推算进度
+- 文件超过一定大小后压缩为每个房间一行（临时文件 + 原子替换），末尾写坏的半行在读取时跳过
+- 多个工作进程共用同一个文件：追加和压缩都持有跨进程文件锁，压缩按文件当前的内容进行，不会丢掉其他进程写入的记录
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from config import CHECKPOINT_DEBOUNCE, CHECKPOINT_COMPACT_BYTES
+from persistence import FileLock
+
+logger = logging.getLogger(__name__)
+
+
+class PlaybackCheckpoint:
+    def __init__(self, path: Path, debounce: float = CHECKPOINT_DEBOUNCE,
+                 compact_bytes: int = CHECKPOINT_COMPACT_BYTES):
+        self.path = path
+        self.debounce = debounce
+        self.compact_bytes = compact_bytes
+        self.pending: Dict[str, Dict[str, Any]] = {}  # 房间名 -> 尚未写入的最新记录
+        self.lock = FileLock(path.with_name(path.name + ".lock"))
+        self.flush_handle: Optional[asyncio.TimerHandle] = None
+
+    def load(self) -> Dict[str, Dict[str, Any]]:
+        """读取每个房间最后一条记录：{房间名: {"state": 快照, "saved_at": 墙上时间}}"""
+        records: Dict[str, Dict[str, Any]] = {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # 写到一半时进程退出留下的半行
+                    if isinstance(record, dict) and isinstance(record.get("state"), dict):
+                        records[record.get("room")] = record
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"读取播放状态检查点失败: {e}")
+        return records
+
+    def record(self, room: str, state: Dict[str, Any]):
+        """记下房间的最新状态，合并 debounce 秒内的修改后写入"""
+        # 时间在记下时取：写入前合并等待的这段时间里进度照常在走
+        self.pending[room] = {"room": room, "saved_at": time.time(), "state": state}
+        if self.flush_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+        self.flush_handle = loop.call_later(self.debounce, self.flush)
+
+    def flush(self):
+        """立即写入所有待写入的快照"""
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if not self.pending:
+            return
+        records = list(self.pending.values())
+        self.pending.clear()
+        lines = "".join(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n" for record in records)
+        try:
+            with self.lock:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(lines)
+                    size = f.tell()
+                if size > self.compact_bytes:
+                    self.compact()
+        except OSError as e:
+            logger.error(f"写入播放状态检查点失败: {e}")
+
+    def compact(self):
+        """按文件当前的内容重写为每个房间一行（包括其他进程写入的房间）"""
+        temp_path = self.path.with_suffix(".tmp")
+        try:
+            with self.lock:
+                records = self.load()
+                with open(temp_path, "w", encoding="utf-8") as f:
+                    for record in records.values():
+                        f.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+                os.replace(temp_path, self.path)
+        except OSError as e:
+            logger.error(f"压缩播放状态检查点失败: {e}")
+
+
+def extrapolate(record: Dict[str, Any], duration: Optional[float] = None) -> float:
+    """按记下快照后经过的时间推算当前进度（暂停时不变，不超过曲目时长）"""
+    state = record["state"]
+    position = float(state.get("current_time") or 0)
+    if state.get("is_playing"):
+        position += max(0.0, time.time() - float(record.get("saved_at") or time.time()))
+        if duration:
+            position = min(position, float(duration))
+    return position
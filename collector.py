@@ -0,0 +1,212 @@
+"""
+上传文件回收（增量标记-清除）
+
+删除曲目和幻灯片后留在上传目录里的文件由这里回收，可以在演出过程中在后台运行：
+- 标记：每一轮是一代（generation），开始时从数据库收集引用的文件，扫描上传目录时没有被引用的文件记为候选，
+  记下第一次成为候选的代数和时间；之后又被引用或已经不在的文件移出候选
+- 宽限期：之前某一代就已经是候选、连续 grace_period 秒没有被引用、修改时间也早于宽限期的文件才会删除。
+  上传、批量导入和转码都是先写文件后保存记录，这段时间内的文件不会被误删
+- 清除：分批删除，每批持有数据库锁、读入其他进程的写入后重新确认没有被引用，批之间间隔 sweep_interval 秒
+- 扫描每检查 scan_batch 个文件让出一次事件循环，文件再多也不会长时间阻塞请求
+试运行（dry_run）只标记不删除，返回可回收的文件和字节数。服务器启动后的第一轮只标记。
+"""
+
+import os
+import time
+import asyncio
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from config import (DEFAULT_COVER_URL, UPLOAD_SUBDIRS, GC_GRACE_PERIOD, GC_SCAN_BATCH,
+                    GC_SWEEP_BATCH, GC_SWEEP_INTERVAL)
+from persistence import persistence_manager
+from metrics import upload_gc_reclaimed, upload_gc_reclaimed_bytes
+
+logger = logging.getLogger(__name__)
+
+# 没有记录引用但不能删除的文件
+KEEP_URLS = {DEFAULT_COVER_URL}
+
+
+class Candidate:
+    """没有被引用的上传文件"""
+    __slots__ = ("generation", "since", "size")
+
+    def __init__(self, generation: int, since: float, size: int):
+        self.generation = generation  # 第一次成为候选的代数
+        self.since = since  # 第一次成为候选的时间（墙上时间）
+        self.size = size
+
+
+class UploadCollector:
+    def __init__(self, root: Path, subdirs: Sequence[str] = UPLOAD_SUBDIRS, grace_period: float = GC_GRACE_PERIOD,
+                 scan_batch: int = GC_SCAN_BATCH, sweep_batch: int = GC_SWEEP_BATCH,
+                 sweep_interval: float = GC_SWEEP_INTERVAL):
+        self.root = root
+        self.subdirs = list(subdirs)
+        self.grace_period = grace_period
+        self.scan_batch = scan_batch
+        self.sweep_batch = sweep_batch
+        self.sweep_interval = sweep_interval
+        self.generation = 0
+        self.candidates: Dict[str, Candidate] = {}  # 文件URL -> 候选信息
+        self.running = False
+        self.guard = asyncio.Lock()  # 同一时间只进行一轮
+        self.last_report: Optional[dict] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self, interval: float):
+        """每 interval 秒在后台回收一轮（0 表示只在手动触发时回收）"""
+        if interval > 0:
+            self.task = asyncio.get_running_loop().create_task(self.run(interval))
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def run(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.collect()
+            except Exception as e:
+                logger.error(f"回收上传文件时出错: {e}")
+
+    async def scan(self) -> Tuple[int, List[Tuple[str, Path, int, float]]]:
+        """分批检查上传目录，返回检查的文件数和没有被引用的文件 (URL, 路径, 大小, 修改时间)"""
+        referenced = persistence_manager.referenced_files() | KEEP_URLS
+        checked = 0
+        unreferenced = []
+        for subdir in self.subdirs:
+            try:
+                entries = os.scandir(self.root / subdir)
+            except FileNotFoundError:
+                continue
+            with entries:
+                for entry in entries:
+                    checked += 1
+                    if checked % self.scan_batch == 0:
+                        await asyncio.sleep(0)
+                    url = f"/uploads/{subdir}/{entry.name}"
+                    # 点开头的是正在写入的临时文件
+                    if url in referenced or entry.name.startswith("."):
+                        continue
+                    try:
+                        if not entry.is_file():
+                            continue
+                        stat = entry.stat()
+                    except OSError:
+                        continue  # 检查时已被删除
+                    unreferenced.append((url, Path(entry.path), stat.st_size, stat.st_mtime))
+        return checked, unreferenced
+
+    async def collect(self, dry_run: bool = False) -> dict:
+        """标记一代并清除超过宽限期的候选；dry_run 时只标记，报告可回收的文件"""
+        async with self.guard:
+            self.running = True
+            try:
+                return await self.collect_generation(dry_run)
+            finally:
+                self.running = False
+
+    async def collect_generation(self, dry_run: bool) -> dict:
+        started = time.perf_counter()
+        self.generation += 1
+        generation = self.generation
+        checked, unreferenced = await self.scan()
+
+        now = time.time()
+        candidates: Dict[str, Candidate] = {}
+        eligible: List[Tuple[str, Path, int]] = []
+        waiting_bytes = 0
+        for url, path, size, mtime in unreferenced:
+            candidate = self.candidates.get(url) or Candidate(generation, now, size)
+            candidate.size = size
+            candidates[url] = candidate
+            if (candidate.generation < generation and now - candidate.since >= self.grace_period
+                    and now - mtime >= self.grace_period):
+                eligible.append((url, path, size))
+            else:
+                waiting_bytes += size
+        # 这一代没有出现的（又被引用或已删除）不再是候选
+        self.candidates = candidates
+
+        report = {
+            "generation": generation,
+            "dry_run": dry_run,
+            "checked": checked,
+            "reclaimable": [{"url": url, "bytes": size,
+                             "unreferenced_seconds": round(now - candidates[url].since)}
+                            for url, _, size in eligible],
+            "reclaimable_bytes": sum(size for _, _, size in eligible),
+            "waiting": len(candidates) - len(eligible),
+            "waiting_bytes": waiting_bytes,
+            "deleted": 0,
+            "deleted_bytes": 0,
+        }
+        if not dry_run and eligible:
+            report["deleted"], report["deleted_bytes"] = await self.sweep(eligible)
+        report["seconds"] = round(time.perf_counter() - started, 3)
+        report["finished_at"] = time.time()
+        self.last_report = report
+
+        if dry_run:
+            logger.info(f"上传文件回收试运行（第 {generation} 代）: 检查 {checked} 个文件，"
+                        f"可回收 {len(eligible)} 个（{report['reclaimable_bytes']} 字节），宽限期内 {report['waiting']} 个")
+        elif eligible or report["waiting"]:
+            logger.info(f"上传文件回收（第 {generation} 代）: 检查 {checked} 个文件，删除 {report['deleted']} 个"
+                        f"（{report['deleted_bytes']} 字节），宽限期内 {report['waiting']} 个，耗时 {report['seconds']}s")
+        return report
+
+    async def sweep(self, eligible: List[Tuple[str, Path, int]]) -> Tuple[int, int]:
+        """分批删除，返回删除的文件数和字节数"""
+        deleted = deleted_bytes = 0
+        for start in range(0, len(eligible), self.sweep_batch):
+            if start:
+                await asyncio.sleep(self.sweep_interval)
+            removed = await asyncio.to_thread(self.delete_batch, eligible[start:start + self.sweep_batch])
+            for url, size in removed:
+                self.candidates.pop(url, None)
+                deleted += 1
+                deleted_bytes += size
+            upload_gc_reclaimed.inc(len(removed))
+            upload_gc_reclaimed_bytes.inc(sum(size for _, size in removed))
+        return deleted, deleted_bytes
+
+    def delete_batch(self, batch: List[Tuple[str, Path, int]]) -> List[Tuple[str, int]]:
+        """持有数据库锁，读入其他进程的写入后重新确认没有被引用再删除（在线程中运行）"""
+        removed = []
+        with persistence_manager.transaction():
+            referenced = persistence_manager.referenced_files()
+            cutoff = time.time() - self.grace_period
+            for url, path, size in batch:
+                if url in referenced:
+                    continue
+                try:
+                    if path.stat().st_mtime > cutoff:
+                        continue  # 标记之后又被写入（同名文件重新上传）
+                    path.unlink()
+                except FileNotFoundError:
+                    continue  # 其他工作进程已经删除
+                except OSError as e:
+                    logger.error(f"删除文件失败 {path}: {e}")
+                    continue
+                logger.info(f"回收上传文件: {path}")
+                removed.append((url, size))
+        return removed
+
+    def status(self) -> dict:
+        return {
+            "running": self.running,
+            "generation": self.generation,
+            "candidates": len(self.candidates),
+            "candidate_bytes": sum(candidate.size for candidate in self.candidates.values()),
+            "grace_period": self.grace_period,
+            "last_report": self.last_report,
+        }
@@ -1,14 +1,19 @@
 # 配置文件
 import os
+import tempfile
 from pathlib import Path
 
 # 基础配置
 BASE_DIR = Path(__file__).resolve().parent
 UPLOAD_FOLDER = BASE_DIR / 'uploads'
 
-# 创建上传目录
-for subdir in ['music', 'slides', 'covers', 'lyrics']:
-    (UPLOAD_FOLDER / subdir).mkdir(parents=True, exist_ok=True)
+UPLOAD_SUBDIRS = ['music', 'slides', 'covers', 'lyrics', 'variants']
+
+
+def ensure_upload_dirs():
+    """创建上传目录（服务器启动时调用，导入配置本身没有副作用）"""
+    for subdir in UPLOAD_SUBDIRS:
+        (UPLOAD_FOLDER / subdir).mkdir(parents=True, exist_ok=True)
 
 # 允许的文件扩展名
 ALLOWED_EXTENSIONS = {
@@ -26,6 +31,97 @@ DEBUG = True
 # WebSocket配置
 WEBSOCKET_PING_INTERVAL = 30
 WEBSOCKET_PING_TIMEOUT = 60
+WEBSOCKET_SEND_QUEUE_LIMIT = 512  # 单个连接待发送消息上限，超过后断开让客户端重连
+RESUME_BUFFER_SIZE = 256  # 每个房间为断线重连保留的最近广播消息数（显示端和管理端各一份）
 
 # 默认文件
-DEFAULT_COVER_URL = "/uploads/covers/default-cover.jpg"
\ No newline at end of file
+DEFAULT_COVER_URL = "/uploads/covers/default-cover.jpg"
+
+# 预取配置（显示端提前加载的后续曲目数量）
+PREFETCH_TRACK_COUNT = 1
+
+# 音频分析配置（波形与响度）
+ANALYSIS_MAX_WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))
+ANALYSIS_SAMPLE_RATE = 8000
+WAVEFORM_POINTS = 800
+LOUDNESS_TARGET = -16.0  # 目标响度（LUFS）
+
+# 转码配置（生成响度标准化的压缩版本，需要ffmpeg）
+TRANSCODE_ENABLED = True
+TRANSCODE_FORMAT = 'mp3'  # 'mp3'、'aac' 或 'opus'
+TRANSCODE_BITRATE = '160k'
+TRANSCODE_WORKERS = 1
+
+# 媒体流配置
+MEDIA_FD_CACHE_SIZE = 32  # 缓存的文件描述符数量
+MEDIA_CHUNK_SIZE = 256 * 1024  # 不支持零拷贝时每次读取的字节数
+MEDIA_BANDWIDTH_CLIENTS = 256  # 按客户端统计流量时最多保留的客户端数（最久没有请求的先淘汰）
+
+# 曲库导入配置（命令行工具 library.py 与批量上传接口）
+LIBRARY_WORKERS = min(8, (os.cpu_count() or 2) * 2)  # 并行读取时长、计算摘要和复制文件的线程数
+LIBRARY_COVER_NAMES = ['cover', 'folder', 'front', 'album']  # 目录中作为整张专辑封面的文件名
+# 批量上传接口只允许导入这些目录下的服务器端目录；默认为空（关闭服务器端目录导入），
+# 用 PYER_IMPORT_ROOTS 指定（多个目录用系统路径分隔符分开，如 /srv/music:/home/teacher/Music）
+IMPORT_DIRECTORY_ROOTS = [Path(root) for root in os.environ.get('PYER_IMPORT_ROOTS', '').split(os.pathsep) if root]
+
+# 搜索配置
+SEARCH_INDEX_LYRICS = True  # 是否索引歌词文本
+SEARCH_FRAGMENT_LENGTH = 4  # 中文按片段索引的最大长度，更长的查询拆成多个片段同时匹配
+SEARCH_MAX_LIMIT = 100  # 每页最多返回的结果数
+
+# 列表接口配置（/api/library/tracks、/api/library/slides）
+LIST_PAGE_SIZE = 50  # 默认每页条数
+LIST_MAX_LIMIT = 500  # 每页最多返回的条数
+
+# 多进程配置（SERVER_WORKERS > 1 时通过 Unix Socket 总线共享状态）
+SERVER_WORKERS = 1
+BUS_BACKEND = 'local'  # 'local' 或 'unix'
+BUS_SOCKET_PATH = str(Path(tempfile.gettempdir()) / f"pyer-bus-{SERVER_PORT}.sock")
+
+# 卡顿诊断配置
+LOOP_STALL_THRESHOLD = 0.5  # 事件循环卡住超过该秒数时记录调用栈
+LOOP_STALL_HISTORY = 50  # 保留的卡顿记录条数
+PROFILER_MAX_SECONDS = 60  # 单次采样的最长时间
+
+# 房间配置（同一进程内同时控制多个会场）
+DEFAULT_ROOM = 'main'
+
+# 播放状态检查点配置（重启后恢复播放）
+CHECKPOINT_DEBOUNCE = 0.25  # 状态变化后合并这么多秒内的修改再写入
+CHECKPOINT_COMPACT_BYTES = 256 * 1024  # 检查点文件超过该大小时压缩为每个房间一行
+
+# 离线缓存配置（显示端演出前把媒体文件下载到本地）
+OFFLINE_CACHE_RATE = 4 * 1024 * 1024  # 显示端后台下载限速（字节/秒），0 表示不限速
+OFFLINE_MANIFEST_HISTORY = 8  # 保留的清单版本数，客户端已有的版本还在其中时只返回差异
+
+# 中继配置（分会场的边缘服务器镜像主服务器的播放状态，媒体文件只从主服务器拉取一次）
+RELAY_UPSTREAM = os.environ.get('PYER_RELAY_UPSTREAM', '')  # 主服务器地址，如 http://192.168.1.10:2427；为空时作为主服务器运行
+RELAY_RECONNECT_MAX = 5.0  # 上游连接断开后重连的最长间隔（秒）
+RELAY_TIMEOUT = 30  # 连接主服务器和下载文件的超时（秒）
+
+# 热备配置（主服务器死机时由热备接管，客户端按服务器列表切换）
+STANDBY_OF = os.environ.get('PYER_STANDBY_OF', '')  # 作为热备运行时填主服务器地址，如 http://192.168.1.10:2427
+FAILOVER_ENDPOINTS = [url for url in os.environ.get('PYER_ENDPOINTS', '').split(',') if url]  # 客户端依次尝试的服务器地址（主服务器在前）
+HEARTBEAT_INTERVAL = 0.5  # 向热备和客户端发送心跳的间隔（秒）
+FAILOVER_TIMEOUT = 2.0  # 超过这么久没有收到消息就认为主服务器已停止（秒）
+REPLICA_QUEUE_LIMIT = 10000  # 每个热备待发送的消息上限，超过时断开让热备重新同步快照
+
+# 送达确认配置（关键命令需要显示端确认，超时重发）
+ACK_COMMANDS = {"track_change", "play", "pause", "seek", "switch_to_music", "switch_to_slide", "slide_change", "cue"}
+ACK_DEADLINE = 1.0  # 超过这么久没有确认就重发（秒）
+ACK_RETRIES = 3  # 重发次数，之后仍没有确认记为丢失
+ACK_SAMPLE_WINDOW = 100  # 每个显示端保留的最近确认数（用于计算延迟分位数和丢失率）
+ACK_LAG_THRESHOLD = 0.25  # 往返延迟 P95 超过这个值（秒）时在管理端标记为滞后
+ACK_CLIENT_TTL = 600  # 断开超过这么久（秒）没有重连的显示端不再保留统计
+
+# 演出流程配置（服务器按提示列表自动切换曲目和幻灯片）
+CUE_LEAD_TIME = 2.0  # 提前多久把提示和开始时间下发给显示端（秒），显示端据此预加载并按时执行
+CUE_MANUAL_LEAD = 0.3  # 手动开始或继续时的提前量（秒），给显示端留出收到提示的时间
+TIMELINE_MAX_CUES = 500  # 每个房间提示列表的长度上限
+
+# 上传文件回收配置（增量标记-清除，演出中也可以在后台运行）
+GC_INTERVAL = 600  # 后台回收的间隔（秒），0 表示只在手动触发时回收
+GC_GRACE_PERIOD = 900  # 文件连续这么久没有被引用才会删除（秒），覆盖上传、批量导入和转码中文件已写入、记录还没保存的时间
+GC_SCAN_BATCH = 200  # 扫描上传目录时每检查这么多个文件让出一次事件循环
+GC_SWEEP_BATCH = 20  # 每批删除的文件数（每批持有一次数据库锁并重新确认引用）
+GC_SWEEP_INTERVAL = 0.5  # 两批删除之间的间隔（秒），限制删除对磁盘的压力
@@ -0,0 +1,177 @@
+"""
+显示端送达确认
+
+广播给显示端的关键命令（ACK_COMMANDS：切歌、播放、暂停、跳转、切换模式和幻灯片）带上 "ack": true。
+支持确认的显示端（连接时带 ?ack=1&client=显示端ID）应用命令后回复
+    {"type": "ack", "data": {"seq": 序号, "received": 收到时间, "applied": 应用完成时间}}
+两个时间是客户端时钟的毫秒数。事件日志的序号就是命令ID：同一房间的显示端收到的同一条命令序号相同。
+
+服务器按显示端统计：
+- 往返延迟：发出到收到确认（服务器时钟，从第一次发出算起）
+- 应用耗时：客户端两个时间之差
+- 重发次数和丢失率：超过 ACK_DEADLINE 没有确认的命令原样重发，重发 ACK_RETRIES 次后仍没有确认记为丢失
+连接断开时未确认的命令不计为丢失（重连时由会话恢复补发）。断开超过 ACK_CLIENT_TTL 秒没有重连的显示端删除统计。
+"""
+
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple, Union
+
+from config import ACK_CLIENT_TTL, ACK_DEADLINE, ACK_LAG_THRESHOLD, ACK_RETRIES, ACK_SAMPLE_WINDOW
+from wire import ClientConnection
+
+
+def percentile(samples, fraction: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class PendingCommand:
+    __slots__ = ("frame", "sent_at", "last_sent", "attempts")
+
+    def __init__(self, frame: Union[str, bytes], now: float):
+        self.frame = frame
+        self.sent_at = now
+        self.last_sent = now
+        self.attempts = 0
+
+
+class ClientStats:
+    """一个显示端（按显示端ID，重连后继续累计）的送达统计"""
+
+    def __init__(self, client_id: str):
+        self.client_id = client_id
+        self.connected = True
+        self.disconnected_at: Optional[float] = None  # 最后一个连接断开的时间（monotonic）
+        self.sent = 0
+        self.acked = 0
+        self.retransmits = 0
+        self.dropped = 0
+        self.last_ack: Optional[float] = None
+        self.rtt: Deque[float] = deque(maxlen=ACK_SAMPLE_WINDOW)
+        self.apply: Deque[float] = deque(maxlen=ACK_SAMPLE_WINDOW)
+        # 最近的命令是否送达（True 确认，False 丢失），用于计算丢失率
+        self.outcomes: Deque[bool] = deque(maxlen=ACK_SAMPLE_WINDOW)
+
+    def summary(self, oldest_pending: Optional[float]) -> dict:
+        rtt_p95 = percentile(self.rtt, 0.95)
+        drop_rate = self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+        return {
+            "client_id": self.client_id,
+            "connected": self.connected,
+            "sent": self.sent,
+            "acked": self.acked,
+            "retransmits": self.retransmits,
+            "dropped": self.dropped,
+            "drop_rate": round(drop_rate, 3),
+            "rtt_ms": round(self.rtt[-1] * 1000, 1) if self.rtt else None,
+            "rtt_p95_ms": round(rtt_p95 * 1000, 1) if rtt_p95 is not None else None,
+            "apply_p95_ms": round(percentile(self.apply, 0.95), 1) if self.apply else None,
+            "pending_ms": round(oldest_pending * 1000) if oldest_pending is not None else None,
+            "last_ack": self.last_ack,
+            "lagging": self.connected and (
+                (rtt_p95 is not None and rtt_p95 > ACK_LAG_THRESHOLD) or drop_rate > 0
+                or (oldest_pending is not None and oldest_pending > ACK_DEADLINE)),
+        }
+
+
+class DeliveryTracker:
+    """一个房间的显示端送达确认：未确认的命令、超时重发和各显示端的统计"""
+
+    def __init__(self):
+        self.pending: Dict[ClientConnection, Dict[int, PendingCommand]] = {}
+        self.connections: Dict[ClientConnection, ClientStats] = {}
+        self.clients: Dict[str, ClientStats] = {}
+
+    def register(self, connection: ClientConnection, client_id: str):
+        stats = self.clients.get(client_id)
+        if stats is None:
+            stats = self.clients[client_id] = ClientStats(client_id)
+        stats.connected = True
+        stats.disconnected_at = None
+        self.connections[connection] = stats
+        self.pending[connection] = {}
+
+    def unregister(self, connection: ClientConnection):
+        self.pending.pop(connection, None)
+        stats = self.connections.pop(connection, None)
+        if stats is not None and stats not in self.connections.values():
+            stats.connected = False
+            stats.disconnected_at = time.monotonic()
+
+    def prune(self, now: float):
+        """删除断开超过 ACK_CLIENT_TTL 秒的显示端统计"""
+        expired = [client_id for client_id, stats in self.clients.items()
+                   if not stats.connected and now - stats.disconnected_at > ACK_CLIENT_TTL]
+        for client_id in expired:
+            del self.clients[client_id]
+
+    def sent(self, connection: ClientConnection, seq: int, frame: Union[str, bytes]):
+        """记录发给支持确认的连接的关键命令"""
+        pending = self.pending.get(connection)
+        if pending is None:
+            return
+        pending[seq] = PendingCommand(frame, time.monotonic())
+        self.connections[connection].sent += 1
+
+    def acknowledge(self, connection: ClientConnection, data: dict) -> Optional[float]:
+        """处理确认，返回往返延迟（秒）；重复的确认（重发后两次都送到了）返回None"""
+        pending = self.pending.get(connection)
+        if pending is None:
+            return None
+        try:
+            command = pending.pop(int(data.get("seq")), None)
+        except (TypeError, ValueError):
+            return None
+        if command is None:
+            return None
+
+        stats = self.connections[connection]
+        rtt = time.monotonic() - command.sent_at
+        stats.acked += 1
+        stats.last_ack = time.time()
+        stats.rtt.append(rtt)
+        stats.outcomes.append(True)
+        try:
+            stats.apply.append(max(0.0, float(data["applied"]) - float(data["received"])))
+        except (KeyError, TypeError, ValueError):
+            pass
+        return rtt
+
+    def overdue(self) -> Tuple[List[Tuple[ClientConnection, Union[str, bytes]]], int]:
+        """超时未确认的命令：返回需要重发的 (连接, 帧) 和这次记为丢失的数量"""
+        now = time.monotonic()
+        self.prune(now)
+        resend = []
+        dropped = 0
+        for connection, pending in self.pending.items():
+            stats = self.connections[connection]
+            for seq, command in list(pending.items()):
+                if now - command.last_sent < ACK_DEADLINE:
+                    continue
+                if command.attempts >= ACK_RETRIES:
+                    del pending[seq]
+                    stats.dropped += 1
+                    stats.outcomes.append(False)
+                    dropped += 1
+                    continue
+                command.attempts += 1
+                command.last_sent = now
+                stats.retransmits += 1
+                resend.append((connection, command.frame))
+        return resend, dropped
+
+    def summary(self) -> List[dict]:
+        """各显示端的统计（滞后的排在前面）"""
+        now = time.monotonic()
+        oldest: Dict[str, float] = {}
+        for connection, pending in self.pending.items():
+            if pending:
+                client_id = self.connections[connection].client_id
+                age = now - min(command.sent_at for command in pending.values())
+                oldest[client_id] = max(age, oldest.get(client_id, 0.0))
+        summaries = [stats.summary(oldest.get(client_id)) for client_id, stats in self.clients.items()]
+        summaries.sort(key=lambda item: (not item["lagging"], not item["connected"], item["client_id"]))
+        return summaries
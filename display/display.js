@@ -33,13 +33,28 @@ document.addEventListener('DOMContentLoaded', function() {
     let isConnected = false;
     let ws = null;
     let reconnectAttempts = 0;
-    const maxReconnectAttempts = 5;
+    // 会话恢复：重连时带上令牌和最后收到的序号，服务器只补发断线期间的消息
+    let resumeToken = null;
+    let lastSeq = null;
+    const clientId = getClientId();
+    const roomName = new URLSearchParams(window.location.search).get('room') || '';
+    // 热备切换：服务器列表来自 /api/endpoints，连不上或心跳超时时换下一个
+    let endpoints = [];
+    let endpointIndex = -1;
+    let serverBase = '';       // 当前服务器地址，与页面同源时为空
+    let heartbeatTimeout = 0;  // 超过这么久没有收到任何消息就认为服务器已停止（毫秒），0 表示不检测
+    let lastMessageAt = 0;
+    // 演出流程：提示带有服务器时钟的开始时间，按估计的时钟差换算成本地时间后执行
+    let clockOffset = 0;         // 服务器时间 - 本地时间（毫秒）
+    const clockSamples = [];     // 最近几次时钟同步的 { offset, rtt }
+    let pendingCue = null;       // 等待开始的提示 { id, timer }
     
     // 音频相关
     let audio = new Audio();
     let isPlaying = false;
     let currentVolume = 0.8;
     let currentTrack = null;
+    let currentSourceUrl = null;  // 当前实际播放的音频地址（可能是转码版本）
     let audioEnabled = false;
     
     // 歌词相关
@@ -48,9 +63,44 @@ document.addEventListener('DOMContentLoaded', function() {
     let lyricScrollInterval = null;
     let updateInterval = null;
     
+    // 预取相关（服务器推送的后续曲目）
+    const prefetchedAudio = new Map();   // 音频URL -> 预加载的Audio元素
+    const prefetchedLyrics = new Map();  // 歌词URL -> 已解析歌词
+    const prefetchedCovers = new Map();  // 封面URL -> 预加载的Image
+    
+    // 离线缓存（Service Worker 在后台下载演出用到的所有文件）
+    let lastCacheReport = 0;
+    
     // 初始化
     init();
     
+    // 获取本显示端的唯一标识（保存在localStorage中，刷新后保持不变）
+    function getClientId() {
+        let id = null;
+        try {
+            id = localStorage.getItem('displayClientId');
+            if (!id) {
+                id = 'display-' + Math.random().toString(36).slice(2, 10);
+                localStorage.setItem('displayClientId', id);
+            }
+        } catch (e) {
+            id = id || 'display-' + Math.random().toString(36).slice(2, 10);
+        }
+        return id;
+    }
+    
+    // 将上传文件地址转换为支持Range请求的媒体流地址
+    function mediaUrl(url) {
+        if (!url || !url.startsWith('/uploads/')) return resolveUrl(url);
+        return resolveUrl(`/media/${url.slice('/uploads/'.length)}?client=${encodeURIComponent(clientId)}`);
+    }
+    
+    // 切换到其他服务器后，文件地址要加上服务器地址
+    function resolveUrl(url) {
+        if (!serverBase || !url || !url.startsWith('/')) return url;
+        return serverBase + url;
+    }
+    
     function init() {
         // 添加音频启用覆盖层
         createAudioEnableOverlay();
@@ -60,6 +110,11 @@ document.addEventListener('DOMContentLoaded', function() {
         
         // 连接WebSocket
         connectWebSocket();
+        loadEndpoints();
+        setInterval(() => syncClock(1), 30000);
+        
+        // 注册离线缓存
+        initOfflineCache();
         
         // 初始化歌词显示
         initLyricDisplay();
@@ -90,10 +145,10 @@ document.addEventListener('DOMContentLoaded', function() {
         // 发送时间更新到服务器
         if (isConnected && ws && ws.readyState === WebSocket.OPEN) {
             try {
-                ws.send(JSON.stringify({
+                PyerWire.send(ws, {
                     type: 'time_update',
                     data: { time: audio.currentTime }
-                }));
+                });
             } catch (e) {
                 console.error('发送时间更新失败:', e);
             }
@@ -166,8 +221,16 @@ document.addEventListener('DOMContentLoaded', function() {
         audio.volume = currentVolume;
         audio.preload = 'metadata';
         
+        bindAudioEvents(audio);
+        
+        // 开始更新循环
+        startUpdateInterval();
+    }
+    
+    // 绑定音频元素事件（切换到预取的音频元素时需要重新绑定）
+    function bindAudioEvents(target) {
         // 监听音频事件
-        audio.addEventListener('loadedmetadata', function() {
+        target.addEventListener('loadedmetadata', function() {
             updateDurationDisplay();
             if (isPlaying && audioEnabled) {
                 audio.play().catch(e => {
@@ -179,50 +242,47 @@ document.addEventListener('DOMContentLoaded', function() {
             }
         });
         
-        audio.addEventListener('timeupdate', function() {
+        target.addEventListener('timeupdate', function() {
             updateProgress();
             updateLyricDisplay(audio.currentTime);
             
             // 发送时间更新到服务器
             if (isConnected && ws && ws.readyState === WebSocket.OPEN) {
                 try {
-                    ws.send(JSON.stringify({
+                    PyerWire.send(ws, {
                         type: 'time_update',
                         data: { time: audio.currentTime }
-                    }));
+                    });
                 } catch (e) {
                     console.error('发送时间更新失败:', e);
                 }
             }
         });
         
-        audio.addEventListener('play', function() {
+        target.addEventListener('play', function() {
             isPlaying = true;
             updatePlayPauseButton();
             albumCover.classList.add('playing');
             startLyricScroll();
         });
         
-        audio.addEventListener('pause', function() {
+        target.addEventListener('pause', function() {
             isPlaying = false;
             updatePlayPauseButton();
             albumCover.classList.remove('playing');
             stopLyricScroll();
         });
         
-        audio.addEventListener('ended', function() {
+        target.addEventListener('ended', function() {
             isPlaying = false;
             updatePlayPauseButton();
             albumCover.classList.remove('playing');
             stopLyricScroll();
         });
         
-        audio.addEventListener('error', function(e) {
+        target.addEventListener('error', function(e) {
             console.error('音频播放错误:', e);
         });
-        
-        // 开始更新循环
-        startUpdateInterval();
     }
     
 
@@ -262,10 +322,21 @@ document.addEventListener('DOMContentLoaded', function() {
     // 设置音量 - 只响应服务器命令
     function setVolume(volume) {
         currentVolume = Math.max(0, Math.min(1, volume));
-        audio.volume = currentVolume;
+        applyVolume();
         volumeFilled.style.width = `${currentVolume * 100}%`;
     }
     
+    // 应用音量（叠加服务器分析得到的响度增益）
+    function applyVolume() {
+        let gain = 1;
+        // 转码版本已经做过响度标准化，不再叠加增益
+        const normalized = currentTrack && currentTrack.stream_url && currentSourceUrl === mediaUrl(currentTrack.stream_url);
+        if (currentTrack && !normalized && typeof currentTrack.gain_db === 'number') {
+            gain = Math.pow(10, currentTrack.gain_db / 20);
+        }
+        audio.volume = Math.max(0, Math.min(1, currentVolume * gain));
+    }
+    
     // 更新播放/暂停按钮
     function updatePlayPauseButton() {
         const icon = playPauseBtn.querySelector('i');
@@ -314,40 +385,53 @@ document.addEventListener('DOMContentLoaded', function() {
     
     // 连接WebSocket
     function connectWebSocket() {
-        const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-        const wsUrl = `${protocol}//${window.location.host}/ws/display`;
+        const params = new URLSearchParams();
+        if (roomName) params.set('room', roomName);
+        // 关键命令应用后回复确认，管理端可以看到每个显示端的延迟和丢失
+        params.set('client', clientId);
+        params.set('ack', '1');
+        if (resumeToken && lastSeq !== null) {
+            params.set('resume', resumeToken);
+            params.set('seq', lastSeq);
+        }
+        const query = params.toString();
+        const server = serverBase ? new URL(serverBase) : window.location;
+        const protocol = server.protocol === 'https:' ? 'wss:' : 'ws:';
+        const wsUrl = `${protocol}//${server.host}/ws/display${query ? '?' + query : ''}`;
         
-        ws = new WebSocket(wsUrl);
+        ws = PyerWire.connect(wsUrl);
+        lastMessageAt = Date.now();
+        let opened = false;
         
         ws.onopen = function() {
+            opened = true;
             isConnected = true;
             updateConnectionStatus(true);
             reconnectAttempts = 0;
-            console.log('显示端WebSocket连接已建立');
+            console.log(`显示端WebSocket连接已建立 (${PyerWire.isBinary(ws) ? '二进制' : 'JSON'})`);
+            syncClock(5);
         };
         
         ws.onmessage = function(event) {
+            const received = Date.now();
+            lastMessageAt = received;
             try {
-                const data = JSON.parse(event.data);
+                const data = PyerWire.parse(event);
+                if (data.ack && typeof data.seq === 'number' && lastSeq !== null && data.seq <= lastSeq) {
+                    // 服务器没收到确认而重发的命令，已经应用过，只需要再确认一次
+                    acknowledge(data.seq, received);
+                    return;
+                }
                 handleWebSocketMessage(data);
+                if (data.ack) acknowledge(data.seq, received);
             } catch (e) {
-                console.error('解析WebSocket消息失败:', e);
+                console.error('处理WebSocket消息失败:', e);
             }
         };
         
         ws.onclose = function() {
-            isConnected = false;
-            updateConnectionStatus(false);
             console.log('显示端WebSocket连接已关闭');
-            
-            // 尝试重新连接
-            if (reconnectAttempts < maxReconnectAttempts) {
-                reconnectAttempts++;
-                setTimeout(() => {
-                    console.log(`尝试重新连接 (${reconnectAttempts}/${maxReconnectAttempts})`);
-                    connectWebSocket();
-                }, 3000);
-            }
+            scheduleReconnect(!opened);
         };
         
         ws.onerror = function(error) {
@@ -355,6 +439,120 @@ document.addEventListener('DOMContentLoaded', function() {
         };
     }
     
+    // 时钟同步：发送本地时间，服务器带回并加上服务器时间；取往返时间最短的一次估计时钟差
+    function syncClock(count) {
+        for (let i = 0; i < count; i++) {
+            setTimeout(() => {
+                if (ws && ws.readyState === WebSocket.OPEN) {
+                    PyerWire.send(ws, { type: 'clock_sync', data: { client: Date.now() } });
+                }
+            }, i * 200);
+        }
+    }
+    
+    function handleClockSync(data) {
+        if (!data || typeof data.client !== 'number') return;
+        const now = Date.now();
+        clockSamples.push({ offset: data.server - (data.client + now) / 2, rtt: now - data.client });
+        if (clockSamples.length > 8) clockSamples.shift();
+        clockOffset = clockSamples.reduce((best, sample) => sample.rtt < best.rtt ? sample : best).offset;
+    }
+    
+    function serverNow() {
+        return Date.now() + clockOffset;
+    }
+    
+    // 演出流程的提示：提前收到，预加载后在开始时间执行；迟到时从应有的进度开始
+    function scheduleCue(data) {
+        if (data.cancel) {
+            if (pendingCue && pendingCue.id === data.id) {
+                clearTimeout(pendingCue.timer);
+                pendingCue = null;
+            }
+            return;
+        }
+        if (pendingCue) clearTimeout(pendingCue.timer);
+        pendingCue = null;
+        
+        const command = data.command;
+        if (command.type === 'switch_to_music' && command.data.track) {
+            const track = command.data.track;
+            preloadAudio(mediaUrl(track.stream_url || track.url));
+        }
+        
+        const run = () => {
+            pendingCue = null;
+            const late = (serverNow() - data.at) / 1000;
+            if (command.type === 'switch_to_music' && late > 0.05) {
+                switchToMusicMode({ ...command.data, current_time: late });
+            } else {
+                handleWebSocketMessage(command);
+            }
+            console.log(`执行提示 ${data.index + 1}（${late >= 0 ? '晚' : '早'} ${Math.abs(late * 1000).toFixed(0)} ms）`);
+        };
+        const delay = data.at - serverNow();
+        if (delay <= 0) {
+            run();
+        } else {
+            pendingCue = { id: data.id, timer: setTimeout(run, delay) };
+        }
+    }
+    
+    function acknowledge(seq, received) {
+        if (!ws || ws.readyState !== WebSocket.OPEN) return;
+        PyerWire.send(ws, { type: 'ack', data: { seq, received, applied: Date.now() } });
+    }
+    
+    function scheduleReconnect(failed) {
+        isConnected = false;
+        ws = null;
+        updateConnectionStatus(false);
+        
+        // 连不上或心跳中断时换下一个服务器，正常断开时先重连原来的服务器恢复会话
+        if (failed && endpoints.length) switchEndpoint();
+        
+        // 尝试重新连接：第一次几乎立即重连（短暂断网时可以直接恢复会话），之后逐渐拉长间隔
+        const delay = Math.min(5000, 250 * Math.pow(2, reconnectAttempts));
+        reconnectAttempts++;
+        setTimeout(() => {
+            console.log(`尝试重新连接 (第${reconnectAttempts}次)`);
+            connectWebSocket();
+        }, delay);
+    }
+    
+    // 获取服务器列表（服务器没有配置时为空，只重连当前服务器）
+    function loadEndpoints() {
+        fetch('/api/endpoints')
+            .then(response => response.json())
+            .then(data => {
+                if (!data.endpoints || !data.endpoints.length) return;
+                endpoints = data.endpoints.map(url => url.replace(/\/+$/, ''));
+                endpointIndex = endpoints.indexOf(serverBase || window.location.origin);
+                heartbeatTimeout = data.failover_timeout * 1000;
+                setInterval(checkHeartbeat, data.heartbeat_interval * 1000);
+            })
+            .catch(error => console.error('获取服务器列表失败:', error));
+    }
+    
+    function switchEndpoint() {
+        endpointIndex = (endpointIndex + 1) % endpoints.length;
+        const next = endpoints[endpointIndex];
+        serverBase = next === window.location.origin ? '' : next;
+        console.log(`切换到服务器 ${next}`);
+    }
+    
+    // 服务器定时发送心跳；超时没有收到任何消息（包括还没连上）时放弃当前连接
+    function checkHeartbeat() {
+        if (!ws || !heartbeatTimeout || Date.now() - lastMessageAt < heartbeatTimeout) return;
+        console.warn('服务器心跳超时');
+        const stale = ws;
+        stale.onopen = stale.onmessage = stale.onclose = stale.onerror = null;
+        try {
+            stale.close();
+        } catch (e) {}
+        scheduleReconnect(true);
+    }
+    
     // 更新连接状态显示
     function updateConnectionStatus(connected) {
         if (connected) {
@@ -372,9 +570,21 @@ document.addEventListener('DOMContentLoaded', function() {
     
     // 处理WebSocket消息
     function handleWebSocketMessage(data) {
+        if (data.type === 'heartbeat') return;
+        if (data.type === 'clock_sync') {
+            handleClockSync(data.data);
+            return;
+        }
         console.log('收到命令:', data.type);
         
         switch (data.type) {
+            case 'session':
+                // 没能恢复时服务器随后会发送完整状态，序号从当前位置开始
+                resumeToken = data.data.token;
+                if (!data.data.resumed) lastSeq = data.data.seq;
+                console.log(data.data.resumed ? `会话已恢复，补发 ${data.data.replayed} 条消息` : '新会话');
+                break;
+                
             case 'music_state':
                 showMusicMode(data.data);
                 break;
@@ -414,7 +624,22 @@ document.addEventListener('DOMContentLoaded', function() {
             case 'volume':
                 setVolumeFromServer(data.data);
                 break;
+                
+            case 'cue':
+                scheduleCue(data.data);
+                break;
+                
+            case 'prefetch':
+                handlePrefetch(data.data);
+                requestCacheSync();
+                break;
+                
+            case 'track_update':
+                updateTrackInfo(data.data);
+                break;
         }
+        // 应用完才推进序号：处理出错的命令没有确认，服务器重发时会重新应用
+        if (typeof data.seq === 'number') lastSeq = data.seq;
     }
     
     // 显示音乐模式
@@ -452,9 +677,10 @@ document.addEventListener('DOMContentLoaded', function() {
         if (track) {
             // 保存当前曲目
             currentTrack = track;
+            const sourceUrl = mediaUrl(track.stream_url || track.url);
             
             // 更新封面和背景
-            const coverUrl = track.cover_url || '/uploads/covers/default-cover.jpg';
+            const coverUrl = resolveUrl(track.cover_url || '/uploads/covers/default-cover.jpg');
             coverImage.src = coverUrl;
             backgroundOverlay.style.backgroundImage = `url(${coverUrl})`;
             
@@ -463,28 +689,38 @@ document.addEventListener('DOMContentLoaded', function() {
             trackArtist.textContent = track.artist || '未知艺术家';
             
             // 检查是否需要切换歌曲
-            const needSwitch = !audio.src || audio.src !== track.url;
+            const needSwitch = !audio.src || audio.src !== sourceUrl;
             
             if (needSwitch) {
                 // 暂停当前播放
                 pause();
                 
-                // 切换音频源
-                audio.src = track.url;
+                // 切换音频源（优先使用已预取的音频元素）
+                if (prefetchedAudio.has(sourceUrl)) {
+                    swapToPrefetchedAudio(sourceUrl);
+                } else {
+                    audio.src = sourceUrl;
+                }
+                currentSourceUrl = sourceUrl;
                 
                 // 重置进度
                 progressFilled.style.width = '0%';
                 currentTimeDisplay.textContent = '0:00';
                 durationDisplay.textContent = '0:00';
+                updateDurationDisplay();  // 预取的音频可能已加载元数据
                 
                 // 加载歌词
-                if (track.lyrics_url) {
+                if (track.lyrics_url && prefetchedLyrics.has(track.lyrics_url)) {
+                    applyParsedLyrics(prefetchedLyrics.get(track.lyrics_url));
+                } else if (track.lyrics_url) {
                     loadLyrics(track.lyrics_url);
                 } else {
                     clearLyrics();
                 }
             }
             
+            applyVolume();
+            
             // 设置播放状态
             if (shouldPlay) {
                 if (audioEnabled) {
@@ -545,7 +781,7 @@ document.addEventListener('DOMContentLoaded', function() {
         const slide = data.slide;
         
         if (slide) {
-            slideFrame.src = slide.url;
+            slideFrame.src = resolveUrl(slide.url);
         }
     }
     
@@ -567,6 +803,14 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
     
+    // 曲目信息更新（例如后台分析完成后带来的响度增益）
+    function updateTrackInfo(data) {
+        if (data && data.track && currentTrack && currentTrack.id === data.track.id) {
+            currentTrack = data.track;
+            applyVolume();
+        }
+    }
+    
     // 播放音乐（来自服务器命令）
     function playMusic(data) {
         if (currentMode === 'music') {
@@ -604,6 +848,112 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
     
+    function preloadAudio(audioUrl) {
+        if (prefetchedAudio.has(audioUrl) || currentSourceUrl === audioUrl) return;
+        const element = new Audio();
+        element.preload = 'auto';
+        element.src = audioUrl;
+        element.load();
+        prefetchedAudio.set(audioUrl, element);
+    }
+    
+    // 处理预取清单：在当前曲目播放时提前加载后续曲目的音频、封面和歌词
+    function handlePrefetch(data) {
+        if (!data || !Array.isArray(data.tracks)) return;
+        
+        const wantedUrls = new Set();
+        data.tracks.forEach(item => {
+            if (!item || !item.url) return;
+            const audioUrl = mediaUrl(item.url);
+            wantedUrls.add(audioUrl);
+            
+            preloadAudio(audioUrl);
+            
+            if (item.cover_url && !prefetchedCovers.has(item.cover_url)) {
+                const img = new Image();
+                img.src = resolveUrl(item.cover_url);
+                prefetchedCovers.set(item.cover_url, img);
+            }
+            
+            if (item.lyrics_url && Array.isArray(item.lyrics)) {
+                prefetchedLyrics.set(item.lyrics_url, item.lyrics);
+            }
+        });
+        
+        // 释放不再需要的预取音频，避免占用带宽和内存
+        prefetchedAudio.forEach((preloadAudio, url) => {
+            if (!wantedUrls.has(url)) {
+                preloadAudio.removeAttribute('src');
+                preloadAudio.load();
+                prefetchedAudio.delete(url);
+            }
+        });
+        
+        if (prefetchedCovers.size > 20) prefetchedCovers.clear();
+        if (prefetchedLyrics.size > 20) prefetchedLyrics.clear();
+    }
+    
+    // 注册离线缓存的 Service Worker，下载进度转发给管理端
+    function initOfflineCache() {
+        if (!('serviceWorker' in navigator)) return;
+        navigator.serviceWorker.register('/sw.js')
+            .then(() => requestCacheSync())
+            .catch(error => console.error('注册离线缓存失败:', error));
+        navigator.serviceWorker.addEventListener('message', event => {
+            if (event.data && event.data.type === 'cache_progress') {
+                reportCacheProgress(event.data.data);
+            }
+        });
+    }
+    
+    // 让 Service Worker 按最新的清单同步（清单没变时只是一次304请求）
+    function requestCacheSync() {
+        if (!('serviceWorker' in navigator)) return;
+        navigator.serviceWorker.ready.then(registration => {
+            if (registration.active) registration.active.postMessage({ type: 'sync' });
+        });
+    }
+    
+    function reportCacheProgress(progress) {
+        // 下载过程中每秒最多上报一次，完成和出错时立即上报
+        const finished = progress.total === undefined || progress.cached >= progress.total;
+        const now = Date.now();
+        if (!finished && now - lastCacheReport < 1000) return;
+        lastCacheReport = now;
+        if (isConnected && ws && ws.readyState === WebSocket.OPEN) {
+            try {
+                PyerWire.send(ws, {
+                    type: 'cache_progress',
+                    data: { ...progress, client_id: clientId }
+                });
+            } catch (e) {
+                console.error('发送缓存进度失败:', e);
+            }
+        }
+    }
+    
+    // 切换到预取的音频元素，省去重新建立连接和缓冲的时间
+    function swapToPrefetchedAudio(url) {
+        const nextAudio = prefetchedAudio.get(url);
+        prefetchedAudio.delete(url);
+        
+        audio.pause();
+        audio.removeAttribute('src');
+        audio.load();
+        
+        audio = nextAudio;
+        applyVolume();
+        bindAudioEvents(audio);
+    }
+    
+    // 使用服务器已解析的歌词
+    function applyParsedLyrics(lines) {
+        lyricsData = lines.map(line => ({ time: line.time, text: line.text }));
+        currentLyricIndex = -1;
+        updateLyricLines();
+        updateLyricDisplay(0);
+    }
+    
     // 初始化歌词显示
     function initLyricDisplay() {
         lyricContainer.innerHTML = `
@@ -662,7 +1012,7 @@ document.addEventListener('DOMContentLoaded', function() {
         
         const filename = match[1];
         
-        fetch(`/api/lyrics/${filename}`)
+        fetch(resolveUrl(`/api/lyrics/${filename}`))
             .then(response => {
                 if (!response.ok) {
                     throw new Error('获取歌词失败');
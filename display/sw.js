@@ -0,0 +1,192 @@
+// 显示端离线缓存 Service Worker
+// 按服务器的离线清单（/api/offline/manifest）在后台限速下载音频、封面、歌词和幻灯片，
+// 演出时对这些地址的请求直接从本地缓存返回（音频的Range请求在缓存中切片），不依赖网络。
+
+const CACHE_NAME = 'pyer-offline-v1';
+const STATE_KEY = '/__pyer_offline_state__';  // 缓存中保存同步状态的键
+const HASH_HEADER = 'X-Pyer-Hash';
+
+let state = null;        // { version, entries: { 缓存URL: 清单条目 } }
+let syncing = null;      // 正在进行的同步
+let syncAgain = false;   // 同步期间又收到了同步请求
+let listedPaths = null;  // 清单中文件的路径（切换到热备服务器后，对其他地址的请求也从缓存返回）
+
+self.addEventListener('install', () => self.skipWaiting());
+self.addEventListener('activate', event => event.waitUntil(self.clients.claim()));
+
+self.addEventListener('message', event => {
+    if (event.data && event.data.type === 'sync') {
+        event.waitUntil(requestSync());
+    }
+});
+
+self.addEventListener('fetch', event => {
+    const request = event.request;
+    if (request.method !== 'GET') return;
+    const key = cacheKey(request.url);
+    if (key && (new URL(request.url).origin === self.location.origin || isListed(key))) {
+        event.respondWith(fromCache(request, key));
+    }
+});
+
+// 请求地址 -> 缓存键：/media/<路径> 与 /uploads/<路径> 是同一个文件，查询参数（显示端ID）和服务器地址忽略
+function cacheKey(url) {
+    const parsed = new URL(url);
+    if (parsed.pathname.startsWith('/media/')) return '/uploads/' + parsed.pathname.slice('/media/'.length);
+    if (parsed.pathname.startsWith('/uploads/') || parsed.pathname.startsWith('/api/lyrics/')) return parsed.pathname;
+    return null;
+}
+
+function isListed(key) {
+    if (!state) return false;
+    if (!listedPaths) {
+        listedPaths = new Set(Object.keys(state.entries).map(url => new URL(url, self.location.origin).pathname));
+    }
+    return listedPaths.has(key);
+}
+
+async function fromCache(request, key) {
+    const cache = await caches.open(CACHE_NAME);
+    const cached = await cache.match(key);
+    if (!cached) return fetch(request);
+    const range = request.headers.get('range');
+    return range ? rangeResponse(cached, range) : cached;
+}
+
+async function rangeResponse(response, range) {
+    const blob = await response.blob();
+    const size = blob.size;
+    const match = /^bytes=(\d*)-(\d*)$/.exec(range.trim());
+    let start = 0;
+    let end = size - 1;
+    if (match && match[1] !== '') {
+        start = parseInt(match[1], 10);
+        if (match[2] !== '') end = Math.min(parseInt(match[2], 10), size - 1);
+    } else if (match && match[2] !== '') {
+        start = Math.max(0, size - parseInt(match[2], 10));
+    }
+    if (!match || start > end) {
+        return new Response(null, { status: 416, headers: { 'Content-Range': `bytes */${size}` } });
+    }
+    return new Response(blob.slice(start, end + 1), {
+        status: 206,
+        headers: {
+            'Content-Type': response.headers.get('Content-Type') || 'application/octet-stream',
+            'Content-Length': String(end - start + 1),
+            'Content-Range': `bytes ${start}-${end}/${size}`,
+            'Accept-Ranges': 'bytes'
+        }
+    });
+}
+
+function requestSync() {
+    if (syncing) {
+        syncAgain = true;
+        return syncing;
+    }
+    syncing = (async () => {
+        try {
+            do {
+                syncAgain = false;
+                await sync();
+            } while (syncAgain);
+        } catch (e) {
+            await report({ error: String(e && e.message || e) });
+        } finally {
+            syncing = null;
+        }
+    })();
+    return syncing;
+}
+
+async function loadState(cache) {
+    if (state) return state;
+    const saved = await cache.match(STATE_KEY);
+    state = saved ? await saved.json() : { version: null, entries: {} };
+    return state;
+}
+
+async function saveState(cache) {
+    listedPaths = null;
+    await cache.put(STATE_KEY, new Response(JSON.stringify(state), {
+        headers: { 'Content-Type': 'application/json' }
+    }));
+}
+
+async function sync() {
+    const cache = await caches.open(CACHE_NAME);
+    await loadState(cache);
+
+    // 带上已有的版本，服务器只返回变化的条目（清单没变时浏览器按ETag得到304）
+    const query = state.version ? `?since=${encodeURIComponent(state.version)}` : '';
+    const response = await fetch(`/api/offline/manifest${query}`, { cache: 'no-cache' });
+    if (!response.ok) throw new Error(`获取离线清单失败: ${response.status}`);
+    const manifest = await response.json();
+
+    if (manifest.full) state.entries = {};
+    for (const url of manifest.removed) delete state.entries[url];
+    for (const entry of manifest.entries) state.entries[entry.url] = entry;
+    state.version = manifest.version;
+    await saveState(cache);
+
+    // 删除清单中已经没有的文件（缓存中的地址是编码过的，比较前统一编码）
+    const wanted = new Set(Object.keys(state.entries).map(url => new URL(url, self.location.origin).pathname));
+    wanted.add(STATE_KEY);
+    for (const request of await cache.keys()) {
+        if (!wanted.has(new URL(request.url).pathname)) await cache.delete(request);
+    }
+
+    await download(cache, manifest.rate_limit || 0);
+}
+
+async function download(cache, rateLimit) {
+    const entries = Object.values(state.entries);
+    const progress = {
+        version: state.version,
+        cached: 0,
+        total: entries.length,
+        cached_bytes: 0,
+        total_bytes: entries.reduce((sum, entry) => sum + entry.size, 0)
+    };
+    const started = Date.now();
+    let downloaded = 0;
+
+    for (const entry of entries) {
+        if (syncAgain) return;  // 清单又变了，重新开始
+        const cached = await cache.match(entry.url);
+        if (!cached || cached.headers.get(HASH_HEADER) !== entry.hash) {
+            let blob;
+            try {
+                const response = await fetch(entry.url, { cache: 'no-store' });
+                if (!response.ok) throw new Error(`HTTP ${response.status}`);
+                blob = await response.blob();
+                await cache.put(entry.url, new Response(blob, {
+                    headers: {
+                        'Content-Type': response.headers.get('Content-Type') || 'application/octet-stream',
+                        [HASH_HEADER]: entry.hash
+                    }
+                }));
+            } catch (e) {
+                // 单个文件失败不影响其他文件，下次同步时重试
+                progress.error = `下载失败 ${entry.url}: ${e.message || e}`;
+                continue;
+            }
+            downloaded += blob.size;
+
+            // 限速：下载得比设定速率快时等待，避免和演出中的其他流量抢带宽
+            if (rateLimit > 0) {
+                const ahead = downloaded / rateLimit * 1000 - (Date.now() - started);
+                if (ahead > 0) await new Promise(resolve => setTimeout(resolve, ahead));
+            }
+        }
+        progress.cached++;
+        progress.cached_bytes += entry.size;
+        await report(progress);
+    }
+    await report(progress);
+}
+
+async function report(progress) {
+    const clients = await self.clients.matchAll({ type: 'window' });
+    clients.forEach(client => client.postMessage({ type: 'cache_progress', data: progress }));
+}
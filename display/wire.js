@@ -0,0 +1,245 @@
+// WebSocket 消息编码（与服务端 wire.py 对应）
+// 协商到子协议 pyer.msgpack.v1 时使用 MessagePack 二进制帧，否则使用 JSON
+(function(global) {
+    const SUBPROTOCOL = 'pyer.msgpack.v1';
+
+    // 消息类型编号，必须与 wire.py 中的 MESSAGE_TYPES 保持一致
+    const MESSAGE_TYPES = [
+        'state_update', 'playlist_update', 'slides_update', 'track_update',
+        'music_state', 'slide_state', 'switch_to_music', 'switch_to_slide',
+        'track_change', 'slide_change', 'play', 'pause', 'seek', 'volume', 'prefetch',
+        'time_update',
+        'play_music', 'pause_music', 'next_track', 'prev_track', 'select_track',
+        'seek_music', 'set_volume', 'switch_mode', 'select_slide',
+        'playlist_delta', 'session', 'cache_progress', 'cache_status',
+        'heartbeat', 'ack', 'cue', 'clock_sync', 'timeline',
+        'set_timeline', 'start_timeline', 'stop_timeline', 'timeline_next',
+        'move_track', 'move_slide', 'queue_track', 'dequeue_track', 'clear_queue', 'set_shuffle'
+    ];
+    const TYPE_CODES = {};
+    MESSAGE_TYPES.forEach((name, index) => { TYPE_CODES[name] = index + 1; });
+
+    const textEncoder = new TextEncoder();
+    const textDecoder = new TextDecoder();
+
+    // ---------- 编码 ----------
+    function pack(value) {
+        const bytes = [];
+        packValue(value, bytes);
+        return new Uint8Array(bytes);
+    }
+
+    function pushUint(bytes, value, size) {
+        for (let shift = (size - 1) * 8; shift >= 0; shift -= 8) {
+            bytes.push(Math.floor(value / Math.pow(2, shift)) & 0xff);
+        }
+    }
+
+    function packLength(bytes, size, fix, fixMax, codes) {
+        if (fix !== null && size <= fixMax) {
+            bytes.push(fix | size);
+        } else if (codes[0] !== null && size < 0x100) {
+            bytes.push(codes[0], size);
+        } else if (size < 0x10000) {
+            bytes.push(codes[1]);
+            pushUint(bytes, size, 2);
+        } else {
+            bytes.push(codes[2]);
+            pushUint(bytes, size, 4);
+        }
+    }
+
+    function packValue(value, bytes) {
+        if (value === null || value === undefined) {
+            bytes.push(0xc0);
+        } else if (value === true) {
+            bytes.push(0xc3);
+        } else if (value === false) {
+            bytes.push(0xc2);
+        } else if (typeof value === 'number') {
+            if (Number.isInteger(value) && value >= -0x80000000 && value < 0x100000000) {
+                if (value >= 0 && value < 0x80) {
+                    bytes.push(value);
+                } else if (value < 0 && value >= -32) {
+                    bytes.push(value & 0xff);
+                } else if (value >= 0) {
+                    if (value < 0x100) { bytes.push(0xcc, value); }
+                    else if (value < 0x10000) { bytes.push(0xcd); pushUint(bytes, value, 2); }
+                    else { bytes.push(0xce); pushUint(bytes, value, 4); }
+                } else if (value >= -0x80) {
+                    bytes.push(0xd0, value & 0xff);
+                } else if (value >= -0x8000) {
+                    bytes.push(0xd1);
+                    pushUint(bytes, value & 0xffff, 2);
+                } else {
+                    bytes.push(0xd2);
+                    pushUint(bytes, value >>> 0, 4);
+                }
+            } else {
+                const buffer = new DataView(new ArrayBuffer(8));
+                buffer.setFloat64(0, value);
+                bytes.push(0xcb);
+                for (let i = 0; i < 8; i++) bytes.push(buffer.getUint8(i));
+            }
+        } else if (typeof value === 'string') {
+            const data = textEncoder.encode(value);
+            packLength(bytes, data.length, 0xa0, 31, [0xd9, 0xda, 0xdb]);
+            for (let i = 0; i < data.length; i++) bytes.push(data[i]);
+        } else if (value instanceof Uint8Array) {
+            packLength(bytes, value.length, null, 0, [0xc4, 0xc5, 0xc6]);
+            for (let i = 0; i < value.length; i++) bytes.push(value[i]);
+        } else if (Array.isArray(value)) {
+            packLength(bytes, value.length, 0x90, 15, [null, 0xdc, 0xdd]);
+            value.forEach(item => packValue(item, bytes));
+        } else if (typeof value === 'object') {
+            const keys = Object.keys(value).filter(key => value[key] !== undefined);
+            packLength(bytes, keys.length, 0x80, 15, [null, 0xde, 0xdf]);
+            keys.forEach(key => {
+                packValue(key, bytes);
+                packValue(value[key], bytes);
+            });
+        } else {
+            throw new Error('无法编码的类型: ' + typeof value);
+        }
+    }
+
+    // ---------- 解码 ----------
+    function unpack(buffer) {
+        const view = new DataView(buffer instanceof ArrayBuffer ? buffer : buffer.buffer,
+                                  buffer.byteOffset || 0, buffer.byteLength);
+        const state = { offset: 0 };
+        const value = unpackValue(view, state);
+        if (state.offset !== view.byteLength) {
+            throw new Error('消息末尾有多余数据');
+        }
+        return value;
+    }
+
+    function readBytes(view, state, size) {
+        if (state.offset + size > view.byteLength) throw new Error('消息被截断');
+        const bytes = new Uint8Array(view.buffer, view.byteOffset + state.offset, size);
+        state.offset += size;
+        return bytes;
+    }
+
+    function readNumber(view, state, method, size) {
+        if (state.offset + size > view.byteLength) throw new Error('消息被截断');
+        const value = view[method](state.offset);
+        state.offset += size;
+        return typeof value === 'bigint' ? Number(value) : value;
+    }
+
+    function unpackArray(view, state, size) {
+        const items = new Array(size);
+        for (let i = 0; i < size; i++) items[i] = unpackValue(view, state);
+        return items;
+    }
+
+    function unpackMap(view, state, size) {
+        const result = {};
+        for (let i = 0; i < size; i++) {
+            const key = unpackValue(view, state);
+            result[key] = unpackValue(view, state);
+        }
+        return result;
+    }
+
+    function unpackValue(view, state) {
+        const head = readNumber(view, state, 'getUint8', 1);
+        if (head < 0x80) return head;
+        if (head >= 0xe0) return head - 0x100;
+        if (head >= 0xa0 && head <= 0xbf) return textDecoder.decode(readBytes(view, state, head & 0x1f));
+        if (head >= 0x90 && head <= 0x9f) return unpackArray(view, state, head & 0x0f);
+        if (head >= 0x80 && head <= 0x8f) return unpackMap(view, state, head & 0x0f);
+
+        switch (head) {
+            case 0xc0: return null;
+            case 0xc2: return false;
+            case 0xc3: return true;
+            case 0xca: return readNumber(view, state, 'getFloat32', 4);
+            case 0xcb: return readNumber(view, state, 'getFloat64', 8);
+            case 0xcc: return readNumber(view, state, 'getUint8', 1);
+            case 0xcd: return readNumber(view, state, 'getUint16', 2);
+            case 0xce: return readNumber(view, state, 'getUint32', 4);
+            case 0xcf: return readNumber(view, state, 'getBigUint64', 8);
+            case 0xd0: return readNumber(view, state, 'getInt8', 1);
+            case 0xd1: return readNumber(view, state, 'getInt16', 2);
+            case 0xd2: return readNumber(view, state, 'getInt32', 4);
+            case 0xd3: return readNumber(view, state, 'getBigInt64', 8);
+            case 0xd9: return textDecoder.decode(readBytes(view, state, readNumber(view, state, 'getUint8', 1)));
+            case 0xda: return textDecoder.decode(readBytes(view, state, readNumber(view, state, 'getUint16', 2)));
+            case 0xdb: return textDecoder.decode(readBytes(view, state, readNumber(view, state, 'getUint32', 4)));
+            case 0xc4: return readBytes(view, state, readNumber(view, state, 'getUint8', 1)).slice();
+            case 0xc5: return readBytes(view, state, readNumber(view, state, 'getUint16', 2)).slice();
+            case 0xc6: return readBytes(view, state, readNumber(view, state, 'getUint32', 4)).slice();
+            case 0xdc: return unpackArray(view, state, readNumber(view, state, 'getUint16', 2));
+            case 0xdd: return unpackArray(view, state, readNumber(view, state, 'getUint32', 4));
+            case 0xde: return unpackMap(view, state, readNumber(view, state, 'getUint16', 2));
+            case 0xdf: return unpackMap(view, state, readNumber(view, state, 'getUint32', 4));
+        }
+        throw new Error('不支持的MessagePack类型: 0x' + head.toString(16));
+    }
+
+    // ---------- 消息 ----------
+    function encodeMessage(message) {
+        const envelope = [TYPE_CODES[message.type] || message.type, message.data === undefined ? null : message.data];
+        const extra = {};
+        let hasExtra = false;
+        Object.keys(message).forEach(key => {
+            if (key !== 'type' && key !== 'data') {
+                extra[key] = message[key];
+                hasExtra = true;
+            }
+        });
+        if (hasExtra) envelope.push(extra);
+        return pack(envelope);
+    }
+
+    function decodeMessage(buffer) {
+        const envelope = unpack(buffer);
+        if (!Array.isArray(envelope) || envelope.length === 0) {
+            throw new Error('二进制消息格式错误');
+        }
+        const code = envelope[0];
+        const message = {
+            type: typeof code === 'number' ? MESSAGE_TYPES[code - 1] : code,
+            data: envelope.length > 1 ? envelope[1] : null
+        };
+        if (envelope.length > 2 && envelope[2] && typeof envelope[2] === 'object') {
+            Object.assign(message, envelope[2]);
+        }
+        return message;
+    }
+
+    // 创建WebSocket：请求二进制子协议，服务端不支持时自动回退到JSON
+    function connect(url) {
+        const socket = new WebSocket(url, [SUBPROTOCOL]);
+        socket.binaryType = 'arraybuffer';
+        return socket;
+    }
+
+    function isBinary(socket) {
+        return socket.protocol === SUBPROTOCOL;
+    }
+
+    function send(socket, message) {
+        socket.send(isBinary(socket) ? encodeMessage(message) : JSON.stringify(message));
+    }
+
+    function parse(event) {
+        return typeof event.data === 'string' ? JSON.parse(event.data) : decodeMessage(event.data);
+    }
+
+    global.PyerWire = {
+        SUBPROTOCOL,
+        MESSAGE_TYPES,
+        pack,
+        unpack,
+        encodeMessage,
+        decodeMessage,
+        connect,
+        isBinary,
+        send,
+        parse
+    };
+})(window);
@@ -0,0 +1,237 @@
+"""
+批量导入音乐
+
+命令行曲库工具（library.py import）和服务器的批量上传接口共用：
+1. 收集音频文件（扫描目录，或接收上传的文件到暂存目录），按内容摘要跳过重复的文件
+2. 按文件名匹配同名的封面和歌词（找不到封面时使用目录中的 cover.jpg / folder.jpg 等）
+3. 在线程池中并行读取时长、标签，并复制到暂存目录
+4. 调用方在持久化事务中调用 commit，把文件移动到上传目录并生成曲目记录
+"""
+
+import os
+import uuid
+import shutil
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterable, List, Optional, Set, Tuple
+
+from config import UPLOAD_FOLDER, ALLOWED_EXTENSIONS, DEFAULT_COVER_URL, LIBRARY_WORKERS, LIBRARY_COVER_NAMES
+from media import probe_duration, read_tags, file_digest, url_to_path
+from persistence import persistence_manager
+
+logger = logging.getLogger(__name__)
+
+# 导入时先放到这里，登记记录时再移动到正式目录（清理孤立文件不会扫描这个目录）
+STAGING_DIR = UPLOAD_FOLDER / ".staging"
+
+
+@dataclass
+class ImportItem:
+    source: Path
+    digest: str
+    music_name: str
+    cover: Optional[Tuple[Path, str]] = None
+    lyrics: Optional[Tuple[Path, str]] = None
+    title: str = ""
+    artist: str = ""
+    duration: int = 0
+
+
+def has_extension(path: Path, file_type: str) -> bool:
+    return path.suffix[1:].lower() in ALLOWED_EXTENSIONS[file_type]
+
+
+def parallel_map(func, items: Iterable, jobs: int) -> List:
+    items = list(items)
+    if jobs <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(func, items))
+
+
+def staged_name(source: Path) -> str:
+    """与网页上传相同的命名方式"""
+    return f"{uuid.uuid4().hex[:8]}_{source.name}"
+
+
+def scan_directory(directory: Path, recursive: bool) -> List[Path]:
+    pattern = "**/*" if recursive else "*"
+    return sorted(path for path in directory.glob(pattern)
+                  if path.is_file() and has_extension(path, "music") and not path.name.startswith("."))
+
+
+def find_sidecar(source: Path, file_type: str) -> Optional[Path]:
+    """同名的封面或歌词文件；封面找不到时使用目录中的 cover.jpg / folder.jpg 等"""
+    candidates = [path for path in source.parent.glob(f"{source.stem}.*")
+                  if path != source and has_extension(path, file_type)]
+    if not candidates and file_type == "covers":
+        candidates = [path for path in source.parent.iterdir()
+                      if path.stem.lower() in LIBRARY_COVER_NAMES and has_extension(path, "covers")]
+    return sorted(candidates)[0] if candidates else None
+
+
+def guess_title(source: Path) -> Tuple[str, str]:
+    """从 “艺术家 - 标题” 形式的文件名猜测标题和艺术家"""
+    stem = source.stem
+    if " - " in stem:
+        artist, title = stem.split(" - ", 1)
+        return title.strip(), artist.strip()
+    return stem, ""
+
+
+def library_digests(jobs: int = LIBRARY_WORKERS) -> Dict[str, str]:
+    """曲库中每首音乐的内容摘要（ID -> SHA-1），记录里没有的现场计算"""
+    digests = {}
+    pending = []
+    for track in list(persistence_manager.music_database):
+        if track.get('sha1'):
+            digests[track['id']] = track['sha1']
+        else:
+            path = url_to_path(track.get('url'))
+            if path is not None and path.is_file():
+                pending.append((track['id'], path))
+
+    def compute(entry):
+        track_id, path = entry
+        try:
+            return track_id, file_digest(path)
+        except OSError as e:
+            logger.warning(f"计算摘要失败 {path}: {e}")
+            return track_id, None
+
+    for track_id, digest in parallel_map(compute, pending, jobs):
+        if digest:
+            digests[track_id] = digest
+    return digests
+
+
+def store_digests(digests: Dict[str, str]):
+    """把现场计算的摘要写回记录（需在事务中调用），下次不用再算"""
+    for track in persistence_manager.music_database:
+        digest = digests.get(track.get('id'))
+        if digest and not track.get('sha1'):
+            track['sha1'] = digest
+
+
+def present_digests() -> Set[str]:
+    """数据库中已登记的摘要（需在事务中调用）"""
+    return {track['sha1'] for track in persistence_manager.music_database if track.get('sha1')}
+
+
+class ImportBatch:
+    """一次批量导入，暂存目录中的文件直接移动，其他位置的文件复制"""
+
+    def __init__(self, jobs: int = LIBRARY_WORKERS, skip_duplicates: bool = True):
+        self.jobs = max(1, jobs)
+        self.skip_duplicates = skip_duplicates
+        self.staging = STAGING_DIR / uuid.uuid4().hex[:12]
+        self.sources: List[Path] = []
+        self.items: List[ImportItem] = []
+        self.skipped: List[Path] = []
+        self.aux_names: Dict[Path, str] = {}
+
+    def add_directory(self, directory: Path, recursive: bool = False) -> int:
+        sources = scan_directory(directory, recursive)
+        self.sources.extend(sources)
+        return len(sources)
+
+    def receive(self, filename: str, fileobj: BinaryIO) -> Optional[Path]:
+        """保存一个上传的文件（文件名可以带相对目录，用于匹配同一文件夹的封面），不支持的类型返回None"""
+        parts = [part for part in Path(filename.replace("\\", "/")).parts if part not in ("", ".", "..", "/")]
+        if not parts:
+            return None
+        path = self.staging / "incoming" / Path(*parts)
+        if not any(has_extension(path, file_type) for file_type in ("music", "covers", "lyrics")):
+            return None
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as f:
+            shutil.copyfileobj(fileobj, f, 1024 * 1024)
+        if has_extension(path, "music"):
+            self.sources.append(path)
+        return path
+
+    def plan(self, known_digests: Set[str]):
+        """并行计算摘要，跳过已知的和本批次中重复的文件，并匹配封面和歌词"""
+        known = set(known_digests) if self.skip_duplicates else set()
+        for source, digest in zip(self.sources, parallel_map(file_digest, self.sources, self.jobs)):
+            if digest in known:
+                self.skipped.append(source)
+                continue
+            if self.skip_duplicates:
+                known.add(digest)
+            self.items.append(ImportItem(source=source, digest=digest, music_name=staged_name(source)))
+
+        # 同一个封面或歌词文件只保存一次（整张专辑共用的封面）
+        for item in self.items:
+            cover = find_sidecar(item.source, "covers")
+            if cover is not None:
+                item.cover = (cover, self.aux_names.setdefault(cover, staged_name(cover)))
+            lyrics = find_sidecar(item.source, "lyrics")
+            if lyrics is not None:
+                item.lyrics = (lyrics, self.aux_names.setdefault(lyrics, staged_name(lyrics)))
+
+    def transfer(self, source: Path, target: Path):
+        if self.staging in source.parents:
+            os.replace(source, target)
+        else:
+            shutil.copyfile(source, target)
+
+    def prepare(self):
+        """并行读取时长、标签，并把文件放到暂存目录"""
+        for subdir in ("music", "covers", "lyrics"):
+            (self.staging / subdir).mkdir(parents=True, exist_ok=True)
+
+        def prepare_item(item: ImportItem) -> ImportItem:
+            item.duration = probe_duration(item.source)
+            tags = read_tags(item.source)
+            title, artist = guess_title(item.source)
+            item.title = tags.get("title") or title
+            item.artist = tags.get("artist") or artist or "未知艺术家"
+            self.transfer(item.source, self.staging / "music" / item.music_name)
+            return item
+
+        def prepare_aux(entry: Tuple[Path, str]):
+            source, name = entry
+            subdir = "covers" if has_extension(source, "covers") else "lyrics"
+            self.transfer(source, self.staging / subdir / name)
+
+        parallel_map(prepare_aux, self.aux_names.items(), self.jobs)
+        parallel_map(prepare_item, self.items, self.jobs)
+
+    def commit(self, present: Set[str]) -> List[Dict]:
+        """把文件移动到上传目录并返回曲目记录（需在持久化事务中调用，present 为数据库中已有的摘要）"""
+        if self.skip_duplicates:
+            # 准备期间服务器或其他导入可能已经登记了相同的文件
+            self.skipped.extend(item.source for item in self.items if item.digest in present)
+            self.items = [item for item in self.items if item.digest not in present]
+
+        # 只移动登记的曲目用到的封面和歌词，跳过的曲目独用的留在暂存目录随 discard 删除
+        used = {"covers": {item.cover[1] for item in self.items if item.cover},
+                "lyrics": {item.lyrics[1] for item in self.items if item.lyrics}}
+        for subdir, names in used.items():
+            (UPLOAD_FOLDER / subdir).mkdir(parents=True, exist_ok=True)
+            for name in names:
+                os.replace(self.staging / subdir / name, UPLOAD_FOLDER / subdir / name)
+
+        (UPLOAD_FOLDER / "music").mkdir(parents=True, exist_ok=True)
+        records = []
+        for item in self.items:
+            os.replace(self.staging / "music" / item.music_name, UPLOAD_FOLDER / "music" / item.music_name)
+            records.append({
+                "id": uuid.uuid4().hex[:8],
+                "title": item.title,
+                "artist": item.artist,
+                "url": f"/uploads/music/{item.music_name}",
+                "cover_url": f"/uploads/covers/{item.cover[1]}" if item.cover else DEFAULT_COVER_URL,
+                "lyrics_url": f"/uploads/lyrics/{item.lyrics[1]}" if item.lyrics else None,
+                "duration": item.duration,
+                "sha1": item.digest,
+            })
+        return records
+
+    def discard(self):
+        """删除暂存目录（未登记的文件一起删除）"""
+        shutil.rmtree(self.staging, ignore_errors=True)
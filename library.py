@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+"""
+命令行曲库工具
+
+不导入服务器，直接操作持久化层和上传目录，服务器停止或运行时都可以使用：
+- 写数据库时与服务器共用跨进程锁，写入前先读入服务器的最新修改，不会互相覆盖
+- 耗时的摘要计算、时长读取和文件复制都在锁外并行完成，持锁时间只有登记记录的一瞬间
+- 修改完成后通知正在运行的服务器重新加载曲库（服务器未运行时跳过）
+
+用法:
+    python library.py import ~/Music/晚会 --recursive
+    python library.py verify
+    python library.py repair --drop-missing
+    python library.py dedupe --apply
+    python library.py export --format m3u -o 晚会.m3u
+    python library.py stats
+"""
+
+import sys
+import csv
+import json
+import logging
+import argparse
+import urllib.error
+import urllib.request
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# 添加当前目录到路径，以便导入模块
+sys.path.insert(0, str(Path(__file__).parent))
+
+from config import UPLOAD_FOLDER, DEFAULT_COVER_URL, SERVER_PORT, LIBRARY_WORKERS
+from media import probe_duration, url_to_path
+from persistence import persistence_manager
+from ingest import ImportBatch, parallel_map, library_digests, store_digests, present_digests
+
+logger = logging.getLogger("library")
+
+
+def format_duration(seconds: int) -> str:
+    hours, rest = divmod(int(seconds), 3600)
+    return f"{hours}:{rest // 60:02d}:{rest % 60:02d}"
+
+
+def format_size(size: int) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.1f} {unit}" if unit != "B" else f"{size} B"
+        size /= 1024
+
+
+def notify_server(args) -> None:
+    """通知正在运行的服务器重新加载曲库"""
+    if args.no_notify:
+        return
+    request = urllib.request.Request(f"{args.server.rstrip('/')}/api/maintenance/reload", data=b"", method="POST")
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            result = json.loads(response.read().decode("utf-8"))
+        print(f"服务器: {result.get('message')}")
+    except (urllib.error.URLError, OSError, ValueError):
+        print(f"未连接到服务器 {args.server}，服务器下次启动时会读取新的曲库")
+
+
+# ---------------------------------------------------------------- import
+
+def cmd_import(args) -> int:
+    directory = Path(args.directory).expanduser()
+    if not directory.is_dir():
+        print(f"目录不存在: {directory}")
+        return 2
+
+    batch = ImportBatch(jobs=args.jobs, skip_duplicates=not args.allow_duplicates)
+    if not batch.add_directory(directory, args.recursive):
+        print("没有找到支持的音频文件")
+        return 0
+    print(f"找到 {len(batch.sources)} 个音频文件，正在计算摘要...")
+
+    digests = library_digests(args.jobs) if batch.skip_duplicates else {}
+    batch.plan(set(digests.values()))
+    for source in batch.skipped:
+        logger.info(f"跳过重复文件: {source}")
+    if not batch.items:
+        print(f"全部 {len(batch.skipped)} 个文件已在曲库中")
+        return 0
+
+    if args.dry_run:
+        for item in batch.items:
+            print(f"将导入: {item.source}" + (f"（封面 {item.cover[0].name}）" if item.cover else "")
+                  + (f"（歌词 {item.lyrics[0].name}）" if item.lyrics else ""))
+        print(f"共 {len(batch.items)} 首，跳过重复 {len(batch.skipped)} 首（试运行，未做修改）")
+        return 0
+
+    try:
+        print(f"正在读取时长并复制 {len(batch.items)} 首音乐（{args.jobs} 线程）...")
+        batch.prepare()
+
+        # 持锁移动到正式目录并一次性登记
+        with persistence_manager.transaction():
+            store_digests(digests)
+            records = batch.commit(present_digests())
+            persistence_manager.add_music_tracks(records)
+    finally:
+        batch.discard()
+
+    total = sum(record["duration"] for record in records)
+    print(f"已导入 {len(records)} 首（总时长 {format_duration(total)}），跳过重复 {len(batch.skipped)} 首")
+    notify_server(args)
+    return 0
+
+
+# ---------------------------------------------------------------- verify
+
+def check_track(track: dict) -> List[str]:
+    """检查一条音乐记录，返回问题列表"""
+    problems = []
+    path = url_to_path(track.get('url'))
+    if path is None or not path.is_file():
+        problems.append(f"音乐文件不存在: {track.get('url')}")
+    elif path.stat().st_size == 0:
+        problems.append(f"音乐文件为空: {track.get('url')}")
+    if not track.get('duration') or track['duration'] <= 0:
+        problems.append("时长缺失")
+    for field, label in (("cover_url", "封面"), ("lyrics_url", "歌词"), ("stream_url", "转码版本")):
+        url = track.get(field)
+        # 默认封面由服务器启动时生成
+        if url and url != DEFAULT_COVER_URL and (url_to_path(url) is None or not url_to_path(url).is_file()):
+            problems.append(f"{label}文件不存在: {url}")
+    if track.get('waveform_url') and not persistence_manager.get_waveform_file(track['id']).is_file():
+        problems.append("波形数据不存在")
+    return problems
+
+
+def cmd_verify(args) -> int:
+    tracks = persistence_manager.music_database
+    slides = persistence_manager.slides_database
+    report = {"tracks": [], "slides": [], "duplicate_ids": [], "orphaned_files": []}
+
+    seen = set()
+    for track in tracks:
+        if track.get('id') in seen:
+            report["duplicate_ids"].append(track.get('id'))
+        seen.add(track.get('id'))
+        problems = check_track(track)
+        if problems:
+            report["tracks"].append({"id": track.get('id'), "title": track.get('title'), "problems": problems})
+    for slide in slides:
+        path = url_to_path(slide.get('url'))
+        if path is None or not path.is_file():
+            report["slides"].append({"id": slide.get('id'), "name": slide.get('name'),
+                                     "problems": [f"幻灯片文件不存在: {slide.get('url')}"]})
+    report["orphaned_files"] = [str(path.relative_to(UPLOAD_FOLDER)) for path in persistence_manager.find_orphaned_files()]
+
+    failed = bool(report["tracks"] or report["slides"] or report["duplicate_ids"])
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return 1 if failed else 0
+
+    for entry in report["tracks"] + report["slides"]:
+        print(f"[{entry['id']}] {entry.get('title') or entry.get('name')}")
+        for problem in entry["problems"]:
+            print(f"    - {problem}")
+    for track_id in report["duplicate_ids"]:
+        print(f"重复的ID: {track_id}")
+    print(f"检查了 {len(tracks)} 首音乐和 {len(slides)} 个幻灯片: "
+          f"{len(report['tracks'])} 首音乐、{len(report['slides'])} 个幻灯片有问题，"
+          f"{len(report['orphaned_files'])} 个孤立文件")
+    return 1 if failed else 0
+
+
+# ---------------------------------------------------------------- repair
+
+def plan_repair(track: dict, drop_missing: bool) -> Optional[dict]:
+    """计算一条记录需要的修复，返回 {"drop": True} / 需要更新的字段 / None"""
+    path = url_to_path(track.get('url'))
+    if path is None or not path.is_file():
+        return {"drop": True} if drop_missing else None
+
+    updates = {}
+    duration = probe_duration(path)
+    if duration > 0 and duration != track.get('duration', 0):
+        updates["duration"] = duration
+    cover = url_to_path(track.get('cover_url'))
+    if track.get('cover_url') != DEFAULT_COVER_URL and (cover is None or not cover.is_file()):
+        updates["cover_url"] = DEFAULT_COVER_URL
+    for field in ("lyrics_url", "stream_url"):
+        if track.get(field) and (url_to_path(track[field]) is None or not url_to_path(track[field]).is_file()):
+            updates[field] = None
+    if track.get('waveform_url') and not persistence_manager.get_waveform_file(track['id']).is_file():
+        # 清空后可以通过 /api/maintenance/analyze 重新分析
+        updates["waveform_url"] = None
+    return updates or None
+
+
+def cmd_repair(args) -> int:
+    tracks = list(persistence_manager.music_database)
+    print(f"正在检查 {len(tracks)} 首音乐（{args.jobs} 线程）...")
+    plans = parallel_map(lambda track: (track, plan_repair(track, args.drop_missing)), tracks, args.jobs)
+    plans = [(track, plan) for track, plan in plans if plan]
+
+    for track, plan in plans:
+        if plan.get("drop"):
+            print(f"删除记录: [{track['id']}] {track.get('title')}（音乐文件不存在）")
+        else:
+            changes = "，".join(f"{key}: {track.get(key)} -> {value}" for key, value in plan.items())
+            print(f"修复: [{track['id']}] {track.get('title')}: {changes}")
+
+    if not plans:
+        print("没有需要修复的记录")
+        return 0
+    if args.dry_run:
+        print(f"共 {len(plans)} 条记录需要修复（试运行，未做修改）")
+        return 0
+
+    with persistence_manager.transaction():
+        for track, plan in plans:
+            if plan.get("drop"):
+                persistence_manager.delete_music_track(track['id'], save=False)
+                persistence_manager.delete_waveform(track['id'])
+            else:
+                persistence_manager.update_music_track(track['id'], plan, save=False)
+        persistence_manager.save_database(persistence_manager.music_db_file, persistence_manager.music_database)
+
+    print(f"已修复 {len(plans)} 条记录")
+    notify_server(args)
+    return 0
+
+
+# ---------------------------------------------------------------- dedupe
+
+def cmd_dedupe(args) -> int:
+    digests = library_digests(args.jobs)
+    groups: Dict[str, List[dict]] = {}
+    for track in persistence_manager.music_database:
+        digest = digests.get(track.get('id'))
+        if digest:
+            groups.setdefault(digest, []).append(track)
+
+    duplicates = []
+    for group in groups.values():
+        if len(group) < 2:
+            continue
+        # 保留最早添加的一条
+        keep, *extra = sorted(group, key=lambda track: track.get('created_at', ''))
+        print(f"保留: [{keep['id']}] {keep.get('title')}")
+        for track in extra:
+            print(f"    重复: [{track['id']}] {track.get('title')}")
+        duplicates.extend(extra)
+
+    if not duplicates:
+        print("没有重复的音乐")
+        return 0
+    if not args.apply:
+        print(f"共 {len(duplicates)} 首重复（使用 --apply 删除）")
+        return 0
+
+    with persistence_manager.transaction():
+        store_digests(digests)
+        for track in duplicates:
+            persistence_manager.delete_music_track(track['id'], save=False)
+            persistence_manager.delete_waveform(track['id'])
+
+        # 删除不再被任何记录引用的文件
+        referenced = persistence_manager.referenced_files()
+        removed_files = 0
+        for track in duplicates:
+            for field in ("url", "cover_url", "lyrics_url", "stream_url"):
+                url = track.get(field)
+                path = url_to_path(url)
+                if url and url != DEFAULT_COVER_URL and url not in referenced and path is not None and path.is_file():
+                    path.unlink()
+                    referenced.add(url)
+                    removed_files += 1
+        persistence_manager.save_database(persistence_manager.music_db_file, persistence_manager.music_database)
+
+    print(f"已删除 {len(duplicates)} 首重复的音乐和 {removed_files} 个文件")
+    notify_server(args)
+    return 0
+
+
+# ---------------------------------------------------------------- export
+
+EXPORT_FIELDS = ["id", "title", "artist", "duration", "url", "cover_url", "lyrics_url", "stream_url", "created_at"]
+
+
+def cmd_export(args) -> int:
+    # 按播放列表顺序导出（还没有位置键的旧记录排在最后）
+    tracks = sorted(persistence_manager.music_database, key=lambda track: track.get('position') or '\uffff')
+    output = open(args.output, "w", encoding="utf-8", newline="") if args.output else sys.stdout
+    try:
+        if args.format == "json":
+            json.dump(tracks, output, ensure_ascii=False, indent=2)
+            output.write("\n")
+        elif args.format == "csv":
+            writer = csv.DictWriter(output, fieldnames=EXPORT_FIELDS + ["path"], extrasaction="ignore")
+            writer.writeheader()
+            for track in tracks:
+                path = url_to_path(track.get('url'))
+                writer.writerow({**track, "path": str(path) if path else ""})
+        else:
+            # M3U 使用本地绝对路径，服务器出问题时可以直接用播放器播放
+            output.write("#EXTM3U\n")
+            for track in tracks:
+                path = url_to_path(track.get('url'))
+                if path is None:
+                    continue
+                output.write(f"#EXTINF:{track.get('duration', -1)},{track.get('artist', '')} - {track.get('title', '')}\n")
+                output.write(f"{path.resolve()}\n")
+    finally:
+        if args.output:
+            output.close()
+    if args.output:
+        print(f"已导出 {len(tracks)} 首音乐到 {args.output}")
+    return 0
+
+
+# ---------------------------------------------------------------- stats
+
+def directory_usage(directory: Path) -> Tuple[int, int]:
+    count = size = 0
+    if directory.exists():
+        for path in directory.iterdir():
+            if path.is_file():
+                count += 1
+                size += path.stat().st_size
+    return count, size
+
+
+def cmd_stats(args) -> int:
+    tracks = persistence_manager.music_database
+    music_size = 0
+    missing = 0
+    extensions: Dict[str, int] = {}
+    for track in tracks:
+        path = url_to_path(track.get('url'))
+        if path is None or not path.is_file():
+            missing += 1
+            continue
+        music_size += path.stat().st_size
+        ext = path.suffix[1:].lower()
+        extensions[ext] = extensions.get(ext, 0) + 1
+
+    orphaned = persistence_manager.find_orphaned_files()
+    stats = {
+        "tracks": len(tracks),
+        "total_duration": sum(track.get('duration', 0) or 0 for track in tracks),
+        "music_bytes": music_size,
+        "formats": dict(sorted(extensions.items())),
+        "with_lyrics": sum(1 for track in tracks if track.get('lyrics_url')),
+        "with_cover": sum(1 for track in tracks if track.get('cover_url') and track['cover_url'] != DEFAULT_COVER_URL),
+        "analyzed": sum(1 for track in tracks if track.get('waveform_url')),
+        "transcoded": sum(1 for track in tracks if track.get('stream_url')),
+        "missing_files": missing,
+        "slides": len(persistence_manager.slides_database),
+        "uploads": {subdir: dict(zip(("files", "bytes"), directory_usage(UPLOAD_FOLDER / subdir)))
+                    for subdir in ("music", "covers", "lyrics", "slides", "variants")},
+        "orphaned_files": len(orphaned),
+        "orphaned_bytes": sum(path.stat().st_size for path in orphaned),
+    }
+
+    if args.json:
+        print(json.dumps(stats, ensure_ascii=False, indent=2))
+        return 0
+
+    print(f"音乐: {stats['tracks']} 首，总时长 {format_duration(stats['total_duration'])}，"
+          f"文件 {format_size(stats['music_bytes'])}")
+    print("格式: " + ("，".join(f"{ext} {count}" for ext, count in stats['formats'].items()) or "无"))
+    print(f"有歌词 {stats['with_lyrics']}，有封面 {stats['with_cover']}，"
+          f"已分析 {stats['analyzed']}，已转码 {stats['transcoded']}，文件缺失 {stats['missing_files']}")
+    print(f"幻灯片: {stats['slides']} 个")
+    for subdir, usage in stats["uploads"].items():
+        print(f"  uploads/{subdir}: {usage['files']} 个文件，{format_size(usage['bytes'])}")
+    print(f"孤立文件: {stats['orphaned_files']} 个，{format_size(stats['orphaned_bytes'])}")
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="命令行曲库工具（服务器停止或运行时都可以使用）")
+    parser.add_argument("--server", default=f"http://127.0.0.1:{SERVER_PORT}", help="修改曲库后通知的服务器地址")
+    parser.add_argument("--no-notify", action="store_true", help="修改曲库后不通知服务器")
+    parser.add_argument("-j", "--jobs", type=int, default=LIBRARY_WORKERS, help="并行线程数")
+    parser.add_argument("-v", "--verbose", action="store_true", help="显示详细日志")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("import", help="批量导入目录中的音乐（同名的封面和歌词一起导入）")
+    command.add_argument("directory")
+    command.add_argument("-r", "--recursive", action="store_true", help="包含子目录")
+    command.add_argument("--allow-duplicates", action="store_true", help="不跳过曲库中已有的相同文件")
+    command.add_argument("--dry-run", action="store_true", help="只列出将要导入的文件")
+    command.set_defaults(handler=cmd_import)
+
+    command = commands.add_parser("verify", help="检查记录引用的文件是否存在")
+    command.add_argument("--json", action="store_true")
+    command.set_defaults(handler=cmd_verify)
+
+    command = commands.add_parser("repair", help="重新读取时长，清除指向缺失文件的引用")
+    command.add_argument("--drop-missing", action="store_true", help="删除音乐文件已不存在的记录")
+    command.add_argument("--dry-run", action="store_true", help="只列出需要修复的记录")
+    command.set_defaults(handler=cmd_repair)
+
+    command = commands.add_parser("dedupe", help="按文件内容查找重复的音乐")
+    command.add_argument("--apply", action="store_true", help="删除重复的记录和文件（默认只列出）")
+    command.set_defaults(handler=cmd_dedupe)
+
+    command = commands.add_parser("export", help="导出曲库")
+    command.add_argument("--format", choices=["json", "csv", "m3u"], default="json")
+    command.add_argument("-o", "--output", help="输出文件（默认输出到标准输出）")
+    command.set_defaults(handler=cmd_export)
+
+    command = commands.add_parser("stats", help="曲库统计")
+    command.add_argument("--json", action="store_true")
+    command.set_defaults(handler=cmd_stats)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    args.jobs = max(1, args.jobs)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, format="%(message)s")
+    if args.verbose:
+        logger.setLevel(logging.INFO)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""
+媒体文件工具：音频时长、标签、歌词文本、内容摘要
+
+只依赖配置和 mutagen，服务器、持久化层和命令行曲库工具共用，导入时没有副作用。
+"""
+
+import asyncio
+import hashlib
+import logging
+from pathlib import Path
+from typing import Dict, Optional
+
+from config import UPLOAD_FOLDER
+
+logger = logging.getLogger(__name__)
+
+# 常见音频格式的估算比特率（kbps），mutagen无法读取时用文件大小估算时长
+BITRATE_ESTIMATES = {
+    '.mp3': 128,      # MP3常见比特率
+    '.mp4': 128,      # MP4/AAC常见比特率
+    '.m4a': 128,
+    '.aac': 128,
+    '.flac': 1000,    # FLAC无损，比特率较高
+    '.wav': 1411,     # WAV CD质量
+    '.ogg': 160,      # OGG Vorbis
+    '.wma': 128,      # Windows Media Audio
+}
+
+DIGEST_CHUNK_SIZE = 1024 * 1024
+
+
+def probe_duration(file_path: Path) -> int:
+    """使用mutagen获取音频文件时长（阻塞调用）"""
+    try:
+        # 尝试使用mutagen直接打开文件（mutagen按需加载各格式模块）
+        import mutagen
+        audio = mutagen.File(str(file_path))
+
+        if audio is None:
+            logger.warning(f"mutagen无法识别文件格式: {file_path}")
+            return get_audio_duration_fallback(file_path)
+
+        # 获取时长（秒）
+        duration = audio.info.length
+
+        if duration <= 0:
+            logger.warning(f"音频时长异常: {duration} 秒, 文件: {file_path}")
+            return get_audio_duration_fallback(file_path)
+
+        # 确保返回整数秒
+        return int(duration)
+
+    except Exception as e:
+        logger.error(f"使用mutagen获取音频时长失败 {file_path}: {e}")
+        return get_audio_duration_fallback(file_path)
+
+
+async def get_audio_duration(file_path: Path) -> int:
+    """在线程中获取音频时长，避免阻塞事件循环"""
+    return await asyncio.to_thread(probe_duration, file_path)
+
+
+def get_audio_duration_fallback(file_path: Path) -> int:
+    """备用方法获取音频时长"""
+    try:
+        # 尝试使用文件信息估算
+        file_ext = file_path.suffix.lower()
+        file_size = file_path.stat().st_size
+
+        # 获取比特率估算值
+        bitrate = BITRATE_ESTIMATES.get(file_ext, 128)  # 默认128kbps
+
+        # 计算时长：文件大小(字节) / (比特率(kbps) * 1000 / 8)
+        # 比特率(kbps) = 千比特/秒，1字节=8比特
+        duration = file_size / (bitrate * 1000 / 8)
+
+        # 限制在合理范围内（10秒到30分钟）
+        return max(10, min(1800, int(duration)))
+    except Exception as e:
+        logger.error(f"备用方法获取时长也失败 {file_path}: {e}")
+        return 180  # 默认3分钟
+
+
+def read_tags(file_path: Path) -> Dict[str, str]:
+    """读取标题和艺术家标签，读取不到的字段不返回"""
+    tags = {}
+    try:
+        import mutagen
+        audio = mutagen.File(str(file_path), easy=True)
+        if audio is None or not audio.tags:
+            return tags
+        for key in ('title', 'artist'):
+            values = audio.tags.get(key)
+            if values and str(values[0]).strip():
+                tags[key] = str(values[0]).strip()
+    except Exception as e:
+        logger.debug(f"读取音频标签失败 {file_path}: {e}")
+    return tags
+
+
+def read_lyrics_text(lyrics_path: Path) -> str:
+    """读取歌词文件内容，先尝试UTF-8，失败后使用GBK"""
+    try:
+        with open(lyrics_path, 'r', encoding='utf-8') as f:
+            return f.read()
+    except UnicodeDecodeError:
+        with open(lyrics_path, 'r', encoding='gbk') as f:
+            return f.read()
+
+
+def file_digest(file_path: Path) -> str:
+    """文件内容的SHA-1摘要（用于查找重复文件）"""
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        while True:
+            chunk = f.read(DIGEST_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def url_to_path(url: Optional[str]) -> Optional[Path]:
+    """把 /uploads/... 形式的URL转换为本地路径，其他URL返回None"""
+    if not url or not url.startswith('/uploads/'):
+        return None
+    relative_path = url[len('/uploads/'):]
+    if not relative_path or '..' in Path(relative_path).parts:
+        return None
+    return UPLOAD_FOLDER / relative_path
@@ -0,0 +1,292 @@
+"""
+运行指标
+
+不依赖 prometheus_client 的简单指标注册表：
+- Counter / Gauge / Histogram，支持标签
+- /metrics 输出 Prometheus 文本格式，/api/metrics 输出 JSON 供管理端显示
+- 事件循环延迟监测
+"""
+
+import time
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 默认耗时分桶（秒）
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def format_labels(names: Sequence[str], values: LabelValues, extra: str = "") -> str:
+    parts = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{name}="{escaped}"')
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(labels)
+        self.lock = threading.Lock()
+
+    def key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()):
+        super().__init__(name, description, labels)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def expose(self) -> List[str]:
+        return self.header() + [f"{self.name}{format_labels(self.label_names, key)} {format_value(value)}"
+                                for key, value in sorted(self.values.items())]
+
+    def snapshot(self) -> List[Dict]:
+        return [{**dict(zip(self.label_names, key)), "value": value} for key, value in sorted(self.values.items())]
+
+
+class Gauge(Metric):
+    """仪表：可以直接设置，也可以注册回调在导出时取值"""
+    kind = "gauge"
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = (),
+                 callback: Optional[Callable[[], Dict[LabelValues, float]]] = None):
+        super().__init__(name, description, labels)
+        self.values: Dict[LabelValues, float] = {}
+        self.callback = callback
+
+    def set(self, value: float, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+    def collect(self) -> Dict[LabelValues, float]:
+        if self.callback is not None:
+            try:
+                return self.callback()
+            except Exception as e:
+                logger.error(f"采集指标失败 {self.name}: {e}")
+                return {}
+        return dict(self.values)
+
+    def expose(self) -> List[str]:
+        return self.header() + [f"{self.name}{format_labels(self.label_names, key)} {format_value(value)}"
+                                for key, value in sorted(self.collect().items())]
+
+    def snapshot(self) -> List[Dict]:
+        return [{**dict(zip(self.label_names, key)), "value": value} for key, value in sorted(self.collect().items())]
+
+
+class HistogramSeries:
+    def __init__(self, buckets: Sequence[float]):
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets))
+        self.series: Dict[LabelValues, HistogramSeries] = {}
+
+    def observe(self, value: float, **labels):
+        key = self.key(labels)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = HistogramSeries(self.buckets)
+            series.count += 1
+            series.sum += value
+            series.max = max(series.max, value)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series.bucket_counts[i] += 1
+                    break
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def quantile(self, series: HistogramSeries, q: float) -> float:
+        """根据分桶估算分位数（桶内线性插值）"""
+        if series.count == 0:
+            return 0.0
+        rank = q * series.count
+        cumulative = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets, series.bucket_counts):
+            if count and cumulative + count >= rank:
+                return min(series.max, lower + (bound - lower) * (rank - cumulative) / count)
+            cumulative += count
+            lower = bound
+        return series.max
+
+    def expose(self) -> List[str]:
+        lines = self.header()
+        for key, series in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series.bucket_counts):
+                cumulative += count
+                labels = format_labels(self.label_names, key, 'le="%s"' % format_value(bound))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = format_labels(self.label_names, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {series.count}")
+            lines.append(f"{self.name}_sum{format_labels(self.label_names, key)} {format_value(series.sum)}")
+            lines.append(f"{self.name}_count{format_labels(self.label_names, key)} {series.count}")
+        return lines
+
+    def snapshot(self) -> List[Dict]:
+        return [{
+            **dict(zip(self.label_names, key)),
+            "count": series.count,
+            "sum": series.sum,
+            "avg": series.sum / series.count if series.count else 0.0,
+            "p50": self.quantile(series, 0.5),
+            "p95": self.quantile(series, 0.95),
+            "p99": self.quantile(series, 0.99),
+            "max": series.max,
+        } for key, series in sorted(self.series.items())]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+        self.started_at = time.time()
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, description: str, labels: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, description, labels))
+
+    def gauge(self, name: str, description: str, labels: Sequence[str] = (), callback=None) -> Gauge:
+        return self.register(Gauge(name, description, labels, callback))
+
+    def histogram(self, name: str, description: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, description, labels, buckets))
+
+    def render_prometheus(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> Dict:
+        return {
+            "uptime": time.time() - self.started_at,
+            "metrics": {name: {"type": metric.kind, "values": metric.snapshot()}
+                        for name, metric in self.metrics.items()},
+        }
+
+
+class LoopLagMonitor:
+    """事件循环延迟监测：定时休眠，实际唤醒时间比预期晚多少就是延迟"""
+
+    def __init__(self, registry: MetricsRegistry, interval: float = 0.5):
+        self.interval = interval
+        self.task: Optional[asyncio.Task] = None
+        self.current = registry.gauge("pyer_event_loop_lag_seconds", "最近一次测得的事件循环延迟")
+        self.histogram = registry.histogram("pyer_event_loop_lag_seconds_hist", "事件循环延迟分布")
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self.current.set(lag)
+            self.histogram.observe(lag)
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+
+# 全局指标
+registry = MetricsRegistry()
+
+command_duration = registry.histogram(
+    "pyer_command_duration_seconds", "管理端命令处理耗时", ["command_type"])
+broadcast_duration = registry.histogram(
+    "pyer_broadcast_duration_seconds", "向本进程连接广播一条消息的耗时（含编码）", ["target"])
+encode_duration = registry.histogram(
+    "pyer_encode_duration_seconds", "消息序列化耗时", ["codec"])
+messages_sent = registry.counter(
+    "pyer_messages_sent_total", "发送的WebSocket消息数", ["target"])
+send_queue_dropped = registry.counter(
+    "pyer_send_queue_overflow_total", "发送队列溢出而断开的连接数", ["target"])
+upload_bytes = registry.counter(
+    "pyer_upload_bytes_total", "上传写入的字节数", ["subdir"])
+upload_duration = registry.histogram(
+    "pyer_upload_write_seconds", "上传文件写入耗时", ["subdir"])
+startup_duration = registry.gauge(
+    "pyer_startup_seconds", "启动各阶段耗时", ["phase"])
+session_resumes = registry.counter(
+    "pyer_session_resume_total", "连接时的会话恢复结果（replayed 补发缺少的消息，snapshot 发送完整状态）",
+    ["target", "result"])
+persistence_write_duration = registry.histogram(
+    "pyer_persistence_write_seconds", "数据库文件写入耗时", ["database"])
+relay_media_requests = registry.counter(
+    "pyer_relay_media_requests_total", "中继模式下媒体请求的本地缓存结果（hit 本地已有，fetched 从主服务器下载）", ["result"])
+relay_upstream_bytes = registry.counter(
+    "pyer_relay_upstream_bytes_total", "中继模式下从主服务器下载的媒体字节数")
+display_ack_latency = registry.histogram(
+    "pyer_display_ack_seconds", "关键命令从发出到收到显示端确认的时间", ["room"])
+display_retransmits = registry.counter(
+    "pyer_display_retransmits_total", "超时未确认而重发的关键命令数", ["room"])
+display_dropped = registry.counter(
+    "pyer_display_dropped_total", "重发后仍未确认、记为丢失的关键命令数", ["room"])
+upload_gc_reclaimed = registry.counter(
+    "pyer_upload_gc_reclaimed_total", "回收的上传文件数")
+upload_gc_reclaimed_bytes = registry.counter(
+    "pyer_upload_gc_reclaimed_bytes_total", "回收的上传文件字节数")
+
+loop_lag_monitor = LoopLagMonitor(registry)
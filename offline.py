@@ -0,0 +1,110 @@
+"""
+演出前的离线缓存清单
+
+显示端演出时从服务器按需加载音频、封面、歌词和幻灯片，现场 Wi-Fi 拥挤时每块屏幕都会卡顿。
+这里生成一份清单，列出播放列表和幻灯片用到的所有文件及其内容摘要，显示端的 Service Worker
+（display/sw.js）在后台限速下载到本地缓存，演出时直接从缓存读取：
+- 摘要按 (inode, 修改时间, 大小) 缓存，文件没变时不重新计算；曲目自带的 sha1 直接使用
+- 清单版本是所有条目摘要的摘要；最近几个版本的条目保留在内存中，客户端带上已有的版本时只返回差异
+"""
+
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from config import DEFAULT_COVER_URL, OFFLINE_MANIFEST_HISTORY
+from media import file_digest, url_to_path
+from persistence import file_signature
+
+logger = logging.getLogger(__name__)
+
+Entry = Dict[str, object]
+
+
+def lyrics_api_url(lyrics_url: str) -> str:
+    """显示端通过 /api/lyrics/<文件名> 读取歌词"""
+    return f"/api/lyrics/{lyrics_url.rsplit('/', 1)[-1]}"
+
+
+class OfflineManifest:
+    def __init__(self, history: int = OFFLINE_MANIFEST_HISTORY):
+        self.lock = threading.Lock()
+        self.digests: Dict[str, Tuple[object, str]] = {}  # 文件路径 -> (文件签名, 摘要)
+        self.history: "OrderedDict[str, Dict[str, str]]" = OrderedDict()  # 版本 -> {URL: 摘要}
+        self.history_size = history
+
+    def digest(self, url: str, known: Optional[str] = None) -> Optional[Tuple[str, int]]:
+        """文件的 (摘要, 大小)，文件不存在或不是上传文件时返回None"""
+        path = url_to_path(url)
+        signature = file_signature(path) if path is not None else None
+        if signature is None:
+            return None
+        key = str(path)
+        with self.lock:
+            cached = self.digests.get(key)
+        if cached is not None and cached[0] == signature:
+            return cached[1], signature[2]
+        try:
+            digest = known or file_digest(path)
+        except OSError as e:
+            logger.warning(f"计算离线缓存摘要失败 {url}: {e}")
+            return None
+        with self.lock:
+            self.digests[key] = (signature, digest)
+        return digest, signature[2]
+
+    def entries(self, tracks: Iterable, slides: Iterable) -> List[Entry]:
+        """播放列表和幻灯片用到的所有文件（阻塞调用，首次计算摘要时需要读取文件）"""
+        wanted: "OrderedDict[str, Tuple[str, str, Optional[str]]]" = OrderedDict()  # 缓存URL -> (类型, 文件URL, 已知摘要)
+        wanted[DEFAULT_COVER_URL] = ("cover", DEFAULT_COVER_URL, None)
+        for track in tracks:
+            # 显示端优先播放转码版本，原文件的 sha1 在导入时已经算过
+            audio_url = track.stream_url or track.url
+            wanted[audio_url] = ("audio", audio_url, track.sha1 if audio_url == track.url else None)
+            if track.cover_url:
+                wanted.setdefault(track.cover_url, ("cover", track.cover_url, None))
+            if track.lyrics_url:
+                wanted.setdefault(lyrics_api_url(track.lyrics_url), ("lyrics", track.lyrics_url, None))
+        for slide in slides:
+            wanted.setdefault(slide.url, ("slide", slide.url, None))
+
+        entries = []
+        for url, (kind, file_url, known) in wanted.items():
+            result = self.digest(file_url, known)
+            if result is not None:
+                entries.append({"url": url, "kind": kind, "hash": result[0], "size": result[1]})
+        return entries
+
+    def build(self, tracks: Iterable, slides: Iterable, since: Optional[str] = None) -> Dict[str, object]:
+        """生成清单；since 是客户端已经同步完成的版本，仍在历史中时只返回差异"""
+        entries = self.entries(tracks, slides)
+        hashes = {entry["url"]: entry["hash"] for entry in entries}
+        version = hashlib.sha1("\n".join(f"{url} {digest}" for url, digest in sorted(hashes.items()))
+                               .encode("utf-8")).hexdigest()[:16]
+        with self.lock:
+            self.history[version] = hashes
+            self.history.move_to_end(version)
+            while len(self.history) > self.history_size:
+                self.history.popitem(last=False)
+            previous = self.history.get(since) if since else None
+
+        manifest = {
+            "version": version,
+            "total": len(entries),
+            "total_bytes": sum(entry["size"] for entry in entries),
+        }
+        if previous is None:
+            manifest.update(full=True, entries=entries, removed=[])
+        else:
+            manifest.update(
+                full=False,
+                entries=[entry for entry in entries if previous.get(entry["url"]) != entry["hash"]],
+                removed=[url for url in previous if url not in hashes],
+            )
+        return manifest
+
+
+# 全局实例
+offline_manifest = OfflineManifest()
@@ -1,32 +1,171 @@
+import os
 import json
 import logging
+import threading
+from contextlib import contextmanager, nullcontext
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime
 
 from config import UPLOAD_FOLDER
+from metrics import persistence_write_duration
+from media import probe_duration
+from playlist import keys_between
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
 
 logger = logging.getLogger(__name__)
 
+# 数据库文件签名（inode, 修改时间, 大小），用于发现其他进程的写入
+FileSignature = Optional[Tuple[int, int, int]]
+
+
+def file_signature(path: Path) -> FileSignature:
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+class FileLock:
+    """跨进程文件锁（服务器、其他工作进程和命令行曲库工具之间互斥），同一进程内可重入"""
+    
+    def __init__(self, path: Path):
+        self.path = path
+        self.guard = threading.RLock()
+        self.depth = 0
+        self.handle = None
+    
+    def acquire(self):
+        self.guard.acquire()
+        if self.depth == 0:
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                handle = open(self.path, 'a+b')
+                if fcntl is not None:
+                    fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+                else:
+                    handle.seek(0)
+                    msvcrt.locking(handle.fileno(), msvcrt.LK_LOCK, 1)
+            except Exception:
+                self.guard.release()
+                raise
+            self.handle = handle
+        self.depth += 1
+    
+    def release(self):
+        self.depth -= 1
+        if self.depth == 0:
+            try:
+                if fcntl is not None:
+                    fcntl.flock(self.handle.fileno(), fcntl.LOCK_UN)
+                else:
+                    self.handle.seek(0)
+                    msvcrt.locking(self.handle.fileno(), msvcrt.LK_UNLCK, 1)
+            finally:
+                self.handle.close()
+                self.handle = None
+        self.guard.release()
+    
+    def __enter__(self):
+        self.acquire()
+        return self
+    
+    def __exit__(self, *exc):
+        self.release()
+
 class PersistenceManager:
     def __init__(self):
         self.data_dir = Path(__file__).parent / "data"
-        self.data_dir.mkdir(exist_ok=True)
         
         # 数据库文件路径
         self.music_db_file = self.data_dir / "music_database.json"
         self.slides_db_file = self.data_dir / "slides_database.json"
         
-        # 初始化数据库
-        self.music_database = self.load_database(self.music_db_file)
-        self.slides_database = self.load_database(self.slides_db_file)
+        # 音频分析结果（波形）目录
+        self.waveform_dir = self.data_dir / "waveforms"
+        
+        # 数据库在第一次访问时才加载（服务器在启动阶段显式调用 load）
+        self._music_database: Optional[List[Dict[str, Any]]] = None
+        self._slides_database: Optional[List[Dict[str, Any]]] = None
         
-        logger.info(f"音乐数据库已加载: {len(self.music_database)} 条记录")
-        logger.info(f"幻灯片数据库已加载: {len(self.slides_database)} 条记录")
+        # 写数据库前持有的跨进程锁，以及上次读写时各数据库文件的签名
+        self.lock = FileLock(self.data_dir / "library.lock")
+        self.signatures: Dict[Path, FileSignature] = {}
+    
+    def load(self):
+        """创建数据目录并加载数据库"""
+        self.data_dir.mkdir(exist_ok=True)
+        self.waveform_dir.mkdir(exist_ok=True)
+        
+        with self.lock:
+            self._music_database = self.load_database(self.music_db_file)
+            self._slides_database = self.load_database(self.slides_db_file)
+        
+        logger.info(f"音乐数据库已加载: {len(self._music_database)} 条记录")
+        logger.info(f"幻灯片数据库已加载: {len(self._slides_database)} 条记录")
+    
+    def refresh_if_changed(self) -> bool:
+        """数据库文件被其他进程改过时重新加载，返回是否重新加载（需持有锁）"""
+        if not self.loaded:
+            self.load()
+            return True
+        
+        changed = False
+        if file_signature(self.music_db_file) != self.signatures.get(self.music_db_file):
+            self._music_database = self.load_database(self.music_db_file)
+            changed = True
+        if file_signature(self.slides_db_file) != self.signatures.get(self.slides_db_file):
+            self._slides_database = self.load_database(self.slides_db_file)
+            changed = True
+        if changed:
+            logger.info("数据库文件已被其他进程修改，已重新加载")
+        return changed
+    
+    @contextmanager
+    def transaction(self):
+        """读-改-写事务：持有跨进程锁，并在修改前读入其他进程的写入，避免互相覆盖"""
+        with self.lock:
+            self.refresh_if_changed()
+            yield
+    
+    def write_scope(self, save: bool):
+        """save=False（同步其他进程已经写入的修改）时只改内存，不需要加锁"""
+        return self.transaction() if save else nullcontext()
+    
+    @property
+    def loaded(self) -> bool:
+        return self._music_database is not None
+    
+    @property
+    def music_database(self) -> List[Dict[str, Any]]:
+        if self._music_database is None:
+            self.load()
+        return self._music_database
+    
+    @music_database.setter
+    def music_database(self, value: List[Dict[str, Any]]):
+        self._music_database = value
+    
+    @property
+    def slides_database(self) -> List[Dict[str, Any]]:
+        if self._slides_database is None:
+            self.load()
+        return self._slides_database
+    
+    @slides_database.setter
+    def slides_database(self, value: List[Dict[str, Any]]):
+        self._slides_database = value
     
     def load_database(self, db_file: Path) -> List[Dict[str, Any]]:
         """加载数据库文件"""
         try:
+            self.signatures[db_file] = file_signature(db_file)
             if db_file.exists():
                 with open(db_file, 'r', encoding='utf-8') as f:
                     return json.load(f)
@@ -36,103 +175,213 @@ class PersistenceManager:
             return []
     
     def save_database(self, db_file: Path, data: List[Dict[str, Any]]):
-        """保存数据库到文件"""
+        """保存数据库到文件（先写临时文件再替换，读取方不会看到写了一半的文件）"""
         try:
-            with open(db_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            with self.lock, persistence_write_duration.time(database=db_file.stem):
+                temp_file = db_file.with_name(db_file.name + '.tmp')
+                with open(temp_file, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False, indent=2)
+                os.replace(temp_file, db_file)
+                self.signatures[db_file] = file_signature(db_file)
             logger.debug(f"数据库已保存到 {db_file}")
         except Exception as e:
             logger.error(f"保存数据库文件失败 {db_file}: {e}")
     
-    def add_music_track(self, track_data: Dict[str, Any]) -> str:
-        """添加音乐轨道到数据库"""
+    def flush(self):
+        """把内存中的两个数据库写入文件（热备应用 save=False 的修改后调用）"""
+        with self.lock:
+            self.save_database(self.music_db_file, self.music_database)
+            self.save_database(self.slides_db_file, self.slides_database)
+
+    def replace_all(self, tracks: List[Dict[str, Any]], slides: List[Dict[str, Any]]):
+        """用完整的记录替换两个数据库并写入文件（热备同步主服务器的快照）"""
+        with self.lock:
+            self._music_database = tracks
+            self._slides_database = slides
+            self.flush()
+
+    def assign_positions(self, database: List[Dict[str, Any]], records: List[Dict[str, Any]]):
+        """给没有位置键的记录分配位置键，按顺序排在数据库中所有记录之后"""
+        missing = [record for record in records if not record.get('position')]
+        if not missing:
+            return
+        last = max((record['position'] for record in database if record.get('position')), default=None)
+        for record, key in zip(missing, keys_between(last, None, len(missing))):
+            record['position'] = key
+    
+    def add_music_track(self, track_data: Dict[str, Any], save: bool = True) -> str:
+        """添加音乐轨道到数据库（save=False 时只更新内存，用于同步其他进程的修改）"""
+        with self.write_scope(save):
+            self.assign_positions(self.music_database, [track_data])
+            track_id = self.insert_music_track(track_data)
+            if save:
+                self.save_database(self.music_db_file, self.music_database)
+        return track_id
+    
+    def add_music_tracks(self, tracks: List[Dict[str, Any]]) -> List[str]:
+        """批量添加音乐轨道，只写一次数据库"""
+        with self.transaction():
+            self.assign_positions(self.music_database, tracks)
+            track_ids = [self.insert_music_track(track_data) for track_data in tracks]
+            if track_ids:
+                self.save_database(self.music_db_file, self.music_database)
+        return track_ids
+    
+    def insert_music_track(self, track_data: Dict[str, Any]) -> str:
+        """把音乐轨道加入内存中的数据库，ID已存在时替换原记录"""
         track_id = track_data.get('id', str(len(self.music_database) + 1))
         track_data['id'] = track_id
-        track_data['created_at'] = datetime.now().isoformat()
+        track_data.setdefault('created_at', datetime.now().isoformat())
         
         # 检查文件是否存在
         url = track_data.get('url', '')
         if url and not self.check_file_exists(url):
             logger.warning(f"音乐文件不存在: {url}")
         
+        # 其他进程的修改可能已经通过重新加载文件读入，这里不能重复添加
+        self.music_database = [track for track in self.music_database if track.get('id') != track_id]
         self.music_database.append(track_data)
-        self.save_database(self.music_db_file, self.music_database)
         
         logger.info(f"音乐已添加到数据库: {track_data.get('title', '未知')}")
         return track_id
     
-    def add_slide(self, slide_data: Dict[str, Any]) -> str:
-        """添加幻灯片到数据库"""
-        slide_id = slide_data.get('id', str(len(self.slides_database) + 1))
-        slide_data['id'] = slide_id
-        slide_data['created_at'] = datetime.now().isoformat()
-        
-        # 检查文件是否存在
-        url = slide_data.get('url', '')
-        if url and not self.check_file_exists(url):
-            logger.warning(f"幻灯片文件不存在: {url}")
-        
-        self.slides_database.append(slide_data)
-        self.save_database(self.slides_db_file, self.slides_database)
+    def add_slide(self, slide_data: Dict[str, Any], save: bool = True) -> str:
+        """添加幻灯片到数据库（save=False 时只更新内存）"""
+        with self.write_scope(save):
+            slide_id = slide_data.get('id', str(len(self.slides_database) + 1))
+            slide_data['id'] = slide_id
+            slide_data.setdefault('created_at', datetime.now().isoformat())
+            self.assign_positions(self.slides_database, [slide_data])
+            
+            # 检查文件是否存在
+            url = slide_data.get('url', '')
+            if url and not self.check_file_exists(url):
+                logger.warning(f"幻灯片文件不存在: {url}")
+            
+            self.slides_database = [slide for slide in self.slides_database if slide.get('id') != slide_id]
+            self.slides_database.append(slide_data)
+            if save:
+                self.save_database(self.slides_db_file, self.slides_database)
         
         logger.info(f"幻灯片已添加到数据库: {slide_data.get('name', '未知')}")
         return slide_id
     
-    def delete_music_track(self, track_id: str) -> bool:
+    def delete_music_track(self, track_id: str, save: bool = True) -> bool:
         """从数据库删除音乐轨道"""
-        original_length = len(self.music_database)
-        self.music_database = [track for track in self.music_database if track.get('id') != track_id]
-        
-        if len(self.music_database) < original_length:
-            self.save_database(self.music_db_file, self.music_database)
-            logger.info(f"音乐已从数据库删除: ID={track_id}")
-            return True
-        return False
+        with self.write_scope(save):
+            original_length = len(self.music_database)
+            self.music_database = [track for track in self.music_database if track.get('id') != track_id]
+            
+            if len(self.music_database) < original_length:
+                if save:
+                    self.save_database(self.music_db_file, self.music_database)
+                    self.delete_waveform(track_id)
+                logger.info(f"音乐已从数据库删除: ID={track_id}")
+                return True
+            return False
+    
+    def update_music_track(self, track_id: str, updates: Dict[str, Any], save: bool = True) -> bool:
+        """更新音乐轨道的部分字段"""
+        with self.write_scope(save):
+            for track in self.music_database:
+                if track.get('id') == track_id:
+                    track.update(updates)
+                    if save:
+                        self.save_database(self.music_db_file, self.music_database)
+                    return True
+            return False
+    
+    def update_slide(self, slide_id: str, updates: Dict[str, Any], save: bool = True) -> bool:
+        """更新幻灯片的部分字段"""
+        with self.write_scope(save):
+            for slide in self.slides_database:
+                if slide.get('id') == slide_id:
+                    slide.update(updates)
+                    if save:
+                        self.save_database(self.slides_db_file, self.slides_database)
+                    return True
+            return False
     
-    def delete_slide(self, slide_id: str) -> bool:
+    def get_waveform_file(self, track_id: str) -> Path:
+        """获取波形数据文件路径"""
+        return self.waveform_dir / f"{track_id}.bin"
+    
+    def save_waveform(self, track_id: str, waveform: bytes):
+        """保存波形数据"""
+        try:
+            self.get_waveform_file(track_id).write_bytes(waveform)
+        except Exception as e:
+            logger.error(f"保存波形数据失败 {track_id}: {e}")
+    
+    def load_waveform(self, track_id: str) -> Optional[bytes]:
+        """读取波形数据，不存在时返回None"""
+        waveform_file = self.get_waveform_file(track_id)
+        if not waveform_file.exists():
+            return None
+        return waveform_file.read_bytes()
+    
+    def delete_waveform(self, track_id: str):
+        """删除波形数据"""
+        try:
+            self.get_waveform_file(track_id).unlink(missing_ok=True)
+        except Exception as e:
+            logger.error(f"删除波形数据失败 {track_id}: {e}")
+    
+    def delete_slide(self, slide_id: str, save: bool = True) -> bool:
         """从数据库删除幻灯片"""
-        original_length = len(self.slides_database)
-        self.slides_database = [slide for slide in self.slides_database if slide.get('id') != slide_id]
-        
-        if len(self.slides_database) < original_length:
-            self.save_database(self.slides_db_file, self.slides_database)
-            logger.info(f"幻灯片已从数据库删除: ID={slide_id}")
-            return True
-        return False
+        with self.write_scope(save):
+            original_length = len(self.slides_database)
+            self.slides_database = [slide for slide in self.slides_database if slide.get('id') != slide_id]
+            
+            if len(self.slides_database) < original_length:
+                if save:
+                    self.save_database(self.slides_db_file, self.slides_database)
+                logger.info(f"幻灯片已从数据库删除: ID={slide_id}")
+                return True
+            return False
     
     def get_all_music_tracks(self) -> List[Dict[str, Any]]:
         """获取所有音乐轨道"""
-        # 过滤掉文件不存在的记录
-        valid_tracks = []
-        for track in self.music_database:
-            url = track.get('url', '')
-            if not url or self.check_file_exists(url):
-                valid_tracks.append(track)
-            else:
-                logger.warning(f"音乐文件不存在，跳过: {track.get('title', '未知')}")
-        
-        # 如果有无效记录，更新数据库
-        if len(valid_tracks) != len(self.music_database):
-            self.music_database = valid_tracks
-            self.save_database(self.music_db_file, self.music_database)
+        with self.transaction():
+            # 过滤掉文件不存在的记录
+            valid_tracks = []
+            for track in self.music_database:
+                url = track.get('url', '')
+                if not url or self.check_file_exists(url):
+                    valid_tracks.append(track)
+                else:
+                    logger.warning(f"音乐文件不存在，跳过: {track.get('title', '未知')}")
+            
+            # 旧版本的记录没有位置键，按原来的顺序补上
+            unordered = not all(track.get('position') for track in valid_tracks)
+            self.assign_positions(valid_tracks, valid_tracks)
+            
+            # 如果有无效记录，更新数据库
+            if len(valid_tracks) != len(self.music_database) or unordered:
+                self.music_database = valid_tracks
+                self.save_database(self.music_db_file, self.music_database)
         
         return valid_tracks
     
     def get_all_slides(self) -> List[Dict[str, Any]]:
         """获取所有幻灯片"""
-        # 过滤掉文件不存在的记录
-        valid_slides = []
-        for slide in self.slides_database:
-            url = slide.get('url', '')
-            if not url or self.check_file_exists(url):
-                valid_slides.append(slide)
-            else:
-                logger.warning(f"幻灯片文件不存在，跳过: {slide.get('name', '未知')}")
-        
-        # 如果有无效记录，更新数据库
-        if len(valid_slides) != len(self.slides_database):
-            self.slides_database = valid_slides
-            self.save_database(self.slides_db_file, self.slides_database)
+        with self.transaction():
+            # 过滤掉文件不存在的记录
+            valid_slides = []
+            for slide in self.slides_database:
+                url = slide.get('url', '')
+                if not url or self.check_file_exists(url):
+                    valid_slides.append(slide)
+                else:
+                    logger.warning(f"幻灯片文件不存在，跳过: {slide.get('name', '未知')}")
+            
+            unordered = not all(slide.get('position') for slide in valid_slides)
+            self.assign_positions(valid_slides, valid_slides)
+            
+            # 如果有无效记录，更新数据库
+            if len(valid_slides) != len(self.slides_database) or unordered:
+                self.slides_database = valid_slides
+                self.save_database(self.slides_db_file, self.slides_database)
         
         return valid_slides
     
@@ -147,49 +396,46 @@ class PersistenceManager:
         
         return file_path.exists()
     
-    def cleanup_orphaned_files(self):
-        """清理孤立的文件（数据库中不存在引用的文件）"""
-        try:
-            # 收集所有在数据库中引用的文件
-            referenced_files = set()
-            
-            for track in self.music_database:
-                if track.get('url'):
-                    referenced_files.add(track['url'])
-                if track.get('cover_url'):
-                    referenced_files.add(track['cover_url'])
-                if track.get('lyrics_url'):
-                    referenced_files.add(track['lyrics_url'])
-            
-            for slide in self.slides_database:
-                if slide.get('url'):
-                    referenced_files.add(slide['url'])
-                if slide.get('thumbnail_url'):
-                    referenced_files.add(slide['thumbnail_url'])
-            
-            # 遍历上传目录，删除未被引用的文件
-            for subdir in ['music', 'slides', 'covers', 'lyrics']:
-                dir_path = UPLOAD_FOLDER / subdir
-                if dir_path.exists():
-                    for file_path in dir_path.iterdir():
-                        if file_path.is_file():
-                            file_url = f"/uploads/{subdir}/{file_path.name}"
-                            if file_url not in referenced_files and file_path.name != "default-cover.jpg":
-                                try:
-                                    file_path.unlink()
-                                    logger.info(f"清理孤立文件: {file_path}")
-                                except Exception as e:
-                                    logger.error(f"删除文件失败 {file_path}: {e}")
-            
-            logger.info("文件清理完成")
-            
-        except Exception as e:
-            logger.error(f"清理文件时出错: {e}")
+    def referenced_files(self) -> set:
+        """收集所有在数据库中引用的文件URL"""
+        referenced_files = set()
+        
+        for track in self.music_database:
+            if track.get('url'):
+                referenced_files.add(track['url'])
+            if track.get('cover_url'):
+                referenced_files.add(track['cover_url'])
+            if track.get('lyrics_url'):
+                referenced_files.add(track['lyrics_url'])
+            if track.get('stream_url'):
+                referenced_files.add(track['stream_url'])
+        
+        for slide in self.slides_database:
+            if slide.get('url'):
+                referenced_files.add(slide['url'])
+            if slide.get('thumbnail_url'):
+                referenced_files.add(slide['thumbnail_url'])
+        
+        return referenced_files
+    
+    def find_orphaned_files(self) -> List[Path]:
+        """列出上传目录中没有被数据库引用的文件"""
+        referenced_files = self.referenced_files()
+        orphaned = []
+        for subdir in ['music', 'slides', 'covers', 'lyrics', 'variants']:
+            dir_path = UPLOAD_FOLDER / subdir
+            if dir_path.exists():
+                for file_path in dir_path.iterdir():
+                    if file_path.is_file():
+                        file_url = f"/uploads/{subdir}/{file_path.name}"
+                        if file_url not in referenced_files and file_path.name != "default-cover.jpg":
+                            orphaned.append(file_path)
+        return orphaned
     
     def backup_database(self):
         """备份数据库"""
         backup_dir = self.data_dir / "backups"
-        backup_dir.mkdir(exist_ok=True)
+        backup_dir.mkdir(parents=True, exist_ok=True)
         
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         
@@ -218,10 +464,9 @@ class PersistenceManager:
                 logger.error(f"备份幻灯片数据库失败: {e}")
 
     def repair_music_durations(self):
-        """修复音乐文件的时长信息"""
-        repaired_count = 0
-        
-        for track in self.music_database:
+        """修复音乐文件的时长信息（先在锁外读取时长，再在事务中按ID写回）"""
+        durations = {}
+        for track in list(self.music_database):
             try:
                 url = track.get('url', '')
                 if not url:
@@ -234,23 +479,23 @@ class PersistenceManager:
                     
                     if file_path.exists():
                         # 重新获取时长
-                        from server import get_audio_duration
-                        import asyncio
-                        
-                        # 注意：get_audio_duration是async函数，需要特殊处理
-                        duration = asyncio.run(get_audio_duration(file_path))
-                        
-                        if duration > 0 and duration != track.get('duration', 0):
-                            old_duration = track.get('duration', 0)
-                            track['duration'] = duration
-                            repaired_count += 1
-                            logger.info(f"修复音乐时长: {track.get('title', '未知')} - {old_duration}s -> {duration}s")
+                        durations[track['id']] = probe_duration(file_path)
                 
             except Exception as e:
                 logger.error(f"修复音乐时长失败 {track.get('id', '未知')}: {e}")
         
-        if repaired_count > 0:
-            self.save_database(self.music_db_file, self.music_database)
+        repaired_count = 0
+        with self.transaction():
+            for track in self.music_database:
+                duration = durations.get(track.get('id'), 0)
+                if duration > 0 and duration != track.get('duration', 0):
+                    old_duration = track.get('duration', 0)
+                    track['duration'] = duration
+                    repaired_count += 1
+                    logger.info(f"修复音乐时长: {track.get('title', '未知')} - {old_duration}s -> {duration}s")
+            
+            if repaired_count > 0:
+                self.save_database(self.music_db_file, self.music_database)
         
         logger.info(f"已修复 {repaired_count} 个音乐的时长信息")
         return repaired_count
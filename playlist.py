@@ -0,0 +1,305 @@
+"""
+有序列表与分数位置键
+
+播放列表和幻灯片列表按每条记录的位置键（字符串）排序：
+- 位置键是可以按字符串比较的“分数”，任意两个键之间总能生成一个新键，
+  移动或插入一首曲目只需要修改它自己的位置键，不用重写其他记录的顺序
+- 键由整数部分和小数部分组成（与 fractional-indexing 算法相同），追加到末尾时只递增整数部分，键长保持很短
+- OrderedList 按 (位置键, ID) 保存有序数组，ID -> 元素 O(1)，ID -> 下标 O(log n)，插入和删除只移动数组
+- 随机播放顺序按 shuffle_key 排序，只由种子和 ID 决定：各工作进程不管当前曲目、曲目加入的先后，得到的顺序都相同
+"""
+
+import bisect
+import hashlib
+from typing import Dict, Generic, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+DIGITS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+SMALLEST_INTEGER = "A" + DIGITS[0] * 26
+FIRST_KEY = "a" + DIGITS[0]
+
+
+def integer_length(head: str) -> int:
+    """整数部分的长度由首字符决定：a-z 为正数（2-27 位），A-Z 为负数"""
+    if "a" <= head <= "z":
+        return ord(head) - ord("a") + 2
+    if "A" <= head <= "Z":
+        return ord("Z") - ord(head) + 2
+    raise ValueError(f"无效的位置键首字符: {head}")
+
+
+def split_key(key: str) -> Tuple[str, str]:
+    integer = key[:integer_length(key[0])]
+    if len(integer) != integer_length(key[0]):
+        raise ValueError(f"无效的位置键: {key}")
+    return integer, key[len(integer):]
+
+
+def validate_key(key: str):
+    if key == SMALLEST_INTEGER:
+        raise ValueError(f"无效的位置键: {key}")
+    _, fraction = split_key(key)
+    if fraction.endswith(DIGITS[0]):
+        raise ValueError(f"无效的位置键: {key}")
+
+
+def midpoint(lower: str, upper: Optional[str]) -> str:
+    """两个小数部分之间的小数（upper 为 None 表示 1）"""
+    if upper is not None:
+        # 相同的前缀原样保留
+        n = 0
+        while n < len(upper) and (lower[n] if n < len(lower) else DIGITS[0]) == upper[n]:
+            n += 1
+        if n > 0:
+            return upper[:n] + midpoint(lower[n:], upper[n:])
+
+    digit_lower = DIGITS.index(lower[0]) if lower else 0
+    digit_upper = DIGITS.index(upper[0]) if upper is not None else len(DIGITS)
+    if digit_upper - digit_lower > 1:
+        return DIGITS[(digit_lower + digit_upper + 1) // 2]
+    if upper is not None and len(upper) > 1:
+        return upper[0]
+    return DIGITS[digit_lower] + midpoint(lower[1:], None)
+
+
+def increment_integer(integer: str) -> Optional[str]:
+    head, digits = integer[0], list(integer[1:])
+    for i in range(len(digits) - 1, -1, -1):
+        value = DIGITS.index(digits[i]) + 1
+        if value < len(DIGITS):
+            digits[i] = DIGITS[value]
+            return head + "".join(digits)
+        digits[i] = DIGITS[0]
+    # 进位：整数部分变长
+    if head == "Z":
+        return "a" + DIGITS[0]
+    if head == "z":
+        return None
+    head = chr(ord(head) + 1)
+    if head > "a":
+        digits.append(DIGITS[0])
+    else:
+        digits.pop()
+    return head + "".join(digits)
+
+
+def decrement_integer(integer: str) -> Optional[str]:
+    head, digits = integer[0], list(integer[1:])
+    for i in range(len(digits) - 1, -1, -1):
+        value = DIGITS.index(digits[i]) - 1
+        if value >= 0:
+            digits[i] = DIGITS[value]
+            return head + "".join(digits)
+        digits[i] = DIGITS[-1]
+    if head == "a":
+        return "Z" + DIGITS[-1]
+    if head == "A":
+        return None
+    head = chr(ord(head) - 1)
+    if head < "Z":
+        digits.append(DIGITS[-1])
+    else:
+        digits.pop()
+    return head + "".join(digits)
+
+
+def key_between(lower: Optional[str], upper: Optional[str]) -> str:
+    """生成严格位于 lower 和 upper 之间的位置键（None 表示没有边界）"""
+    if lower is not None:
+        validate_key(lower)
+    if upper is not None:
+        validate_key(upper)
+    if lower is not None and upper is not None and lower >= upper:
+        raise ValueError(f"位置键顺序错误: {lower} >= {upper}")
+
+    if lower is None:
+        if upper is None:
+            return FIRST_KEY
+        integer, fraction = split_key(upper)
+        if integer == SMALLEST_INTEGER:
+            return integer + midpoint("", fraction)
+        if integer < upper:
+            return integer
+        result = decrement_integer(integer)
+        if result is None:
+            raise ValueError("位置键已无法再减小")
+        return result
+
+    integer, fraction = split_key(lower)
+    if upper is None:
+        result = increment_integer(integer)
+        return result if result is not None else integer + midpoint(fraction, None)
+
+    upper_integer, upper_fraction = split_key(upper)
+    if integer == upper_integer:
+        return integer + midpoint(fraction, upper_fraction)
+    result = increment_integer(integer)
+    if result is None:
+        raise ValueError("位置键已无法再增大")
+    return result if result < upper else integer + midpoint(fraction, None)
+
+
+def keys_between(lower: Optional[str], upper: Optional[str], count: int) -> List[str]:
+    """生成 count 个位于 lower 和 upper 之间的递增位置键（批量插入时键长只按对数增长）"""
+    if count <= 0:
+        return []
+    if count == 1:
+        return [key_between(lower, upper)]
+    if upper is None:
+        keys = [key_between(lower, None)]
+        for _ in range(count - 1):
+            keys.append(key_between(keys[-1], None))
+        return keys
+    if lower is None:
+        keys = [key_between(None, upper)]
+        for _ in range(count - 1):
+            keys.append(key_between(None, keys[-1]))
+        return keys[::-1]
+    middle = count // 2
+    key = key_between(lower, upper)
+    return keys_between(lower, key, middle) + [key] + keys_between(key, upper, count - middle - 1)
+
+
+def shuffle_key(seed: int, item_id: str) -> int:
+    """随机播放顺序中的排序键"""
+    return int.from_bytes(hashlib.blake2b(f"{seed}:{item_id}".encode(), digest_size=8).digest(), "big")
+
+
+T = TypeVar("T")
+
+
+class OrderedList(Generic[T]):
+    """按位置键排序的列表，元素需要有 id 和 position 属性
+
+    可以像普通列表一样按下标读取和遍历；修改只能通过下面的方法，
+    它们会维护位置键并返回新分配的键（由调用方持久化）。
+    """
+
+    def __init__(self, items: Iterable[T] = ()):
+        self.sort_keys: List[Tuple[str, str]] = []  # (位置键, ID)，ID 用于区分不同进程同时生成的相同键
+        self.items: List[T] = []
+        self.by_id: Dict[str, T] = {}
+        self.load(items)
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __iter__(self) -> Iterator[T]:
+        return iter(self.items)
+
+    def __getitem__(self, index):
+        return self.items[index]
+
+    def __bool__(self) -> bool:
+        return bool(self.items)
+
+    def load(self, items: Iterable[T]) -> Dict[str, str]:
+        """替换全部内容；没有位置键的元素按原顺序排在最后，返回新分配的 {ID: 位置键}"""
+        items = list(items)
+        missing = [item for item in items if not item.position]
+        existing = sorted((item for item in items if item.position), key=lambda item: (item.position, item.id))
+        last = existing[-1].position if existing else None
+        assigned = {}
+        for item, key in zip(missing, keys_between(last, None, len(missing))):
+            item.position = key
+            assigned[item.id] = key
+        self.items = existing + missing
+        self.sort_keys = [(item.position, item.id) for item in self.items]
+        self.by_id = {item.id: item for item in self.items}
+        return assigned
+
+    def get(self, item_id: Optional[str]) -> Optional[T]:
+        return self.by_id.get(item_id) if item_id is not None else None
+
+    def index_of(self, item_id: Optional[str]) -> int:
+        """元素当前的下标，不存在时返回 -1"""
+        item = self.get(item_id)
+        if item is None:
+            return -1
+        return bisect.bisect_left(self.sort_keys, (item.position, item.id))
+
+    def window(self, after: Optional[Tuple[str, str]] = None, limit: int = 50) -> List[T]:
+        """排在 (位置键, ID) 之后的最多 limit 个元素（游标指向的元素已被删除或移动也能继续）"""
+        start = bisect.bisect_right(self.sort_keys, after) if after is not None else 0
+        return self.items[start:start + limit]
+
+    def key_after(self, after_id: Optional[str]) -> str:
+        """排在 after_id 之后（None 表示最前面）的新位置键"""
+        if after_id is None:
+            return key_between(None, self.sort_keys[0][0] if self.sort_keys else None)
+        item = self.by_id[after_id]
+        # 跳过位置键相同的元素
+        index = bisect.bisect_right(self.sort_keys, (item.position, "\U0010ffff"))
+        return key_between(item.position, self.sort_keys[index][0] if index < len(self.sort_keys) else None)
+
+    def place(self, item: T):
+        sort_key = (item.position, item.id)
+        index = bisect.bisect_left(self.sort_keys, sort_key)
+        self.sort_keys.insert(index, sort_key)
+        self.items.insert(index, item)
+        self.by_id[item.id] = item
+
+    def unplace(self, item_id: str) -> Optional[T]:
+        index = self.index_of(item_id)
+        if index == -1:
+            return None
+        del self.sort_keys[index]
+        item = self.items.pop(index)
+        del self.by_id[item_id]
+        return item
+
+    def append(self, item: T) -> str:
+        """加到末尾（元素已有位置键时按原键插入，用于同步其他进程的修改）"""
+        if item.id in self.by_id:
+            self.unplace(item.id)
+        if not item.position:
+            item.position = key_between(self.sort_keys[-1][0] if self.sort_keys else None, None)
+        self.place(item)
+        return item.position
+
+    def extend(self, items: Iterable[T]) -> List[str]:
+        items = list(items)
+        for item in items:
+            if item.id in self.by_id:
+                self.unplace(item.id)
+        missing = [item for item in items if not item.position]
+        last = self.sort_keys[-1][0] if self.sort_keys else None
+        for item, key in zip(missing, keys_between(last, None, len(missing))):
+            item.position = key
+        for item in items:
+            self.place(item)
+        return [item.position for item in items]
+
+    def insert_after(self, item: T, after_id: Optional[str]) -> str:
+        """插入到 after_id 之后（None 表示最前面）"""
+        if item.id in self.by_id:
+            self.unplace(item.id)
+        item.position = self.key_after(after_id)
+        self.place(item)
+        return item.position
+
+    def move(self, item_id: str, after_id: Optional[str]) -> Optional[str]:
+        """把元素移动到 after_id 之后，返回新的位置键；元素不存在或位置没有变化时返回None"""
+        if item_id == after_id or item_id not in self.by_id or (after_id is not None and after_id not in self.by_id):
+            return None
+        index = self.index_of(item_id)
+        previous = self.items[index - 1].id if index > 0 else None
+        if previous == after_id:
+            return None
+        item = self.unplace(item_id)
+        item.position = self.key_after(after_id)
+        self.place(item)
+        return item.position
+
+    def set_position(self, item_id: str, position: str) -> bool:
+        """使用指定的位置键重新排序（其他进程移动了元素）"""
+        item = self.by_id.get(item_id)
+        if item is None:
+            return False
+        if item.position != position:
+            self.unplace(item_id)
+            item.position = position
+            self.place(item)
+        return True
+
+    def remove(self, item_id: str) -> Optional[T]:
+        return self.unplace(item_id)
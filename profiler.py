@@ -0,0 +1,150 @@
+"""
+卡顿诊断
+
+- LoopWatchdog: 后台线程监视事件循环心跳，卡住超过阈值时记录事件循环线程当时的调用栈
+- SamplingProfiler: 按需采样调用栈，输出火焰图工具（flamegraph.pl / speedscope）可用的折叠栈格式
+"""
+
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from collections import Counter, deque
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from config import LOOP_STALL_THRESHOLD, LOOP_STALL_HISTORY, PROFILER_MAX_SECONDS
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+loop_stalls = registry.counter("pyer_event_loop_stalls_total", "事件循环卡顿次数")
+
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def collapse_stack(frame) -> str:
+    """调用栈转为 根;...;叶 的折叠格式"""
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class LoopWatchdog:
+    """事件循环卡顿监视"""
+
+    def __init__(self, threshold: float = LOOP_STALL_THRESHOLD, interval: float = 0.1,
+                 history: int = LOOP_STALL_HISTORY):
+        self.threshold = threshold
+        self.interval = interval
+        self.stalls: deque = deque(maxlen=history)
+        self.loop_thread_id: Optional[int] = None
+        self.last_beat = time.monotonic()
+        self.heartbeat_task: Optional[asyncio.Task] = None
+        self.thread: Optional[threading.Thread] = None
+        self.stop_event = threading.Event()
+
+    def start(self):
+        """在事件循环线程中调用"""
+        if self.heartbeat_task is not None:
+            return
+        self.loop_thread_id = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self.stop_event.clear()
+        self.heartbeat_task = asyncio.create_task(self.heartbeat())
+        self.thread = threading.Thread(target=self.watch, daemon=True, name="loop-watchdog")
+        self.thread.start()
+
+    async def heartbeat(self):
+        while True:
+            self.last_beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+
+    def watch(self):
+        current: Optional[Dict] = None
+        while not self.stop_event.wait(self.interval / 2):
+            blocked = time.monotonic() - self.last_beat - self.interval
+            if blocked > self.threshold:
+                if current is None:
+                    current = self.capture(blocked)
+                else:
+                    current["duration"] = round(blocked, 3)
+            elif current is not None:
+                logger.warning(f"事件循环卡顿结束，持续约 {current['duration']:.2f} 秒")
+                current = None
+
+    def capture(self, blocked: float) -> Dict:
+        """记录事件循环线程当前的调用栈"""
+        frame = sys._current_frames().get(self.loop_thread_id)
+        stall = {
+            "time": datetime.now().isoformat(),
+            "duration": round(blocked, 3),
+            "stack": traceback.format_stack(frame) if frame is not None else [],
+            "collapsed": collapse_stack(frame) if frame is not None else "",
+        }
+        self.stalls.append(stall)
+        loop_stalls.inc()
+        logger.warning(f"事件循环已卡住 {blocked:.2f} 秒，当前调用栈:\n{''.join(stall['stack'][-8:])}")
+        return stall
+
+    async def stop(self):
+        self.stop_event.set()
+        if self.heartbeat_task is not None:
+            self.heartbeat_task.cancel()
+            try:
+                await self.heartbeat_task
+            except asyncio.CancelledError:
+                pass
+            self.heartbeat_task = None
+
+    def report(self) -> List[Dict]:
+        return list(self.stalls)
+
+
+class SamplingProfiler:
+    """调用栈采样（同一时间只允许一个采样任务）"""
+
+    def __init__(self, max_seconds: float = PROFILER_MAX_SECONDS):
+        self.max_seconds = max_seconds
+        self.lock = threading.Lock()
+
+    @property
+    def busy(self) -> bool:
+        return self.lock.locked()
+
+    def sample(self, seconds: float, interval: float = 0.005, thread_ids: Optional[List[int]] = None) -> Dict[str, int]:
+        """在调用线程中阻塞采样，返回 折叠栈 -> 次数；thread_ids 为空时采样除自身外的所有线程"""
+        seconds = min(max(seconds, 0.1), self.max_seconds)
+        if not self.lock.acquire(blocking=False):
+            raise RuntimeError("已有采样任务在运行")
+
+        own_id = threading.get_ident()
+        stacks: Counter = Counter()
+        try:
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == own_id or (thread_ids and thread_id not in thread_ids):
+                        continue
+                    stacks[collapse_stack(frame)] += 1
+                time.sleep(interval)
+        finally:
+            self.lock.release()
+        return dict(stacks)
+
+    @staticmethod
+    def render_collapsed(stacks: Dict[str, int]) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items(), key=lambda item: -item[1]))
+
+
+# 全局实例
+loop_watchdog = LoopWatchdog()
+sampling_profiler = SamplingProfiler()
@@ -0,0 +1,251 @@
+"""
+中继模式（分会场的边缘服务器）
+
+分会场的显示端连接到本地的中继服务器，而不是通过较差的网络直接连接主服务器：
+- 每个房间只有一条到主服务器的上游连接（作为一个显示端订阅，使用二进制编码和会话恢复），
+  收到的消息更新本地的播放状态副本并转发给本地所有显示端；本地显示端上报的播放进度和缓存进度转发回主服务器
+- 本地显示端与中继对时，中继通过上游连接与主服务器对时，演出流程提示的开始时间换算成中继的时钟再转发
+- 媒体文件第一次被请求时从主服务器下载到本地上传目录，之后由本地直接提供（同一文件并发请求只下载一次），
+  上游流量是每个分会场一份而不是每块屏幕一份
+- 播放控制仍然在主服务器的管理端进行
+"""
+
+import os
+import time
+import uuid
+import json
+import shutil
+import asyncio
+import logging
+import urllib.request
+from collections import deque
+from pathlib import Path
+from typing import Deque, Dict, Optional, Tuple
+from urllib.parse import quote, urlencode
+
+import websockets
+
+from config import MEDIA_CHUNK_SIZE, RELAY_RECONNECT_MAX, RELAY_TIMEOUT
+from wire import BINARY_CODEC, BINARY_SUBPROTOCOL
+from metrics import relay_media_requests, relay_upstream_bytes
+
+logger = logging.getLogger(__name__)
+
+# 本地显示端上报后转发给主服务器的消息
+FORWARDED_TYPES = {"time_update", "cache_progress"}
+
+# 与主服务器对时：连接后连续发送 CLOCK_SYNC_BURST 次，之后每 CLOCK_SYNC_INTERVAL 秒一次，取最近几次中往返最快的
+CLOCK_SYNC_BURST = 5
+CLOCK_SYNC_INTERVAL = 30.0
+CLOCK_SYNC_SAMPLES = 8
+
+
+class RelayLink:
+    """一个房间到主服务器的上游连接"""
+
+    def __init__(self, relay: "Relay", room):
+        self.relay = relay
+        self.room = room
+        self.token: Optional[str] = None
+        self.seq: Optional[int] = None
+        self.socket = None
+        self.last_time_forward = 0.0
+        self.task: Optional[asyncio.Task] = None
+        # 主服务器时钟减本地时钟（毫秒）和最近的对时样本 (时钟差, 往返时间)
+        self.clock_offset = 0.0
+        self.clock_samples: Deque[Tuple[float, float]] = deque(maxlen=CLOCK_SYNC_SAMPLES)
+
+    def url(self) -> str:
+        query = {"room": self.room.name}
+        if self.token and self.seq is not None:
+            query.update(resume=self.token, seq=self.seq)
+        return f"{self.relay.ws_base}/ws/display?{urlencode(query)}"
+
+    async def run(self):
+        attempt = 0
+        while True:
+            try:
+                async with websockets.connect(self.url(), subprotocols=[BINARY_SUBPROTOCOL],
+                                              max_size=None, open_timeout=RELAY_TIMEOUT) as socket:
+                    self.socket = socket
+                    attempt = 0
+                    logger.info(f"中继已连接主服务器 (房间: {self.room.name})")
+                    clock_task = asyncio.get_running_loop().create_task(self.sync_clock())
+                    try:
+                        async for raw in socket:
+                            await self.handle(BINARY_CODEC.decode(raw))
+                    finally:
+                        clock_task.cancel()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"中继上游连接断开 (房间: {self.room.name}): {e}")
+            finally:
+                self.socket = None
+            delay = min(RELAY_RECONNECT_MAX, 0.25 * 2 ** attempt)
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def sync_clock(self):
+        """定期与主服务器对时（主服务器原样带回发送时间，不进入事件日志）"""
+        socket = self.socket
+        while True:
+            for _ in range(CLOCK_SYNC_BURST):
+                try:
+                    await socket.send(BINARY_CODEC.encode({"type": "clock_sync", "data": {"client": time.time() * 1000}}))
+                except Exception:
+                    return  # 连接已断开，重连后重新对时
+                await asyncio.sleep(0.2)
+            await asyncio.sleep(CLOCK_SYNC_INTERVAL)
+
+    def handle_clock_sync(self, data: dict):
+        sent = data.get("client")
+        if not isinstance(sent, (int, float)) or not isinstance(data.get("server"), (int, float)):
+            return
+        now = time.time() * 1000
+        self.clock_samples.append((data["server"] - (sent + now) / 2, now - sent))
+        self.clock_offset = min(self.clock_samples, key=lambda sample: sample[1])[0]
+
+    async def handle(self, message: dict):
+        kind = message.get("type")
+        if kind == "session":
+            # 主服务器的会话信息只用于上游重连，本地显示端有自己的会话
+            data = message.get("data") or {}
+            self.token, self.seq = data.get("token"), data.get("seq")
+            return
+        if kind == "clock_sync":
+            self.handle_clock_sync(message.get("data") or {})
+            return
+        seq = message.pop("seq", None)
+        if isinstance(seq, int):
+            self.seq = seq
+        if kind == "cue" and isinstance((message.get("data") or {}).get("at"), (int, float)):
+            # 本地显示端与中继对时，开始时间换算成中继的时钟
+            message["data"] = {**message["data"], "at": round(message["data"]["at"] - self.clock_offset)}
+        self.room.mirror(message)
+        await self.room.send_to_local_displays(message)
+
+    async def forward(self, message: dict):
+        """本地显示端上报的消息转发给主服务器（播放进度每秒最多一次，多个显示端只需要一份）"""
+        if self.socket is None or message.get("type") not in FORWARDED_TYPES:
+            return
+        if message.get("type") == "time_update":
+            now = time.monotonic()
+            if now - self.last_time_forward < 1.0:
+                return
+            self.last_time_forward = now
+        try:
+            await self.socket.send(BINARY_CODEC.encode(message))
+        except Exception as e:
+            logger.debug(f"转发到主服务器失败: {e}")
+
+
+def websocket_base(upstream: str) -> str:
+    """http(s)://主机:端口 -> ws(s)://主机:端口"""
+    return "ws" + upstream[len("http"):] if upstream.startswith("http") else upstream
+
+
+class UpstreamMedia:
+    """从主服务器下载上传目录中的文件（中继按需下载，热备实例后台同步）"""
+
+    def __init__(self, upstream: str, root: Path):
+        self.upstream = upstream
+        self.root = root
+        self.downloads: Dict[str, asyncio.Future] = {}
+
+    async def ensure(self, relative: str) -> bool:
+        """确保上传目录中的文件（相对路径，如 music/xxx.mp3）在本地，不在时从主服务器下载（同一文件只下载一次）"""
+        path = self.root / relative
+        if path.is_file():
+            relay_media_requests.inc(result="hit")
+            return True
+        future = self.downloads.get(relative)
+        if future is None:
+            future = self.downloads[relative] = asyncio.ensure_future(asyncio.to_thread(self.download, relative, path))
+            future.add_done_callback(lambda _: self.downloads.pop(relative, None))
+        return await asyncio.shield(future)
+
+    def download(self, relative: str, path: Path) -> bool:
+        """从主服务器下载一个文件（阻塞调用，先写临时文件再原子替换）"""
+        url = f"{self.upstream}/uploads/{quote(relative)}"
+        temp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.part")
+        started = time.perf_counter()
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with urllib.request.urlopen(url, timeout=RELAY_TIMEOUT) as response, open(temp_path, "wb") as f:
+                shutil.copyfileobj(response, f, MEDIA_CHUNK_SIZE)
+                size = f.tell()
+            os.replace(temp_path, path)
+        except OSError as e:
+            temp_path.unlink(missing_ok=True)
+            relay_media_requests.inc(result="error")
+            logger.warning(f"从主服务器下载失败 {relative}: {e}")
+            return False
+        relay_media_requests.inc(result="fetched")
+        relay_upstream_bytes.inc(size)
+        logger.info(f"已从主服务器缓存 {relative} ({size} 字节, {(time.perf_counter() - started) * 1000:.0f} ms)")
+        return True
+
+    def fetch_json(self, path: str) -> dict:
+        """请求主服务器的JSON接口（阻塞调用）"""
+        with urllib.request.urlopen(f"{self.upstream}{path}", timeout=RELAY_TIMEOUT) as response:
+            return json.loads(response.read())
+
+
+class Relay:
+    def __init__(self, upstream: str, root: Path):
+        self.upstream = upstream.rstrip("/")
+        self.ws_base = websocket_base(self.upstream)
+        self.media = UpstreamMedia(self.upstream, root)
+        self.links: Dict[str, RelayLink] = {}
+
+    def follow(self, room) -> RelayLink:
+        """开始镜像房间的状态（已在镜像时直接返回）"""
+        link = self.links.get(room.name)
+        if link is None:
+            link = self.links[room.name] = RelayLink(self, room)
+            link.task = asyncio.get_running_loop().create_task(link.run())
+        return link
+
+    async def forward(self, room, message: dict):
+        link = self.links.get(room.name)
+        if link is not None:
+            await link.forward(message)
+
+    async def stop(self):
+        for link in self.links.values():
+            if link.task is not None:
+                link.task.cancel()
+        for link in self.links.values():
+            if link.task is not None:
+                try:
+                    await link.task
+                except asyncio.CancelledError:
+                    pass
+        self.links.clear()
+
+
+def upload_path(path: str) -> Optional[str]:
+    """请求路径对应的上传目录相对路径（子目录/文件名），不是上传文件时返回None"""
+    for prefix, subdir in (("/media/", ""), ("/uploads/", ""), ("/api/lyrics/", "lyrics/")):
+        if path.startswith(prefix):
+            parts = (subdir + path[len(prefix):]).split("/")
+            if len(parts) != 2 or any(part in ("", ".", "..") for part in parts) or parts[1].startswith("."):
+                return None
+            return "/".join(parts)
+    return None
+
+
+class MediaMirrorMiddleware:
+    """ASGI中间件：读取上传文件的请求先确保文件已从主服务器下载（不包装响应，流式传输和零拷贝不受影响）"""
+
+    def __init__(self, app, media: UpstreamMedia):
+        self.app = app
+        self.media = media
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] in ("GET", "HEAD"):
+            relative = upload_path(scope["path"])
+            if relative is not None:
+                await self.media.ensure(relative)
+        await self.app(scope, receive, send)
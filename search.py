@@ -0,0 +1,367 @@
+"""
+曲库搜索索引
+
+内存中的倒排索引，覆盖标题、艺术家和歌词文本：
+- 英文/数字按单词索引，中日韩文字按每个位置开始的片段索引，查询时按前缀匹配（相当于子串匹配）
+- 中文标题和艺术家额外索引全拼和首字母（需要 pypinyin，没有安装时跳过），“zjl”“jielun” 都能搜到周杰伦；
+  pypinyin 导入较慢，第一次用到时才导入（建立索引在后台线程中，不影响启动）
+- 词项保存在有序列表中，前缀查询用二分查找定位。增量更新时新词项先放进一个较小的有序列表（两个列表都查），
+  积累到一定数量再合并；删除的词项先留在列表中查询时跳过，积累到一定比例再一次清理
+- 服务器中的增删通过 schedule 在专用线程中按顺序执行（读取歌词、计算词项较慢），不阻塞事件循环
+- 边输入边搜索时最常见的一两个字符的查询，前缀对应的词项很多，按前缀预先汇总到每首曲目，不再逐个词项扫描
+"""
+
+import re
+import time
+import heapq
+import bisect
+import logging
+import threading
+import unicodedata
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from config import SEARCH_INDEX_LYRICS, SEARCH_FRAGMENT_LENGTH
+from media import read_lyrics_text, url_to_path
+
+logger = logging.getLogger(__name__)
+
+# pypinyin 的 lazy_pinyin，第一次用到时导入；None 表示没有安装
+_lazy_pinyin = None
+_pinyin_loaded = False
+_pinyin_lock = threading.Lock()
+
+# 字段权重（同一首歌命中多个字段时取最高）
+FIELD_WEIGHTS = {"title": 4, "artist": 2, "lyrics": 1}
+FIELD_BITS = {"title": 1, "artist": 2, "lyrics": 4}
+BITS_WEIGHT = [max([FIELD_WEIGHTS[field] for field, bit in FIELD_BITS.items() if bits & bit], default=0)
+               for bits in range(8)]
+
+# 缓存的前缀匹配结果数（边输入边搜索时前面的词不用重新匹配）
+MATCH_CACHE_SIZE = 256
+
+# 不超过这个长度的前缀预先汇总到每首曲目
+SHORT_PREFIX_LENGTH = 2
+
+# 连续的中日韩文字、连续的字母数字
+CJK_RUN = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]+')
+WORD = re.compile(r'[0-9a-z]+')
+HAN = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]')
+
+# 歌词里的时间标签、ASS样式标签
+LYRICS_TAG = re.compile(r'\[[^\]]*\]|\{[^}]*\}|<[^>]*>')
+
+
+def normalize(text: str) -> str:
+    return unicodedata.normalize('NFKC', text or '').lower()
+
+
+def cjk_fragments(run: str, length: int = SEARCH_FRAGMENT_LENGTH) -> List[str]:
+    """从每个位置开始截取的片段，前缀匹配这些片段就是子串匹配"""
+    return [run[i:i + length] for i in range(len(run))]
+
+
+def load_pinyin():
+    """导入 pypinyin（只导入一次）"""
+    global _lazy_pinyin, _pinyin_loaded
+    if _pinyin_loaded:
+        return _lazy_pinyin
+    with _pinyin_lock:
+        if not _pinyin_loaded:
+            try:
+                from pypinyin import lazy_pinyin
+                _lazy_pinyin = lazy_pinyin
+            except ImportError:
+                logger.info("未安装pypinyin，搜索不支持拼音匹配")
+            _pinyin_loaded = True
+    return _lazy_pinyin
+
+
+def pinyin_terms(run: str) -> List[str]:
+    """汉字串从每个字开始的全拼和首字母"""
+    if not HAN.search(run):
+        return []
+    lazy_pinyin = load_pinyin()
+    if lazy_pinyin is None:
+        return []
+    syllables = [syllable for syllable in lazy_pinyin(run) if syllable.isalpha()]
+    initials = [syllable[0] for syllable in syllables]
+    terms = []
+    for i in range(len(syllables)):
+        terms.append(''.join(syllables[i:]))
+        terms.append(''.join(initials[i:]))
+    return terms
+
+
+def field_terms(text: str, with_pinyin: bool) -> Set[str]:
+    text = normalize(text)
+    terms = set(WORD.findall(text))
+    for run in CJK_RUN.findall(text):
+        terms.update(cjk_fragments(run))
+        if with_pinyin:
+            terms.update(pinyin_terms(run))
+    return terms
+
+
+def query_tokens(query: str, length: int = SEARCH_FRAGMENT_LENGTH) -> List[str]:
+    """查询拆成词：单词原样保留，中文超过片段长度时按片段长度切开"""
+    text = normalize(query)
+    tokens = WORD.findall(text)
+    for run in CJK_RUN.findall(text):
+        tokens.extend(run[i:i + length] for i in range(0, max(1, len(run) - length) + 1, length))
+        if len(run) > length and len(run) % length:
+            tokens.append(run[-length:])
+    return list(dict.fromkeys(tokens))
+
+
+def lyrics_plain_text(lyrics_text: str) -> str:
+    """去掉歌词中的时间标签、字幕序号和时间轴，只保留文字"""
+    lines = []
+    for line in lyrics_text.splitlines():
+        if line.startswith('Dialogue:'):
+            line = line.split(',', 9)[-1]
+        elif '-->' in line or line.strip().isdigit():
+            continue
+        lines.append(LYRICS_TAG.sub(' ', line))
+    return '\n'.join(lines)
+
+
+class SearchIndex:
+    """倒排索引：词项 -> {曲目ID: 命中字段位}"""
+
+    def __init__(self, index_lyrics: bool = SEARCH_INDEX_LYRICS):
+        self.index_lyrics = index_lyrics
+        self.lock = threading.RLock()
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.terms: List[str] = []  # 有序，用于前缀查询
+        self.recent_terms: List[str] = []  # 有序，增量添加的新词项，积累到一定数量后合并进 terms
+        self.new_terms: Set[str] = set()  # 还没有放进 recent_terms 的新词项
+        self.removed_terms: Set[str] = set()  # 已经没有曲目、还留在两个列表中的词项
+        # 短前缀 -> {曲目ID: (以它开头的词项的字段位, 等于它的词项的字段位)}
+        self.short_prefixes: Dict[str, Dict[str, Tuple[int, int]]] = {}
+        self.doc_terms: Dict[str, Set[str]] = {}
+        self.documents: Dict[str, object] = {}  # 曲目ID -> 曲目对象（与播放列表中的是同一个对象）
+        self.building = False
+        self.removed_while_building: Set[str] = set()
+        self.match_cache: Dict[Tuple[str, int], Dict[str, int]] = {}
+        self.executor: Optional[ThreadPoolExecutor] = None
+
+    def __len__(self) -> int:
+        return len(self.doc_terms)
+
+    def track_fields(self, track) -> Dict[str, str]:
+        fields = {"title": track.title or "", "artist": track.artist or ""}
+        if self.index_lyrics and track.lyrics_url:
+            path = url_to_path(track.lyrics_url)
+            try:
+                if path is not None and path.is_file():
+                    fields["lyrics"] = lyrics_plain_text(read_lyrics_text(path))
+            except (OSError, UnicodeDecodeError) as e:
+                logger.warning(f"读取歌词失败，搜索索引跳过歌词 {track.lyrics_url}: {e}")
+        return fields
+
+    def schedule(self, function, *args) -> Future:
+        """在索引线程中按调用顺序执行（add、update、remove），出错时记录日志"""
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="search-index")
+        return self.executor.submit(self.run_logged, function, *args)
+
+    @staticmethod
+    def run_logged(function, *args):
+        try:
+            function(*args)
+        except Exception as e:
+            logger.error(f"更新搜索索引失败: {e}")
+
+    def add(self, track):
+        """索引一首曲目（已存在时先删除旧的词项）"""
+        # 在锁外读取歌词和计算词项
+        terms: Dict[str, int] = {}
+        for field, text in self.track_fields(track).items():
+            for term in field_terms(text, with_pinyin=field != "lyrics"):
+                terms[term] = terms.get(term, 0) | FIELD_BITS[field]
+        prefixes: Dict[str, Tuple[int, int]] = {}
+        for term, bits in terms.items():
+            for length in range(1, min(len(term), SHORT_PREFIX_LENGTH) + 1):
+                prefix = term[:length]
+                prefix_bits, exact_bits = prefixes.get(prefix, (0, 0))
+                prefixes[prefix] = (prefix_bits | bits, exact_bits | (bits if length == len(term) else 0))
+
+        with self.lock:
+            if self.building and track.id in self.removed_while_building:
+                return
+            self.discard(track.id)
+            self.match_cache.clear()
+            for term, bits in terms.items():
+                posting = self.postings.get(term)
+                if posting is None:
+                    posting = self.postings[term] = {}
+                    if term in self.removed_terms:
+                        self.removed_terms.discard(term)  # 还在 terms 中
+                    else:
+                        self.new_terms.add(term)
+                posting[track.id] = bits
+            for prefix, entry in prefixes.items():
+                self.short_prefixes.setdefault(prefix, {})[track.id] = entry
+            self.doc_terms[track.id] = set(terms)
+            self.documents[track.id] = track
+
+    def discard(self, track_id: str):
+        with self.lock:
+            self.match_cache.clear()
+            terms = self.doc_terms.pop(track_id, ())
+            for prefix in {term[:length] for term in terms
+                           for length in range(1, min(len(term), SHORT_PREFIX_LENGTH) + 1)}:
+                bucket = self.short_prefixes.get(prefix)
+                if bucket is not None:
+                    bucket.pop(track_id, None)
+                    if not bucket:
+                        del self.short_prefixes[prefix]
+            for term in terms:
+                posting = self.postings.get(term)
+                if posting is None:
+                    continue
+                posting.pop(track_id, None)
+                if not posting:
+                    del self.postings[term]
+                    if term in self.new_terms:
+                        self.new_terms.discard(term)
+                    else:
+                        self.removed_terms.add(term)
+
+    def remove(self, track_id: str):
+        with self.lock:
+            self.discard(track_id)
+            self.documents.pop(track_id, None)
+            if self.building:
+                self.removed_while_building.add(track_id)
+
+    def update(self, track, changed_fields: Iterable[str]):
+        """曲目字段变化时重新索引（只关心标题、艺术家和歌词）"""
+        if {"title", "artist", "lyrics_url"} & set(changed_fields):
+            self.add(track)
+
+    def rebuild(self, tracks: List):
+        """重建索引（在线程中运行，期间的增删照常生效）"""
+        start = time.perf_counter()
+        with self.lock:
+            self.postings.clear()
+            self.terms.clear()
+            self.recent_terms.clear()
+            self.new_terms.clear()
+            self.removed_terms.clear()
+            self.short_prefixes.clear()
+            self.doc_terms.clear()
+            self.documents.clear()
+            self.match_cache.clear()
+            self.building = True
+            self.removed_while_building.clear()
+        try:
+            for track in tracks:
+                self.add(track)
+        finally:
+            with self.lock:
+                self.building = False
+                self.removed_while_building.clear()
+                # 建立索引时不维护有序列表，最后一次排序
+                self.terms = sorted(self.postings)
+                self.recent_terms = []
+                self.new_terms = set()
+                self.removed_terms = set()
+        logger.info(f"搜索索引已建立: {len(tracks)} 首，{len(self.terms)} 个词项，"
+                    f"耗时 {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    def match(self, token: str, field_mask: int) -> Dict[str, int]:
+        """前缀匹配一个查询词，返回 {曲目ID: 得分}（完全匹配的词项加一分），结果会被缓存，调用方不能修改"""
+        key = (token, field_mask)
+        matched = self.match_cache.get(key)
+        if matched is not None:
+            return matched
+
+        if len(token) <= SHORT_PREFIX_LENGTH:
+            matched = self.match_short(token, field_mask)
+        else:
+            matched = self.match_terms(token, field_mask)
+
+        if len(self.match_cache) >= MATCH_CACHE_SIZE:
+            del self.match_cache[next(iter(self.match_cache))]
+        self.match_cache[key] = matched
+        return matched
+
+    def match_short(self, token: str, field_mask: int) -> Dict[str, int]:
+        """短查询词：直接读取按前缀汇总的字段位"""
+        matched = {}
+        for track_id, (prefix_bits, exact_bits) in self.short_prefixes.get(token, {}).items():
+            score = BITS_WEIGHT[prefix_bits & field_mask]
+            if exact_bits & field_mask:
+                score = max(score, BITS_WEIGHT[exact_bits & field_mask] + 1)
+            if score:
+                matched[track_id] = score
+        return matched
+
+    def sorted_terms(self) -> Tuple[List[str], List[str]]:
+        """整理增删的词项，返回两个有序词项列表（持有锁时调用）"""
+        if len(self.removed_terms) > len(self.terms) // 8:
+            removed = self.removed_terms
+            self.terms = [term for term in self.terms if term not in removed]
+            self.recent_terms = [term for term in self.recent_terms if term not in removed]
+            self.removed_terms = set()
+        if self.new_terms:
+            self.recent_terms = sorted(self.recent_terms + list(self.new_terms))
+            self.new_terms = set()
+        if len(self.recent_terms) > max(1024, len(self.terms) // 16):
+            # 两段都有序，timsort 合并只需要线性时间
+            self.terms += self.recent_terms
+            self.terms.sort()
+            self.recent_terms = []
+        return self.terms, self.recent_terms
+
+    def match_terms(self, token: str, field_mask: int) -> Dict[str, int]:
+        """逐个扫描以查询词开头的词项（跳过已经删除的）"""
+        matched = {}
+        for terms in self.sorted_terms():
+            position = bisect.bisect_left(terms, token)
+            while position < len(terms) and terms[position].startswith(token):
+                term = terms[position]
+                position += 1
+                posting = self.postings.get(term)
+                if posting is None:
+                    continue
+                bonus = 1 if term == token else 0
+                for track_id, bits in posting.items():
+                    weight = BITS_WEIGHT[bits & field_mask]
+                    if weight and weight + bonus > matched.get(track_id, 0):
+                        matched[track_id] = weight + bonus
+        return matched
+
+    def search(self, query: str, offset: int = 0, limit: int = 20,
+               fields: Optional[Iterable[str]] = None) -> Tuple[int, List]:
+        """返回 (命中总数, 当前页的曲目)，所有查询词都要命中（AND）"""
+        tokens = query_tokens(query)
+        if not tokens:
+            return 0, []
+        field_mask = sum(FIELD_BITS[field] for field in set(fields or FIELD_BITS) if field in FIELD_BITS)
+
+        with self.lock:
+            scores: Optional[Dict[str, int]] = None
+            # 先处理长的查询词，候选集合更小
+            for token in sorted(tokens, key=len, reverse=True):
+                matched = self.match(token, field_mask)
+                if scores is None:
+                    scores = dict(matched)
+                else:
+                    scores = {track_id: score + matched[track_id]
+                              for track_id, score in scores.items() if track_id in matched}
+                if not scores:
+                    return 0, []
+
+            # 只需要排出当前页之前的部分，得分相同时按播放列表顺序
+            documents = self.documents
+            ranked = heapq.nsmallest(offset + limit, scores,
+                                     key=lambda track_id: (-scores[track_id], documents[track_id].position or ""))
+            page = [self.documents[track_id] for track_id in ranked[offset:]]
+        return len(scores), page
+
+
+# 全局实例
+search_index = SearchIndex()
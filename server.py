@@ -1,29 +1,31 @@
+import time
+
+# 记录导入耗时（启动报告使用）
+IMPORT_STARTED = time.perf_counter()
+
 import os
+import re
 import json
 import uuid
+import bisect
+import random
+import hashlib
 import asyncio
+import itertools
 import logging
+import threading
 from datetime import datetime
-from typing import Dict, List, Optional, Set
+from typing import Dict, Iterator, List, Optional, Set
+from contextlib import asynccontextmanager
 from pathlib import Path
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, UploadFile, File, Form, HTTPException
-from fastapi.responses import FileResponse, HTMLResponse, JSONResponse
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, UploadFile, File, Form, HTTPException, Request
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, PlainTextResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-import uvicorn
 from dotenv import load_dotenv
 
-import mutagen
-from mutagen.mp3 import MP3
-from mutagen.flac import FLAC
-from mutagen.oggvorbis import OggVorbis
-from mutagen.wave import WAVE
-from mutagen.mp4 import MP4
-from mutagen.asf import ASF
-from mutagen.aac import AAC
-
 from config import *
 
 # 加载环境变量
@@ -31,6 +33,26 @@ load_dotenv()
 
 # 导入持久化管理器
 from persistence import persistence_manager
+from analysis import track_analyzer
+from transcode import transcode_queue
+from streaming import MediaServer
+from media import get_audio_duration, read_lyrics_text
+from ingest import ImportBatch, library_digests, store_digests, present_digests
+from search import search_index
+from playlist import OrderedList, shuffle_key
+from session import EventLog
+from delivery import DeliveryTracker
+from timeline import Timeline, OVERRIDE_COMMANDS, PLAYHEAD_COMMANDS
+from checkpoint import PlaybackCheckpoint, extrapolate
+from offline import offline_manifest
+from relay import Relay, MediaMirrorMiddleware
+from standby import Standby
+from collector import UploadCollector
+from bus import MessageBus, BusHub, create_bus
+from wire import ClientConnection, encode_per_codec, TYPE_CODES
+from profiler import loop_watchdog, sampling_profiler
+from metrics import registry, startup_duration, loop_lag_monitor, command_duration, broadcast_duration, upload_bytes, upload_duration, session_resumes
+from metrics import display_ack_latency, display_retransmits, display_dropped
 
 # 配置日志
 logging.basicConfig(
@@ -39,10 +61,20 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：加载曲库等初始化工作放在启动阶段，导入 server 本身没有副作用"""
+    await startup()
+    try:
+        yield
+    finally:
+        await shutdown()
+
 app = FastAPI(
     title="班级元旦晚会远程控制系统",
     description="远程控制音乐播放和幻灯片显示系统",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # 允许跨域
@@ -54,9 +86,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# 挂载静态文件
-app.mount("/static", StaticFiles(directory="static"), name="static")
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+# 挂载静态文件（目录在启动阶段才创建，这里不检查是否存在）
+app.mount("/static", StaticFiles(directory="static", check_dir=False), name="static")
+app.mount("/uploads", StaticFiles(directory="uploads", check_dir=False), name="uploads")
 app.mount("/admin", StaticFiles(directory="admin"), name="admin")
 app.mount("/display", StaticFiles(directory="display"), name="display")
 # 数据模型
@@ -68,137 +100,305 @@ class Track(BaseModel):
     cover_url: str
     lyrics_url: Optional[str] = None
     duration: int = 0
+    # 后台分析结果
+    loudness: Optional[float] = None
+    gain_db: Optional[float] = None
+    waveform_url: Optional[str] = None
+    # 响度标准化的转码版本（显示端优先播放）
+    stream_url: Optional[str] = None
+    # 文件内容摘要（批量导入时用于跳过重复文件）
+    sha1: Optional[str] = None
+    # 播放列表中的位置键（见 playlist.py），移动曲目只修改这一项
+    position: Optional[str] = None
 
 class Slide(BaseModel):
     id: str
     name: str
     url: str
     thumbnail_url: Optional[str] = None
+    position: Optional[str] = None
 
 class ControlCommand(BaseModel):
     type: str
     data: Optional[Dict] = None
 
-# 全局状态管理器
-class StateManager:
-    def __init__(self):
+# 房间名称只允许字母、数字、下划线和横线
+ROOM_NAME_PATTERN = re.compile(r'^[\w-]{1,32}$')
+
+# 播放房间（会场）：每个房间有独立的播放状态和连接，曲库在所有房间间共享
+class Room:
+    def __init__(self, name: str, manager: "StateManager"):
+        self.name = name
+        self.manager = manager
+        
         # WebSocket连接
-        self.admin_connections: Set[WebSocket] = set()
-        self.display_connections: Set[WebSocket] = set()
+        self.admin_connections: Set[ClientConnection] = set()
+        self.display_connections: Set[ClientConnection] = set()
         
-        # 播放状态
+        # 播放状态（当前曲目和幻灯片按ID记录，列表顺序变化时下标随之计算）
         self.current_mode: str = "music"  # "music" 或 "slide"
-        self.current_track_index: int = -1
-        self.current_slide_index: int = -1
         self.is_playing: bool = False
         self.current_time: float = 0.0
         self.volume: int = 80
         
-        # 从持久化存储加载数据
-        self.playlist: List[Track] = []
-        self.slides: List[Slide] = []
-        self.load_from_persistence()
-        
         # 当前显示的内容
-        self.current_track: Optional[Track] = None
-        self.current_slide: Optional[Slide] = None
+        self.current_track: Optional[Track] = self.playlist[0] if self.playlist else None
+        self.current_slide: Optional[Slide] = self.slides[0] if self.slides else None
         
-        # 创建默认封面
-        self.create_default_cover()
+        # 待播队列（曲目ID，优先于列表顺序播放）
+        self.up_next: List[str] = []
+        
+        # 随机播放：按种子打乱的曲目ID顺序，其他工作进程用同一个种子得到相同的顺序
+        self.shuffle_seed: Optional[int] = None
+        self.shuffle_order: List[str] = []
+        self.shuffle_keys: List[int] = []  # 与 shuffle_order 对应的排序键（递增）
+        
+        self.last_playhead_publish: float = 0.0
+        # 从检查点恢复后、显示端上报进度之前，按本进程时钟推算进度（monotonic 起点）
+        self.playhead_anchor: Optional[float] = None
+        
+        # 断线重连时补发的最近广播消息
+        self.display_log = EventLog()
+        self.admin_log = EventLog()
+        
+        # 各显示端离线缓存的下载进度（显示端ID -> 最近一次上报）
+        self.cache_status: Dict[str, dict] = {}
+        
+        # 关键命令的显示端送达确认
+        self.delivery = DeliveryTracker()
+        
+        # 演出流程：按提示列表自动切换曲目和幻灯片
+        self.timeline = Timeline(self)
+        
+        # 中继模式：主服务器最近一次推送的预取清单（本地没有曲库，不能自己生成）
+        self.mirrored_prefetch: Optional[dict] = None
+        # 中继模式：主服务器已经下发、还没到开始时间的提示（开始时间已换算成本地时钟）
+        self.mirrored_cue: Optional[dict] = None
+        self.mirrored_cue_handle: Optional[asyncio.TimerHandle] = None
     
-    def create_default_cover(self):
-        """创建默认封面图片"""
-        default_cover_path = UPLOAD_FOLDER / "covers" / "default-cover.jpg"
-        if not default_cover_path.exists():
-            try:
-                # 创建一个简单的默认封面
-                from PIL import Image, ImageDraw, ImageFont
-                import io
-                
-                # 创建新图片
-                img = Image.new('RGB', (800, 800), color='#667eea')
-                draw = ImageDraw.Draw(img)
-                
-                # 添加文字
-                try:
-                    font = ImageFont.truetype("arial.ttf", 60)
-                except:
-                    font = ImageFont.load_default()
-                
-                text = "元旦晚会\n音乐系统"
-                bbox = draw.textbbox((0, 0), text, font=font)
-                text_width = bbox[2] - bbox[0]
-                text_height = bbox[3] - bbox[1]
-                
-                position = ((800 - text_width) // 2, (800 - text_height) // 2)
-                draw.text(position, text, fill="white", font=font)
-                
-                # 保存图片
-                img.save(default_cover_path, "JPEG")
-                logger.info("创建默认封面成功")
-            except Exception as e:
-                logger.warning(f"创建默认封面失败: {e}")
-                # 创建一个纯色图片作为备用
-                img = Image.new('RGB', (800, 800), color='#667eea')
-                img.save(default_cover_path, "JPEG")
+    @property
+    def playlist(self) -> OrderedList[Track]:
+        return self.manager.playlist
     
-    async def connect_admin(self, websocket: WebSocket):
-        await websocket.accept()
-        self.admin_connections.add(websocket)
-        await self.send_admin_state(websocket)
+    @property
+    def slides(self) -> OrderedList[Slide]:
+        return self.manager.slides
     
-    async def connect_display(self, websocket: WebSocket):
-        await websocket.accept()
-        self.display_connections.add(websocket)
-        await self.send_display_state(websocket)
+    @property
+    def current_track_index(self) -> int:
+        return self.playlist.index_of(self.current_track.id) if self.current_track else -1
     
-    def disconnect_admin(self, websocket: WebSocket):
-        if websocket in self.admin_connections:
-            self.admin_connections.remove(websocket)
+    @property
+    def current_slide_index(self) -> int:
+        return self.slides.index_of(self.current_slide.id) if self.current_slide else -1
     
-    def disconnect_display(self, websocket: WebSocket):
-        if websocket in self.display_connections:
-            self.display_connections.remove(websocket)
+    async def connect_admin(self, websocket: WebSocket, resume: Optional[str] = None,
+                            seq: Optional[int] = None) -> ClientConnection:
+        connection = await ClientConnection.accept(websocket, "admin")
+        await self.start_session(connection, self.admin_log, self.send_admin_state, resume, seq)
+        self.admin_connections.add(connection)
+        return connection
+    
+    async def connect_display(self, websocket: WebSocket, resume: Optional[str] = None,
+                              seq: Optional[int] = None) -> ClientConnection:
+        connection = await ClientConnection.accept(websocket, "display")
+        if websocket.query_params.get("ack") == "1":
+            client_id = websocket.query_params.get("client") or f"display-{id(connection):x}"
+            self.delivery.register(connection, client_id[:64])
+        if self.manager.relay is not None:
+            self.manager.relay.follow(self)
+        await self.start_session(connection, self.display_log, self.send_display_state, resume, seq)
+        self.display_connections.add(connection)
+        return connection
+    
+    async def start_session(self, connection: ClientConnection, log: EventLog, send_snapshot,
+                            resume: Optional[str], seq: Optional[int]):
+        """客户端带着恢复令牌重连时只补发缺少的消息，否则发送完整状态
+        
+        调用方在之后才把连接加入广播集合；这里的发送只是放入发送队列，中间不会切换任务，
+        所以补发的消息和之后的广播之间不会漏掉或重复。
+        """
+        missed = log.since(resume, seq)
+        if missed is None:
+            session_resumes.inc(target=connection.kind, result="snapshot")
+            await connection.send(log.session(resumed=False))
+            await send_snapshot(connection)
+            return
+        
+        session_resumes.inc(target=connection.kind, result="replayed")
+        await connection.send(log.session(resumed=True, replayed=len(missed)))
+        for event in missed:
+            await connection.send(event)
+    
+    def disconnect_admin(self, connection: ClientConnection):
+        connection.close()
+        if connection in self.admin_connections:
+            self.admin_connections.remove(connection)
+    
+    def disconnect_display(self, connection: ClientConnection):
+        connection.close()
+        self.delivery.unregister(connection)
+        if connection in self.display_connections:
+            self.display_connections.remove(connection)
     
     async def broadcast_to_display(self, command: ControlCommand):
-        """向所有显示端广播命令"""
-        for connection in self.display_connections:
-            try:
-                await connection.send_json(command.dict())
-            except Exception as e:
-                logger.error(f"广播到显示端失败: {e}")
+        """向本房间所有显示端广播命令（包括其他工作进程上的连接）"""
+        payload = command.dict()
+        await self.send_to_local_displays(payload)
+        self.manager.publish("broadcast", room=self.name, target="display", command=payload)
     
     async def broadcast_to_admin(self, command: ControlCommand):
-        """向所有管理端广播状态更新"""
-        for connection in self.admin_connections:
-            try:
-                await connection.send_json(command.dict())
-            except Exception as e:
-                logger.error(f"广播到管理端失败: {e}")
+        """向本房间所有管理端广播状态更新（包括其他工作进程上的连接）"""
+        payload = command.dict()
+        await self.send_to_local_admins(payload)
+        self.manager.publish("broadcast", room=self.name, target="admin", command=payload)
+    
+    async def send_to_local_displays(self, payload: dict):
+        """发送给本进程的显示端连接（同时记入事件日志，带上序号；关键命令要求显示端确认）"""
+        if payload.get("type") in ACK_COMMANDS:
+            payload = {**payload, "ack": True}
+        payload = self.display_log.append(payload)
+        connections = list(self.display_connections)
+        with broadcast_duration.time(target="display"):
+            frames = encode_per_codec(connections, payload)
+            for connection in connections:
+                frame = frames[connection.codec.name]
+                try:
+                    await connection.send_frame(frame)
+                    if payload.get("ack"):
+                        self.delivery.sent(connection, payload["seq"], frame)
+                except Exception as e:
+                    logger.error(f"广播到显示端失败: {e}")
+    
+    async def send_to_local_admins(self, payload: dict):
+        """发送给本进程的管理端连接（同时记入事件日志，带上序号）"""
+        payload = self.admin_log.append(payload)
+        connections = list(self.admin_connections)
+        with broadcast_duration.time(target="admin"):
+            frames = encode_per_codec(connections, payload)
+            for connection in connections:
+                try:
+                    await connection.send_frame(frames[connection.codec.name])
+                except Exception as e:
+                    logger.error(f"广播到管理端失败: {e}")
+    
+    def snapshot_state(self) -> dict:
+        """播放状态快照（不含曲库）"""
+        return {
+            "mode": self.current_mode,
+            "current_track_id": self.current_track.id if self.current_track else None,
+            "current_track_index": self.current_track_index,
+            "current_slide_id": self.current_slide.id if self.current_slide else None,
+            "current_slide_index": self.current_slide_index,
+            "is_playing": self.is_playing,
+            "current_time": self.playhead(),
+            "volume": self.volume,
+            "up_next": self.up_next,
+            "shuffle_seed": self.shuffle_seed,
+        }
+    
+    def apply_state(self, state: dict):
+        """应用其他进程发布的播放状态快照"""
+        self.current_mode = state.get("mode", self.current_mode)
+        self.is_playing = state.get("is_playing", self.is_playing)
+        self.current_time = state.get("current_time", self.current_time)
+        self.volume = state.get("volume", self.volume)
+        self.current_track = self.playlist.get(state.get("current_track_id"))
+        self.current_slide = self.slides.get(state.get("current_slide_id"))
+        self.up_next = list(state.get("up_next", self.up_next))
+        if state.get("shuffle_seed", self.shuffle_seed) != self.shuffle_seed:
+            self.set_shuffle(state.get("shuffle_seed") is not None, state.get("shuffle_seed"))
+        if self.playhead_anchor is not None:
+            self.playhead_anchor = time.monotonic()
+    
+    def restore(self, record: dict):
+        """从检查点恢复播放状态，正在播放时按停机时间推算进度"""
+        self.apply_state(record["state"])
+        if self.current_track is None and self.playlist:
+            # 检查点中的曲目已被删除
+            self.current_track = self.playlist[0]
+            self.is_playing = False
+            self.current_time = 0.0
+        else:
+            self.current_time = extrapolate(record, self.current_track.duration if self.current_track else None)
+        if self.current_slide is None and self.slides:
+            self.current_slide = self.slides[0]
+        self.playhead_anchor = time.monotonic() if self.is_playing else None
+    
+    def playhead(self) -> float:
+        """当前进度：恢复后还没有显示端上报时按经过的时间推算"""
+        if self.is_playing and self.playhead_anchor is not None:
+            return self.current_time + time.monotonic() - self.playhead_anchor
+        return self.current_time
+    
+    def settle_playhead(self):
+        """把推算的进度写回 current_time（处理命令前调用，命令可以直接修改进度和播放状态）"""
+        if self.playhead_anchor is not None:
+            self.current_time = self.playhead()
+            self.playhead_anchor = time.monotonic()
     
-    async def send_admin_state(self, websocket: WebSocket):
-        """发送完整状态给管理端"""
+    def publish_state(self):
+        """同步播放状态到其他工作进程，并写入检查点"""
+        state = self.snapshot_state()
+        self.manager.publish("state", room=self.name, state=state)
+        self.manager.checkpoint.record(self.name, state)
+    
+    def publish_playhead(self, interval: float = 1.0):
+        """发布播放进度（限频，显示端每秒会上报多次）"""
+        now = time.monotonic()
+        if now - self.last_playhead_publish >= interval:
+            self.last_playhead_publish = now
+            self.publish_state()
+    
+    def build_state(self, track_fields: Optional[Set[str]] = None) -> dict:
+        """完整状态（/api/state 使用），track_fields 限定列表中曲目的字段"""
+        return {
+            "room": self.name,
+            "mode": self.current_mode,
+            "is_playing": self.is_playing,
+            "current_time": self.playhead(),
+            "volume": self.volume,
+            "playlist": [track.dict(include=track_fields) for track in self.playlist],
+            "slides": [slide.dict() for slide in self.slides],
+            "current_track_index": self.current_track_index,
+            "current_slide_index": self.current_slide_index,
+            "current_track": self.current_track.dict() if self.current_track else None,
+            "current_slide": self.current_slide.dict() if self.current_slide else None,
+            "up_next": self.up_next,
+            "shuffle": self.shuffle_seed is not None,
+        }
+    
+    def build_summary(self) -> dict:
+        """“正在播放” 摘要：不含曲库列表，管理端再通过 /api/library/* 按需分页加载"""
+        return {
+            "room": self.name,
+            "mode": self.current_mode,
+            "is_playing": self.is_playing,
+            "current_time": self.playhead(),
+            "volume": self.volume,
+            "current_track_index": self.current_track_index,
+            "current_slide_index": self.current_slide_index,
+            "current_track": self.current_track.dict() if self.current_track else None,
+            "current_slide": self.current_slide.dict() if self.current_slide else None,
+            "up_next": self.up_next,
+            "shuffle": self.shuffle_seed is not None,
+            "timeline": self.timeline.summary(),
+            "track_count": len(self.playlist),
+            "slide_count": len(self.slides),
+            "cache_status": list(self.cache_status.values()),
+        }
+    
+    async def send_admin_state(self, connection: ClientConnection):
+        """发送状态摘要给管理端（曲库列表由管理端分页加载）"""
         state = {
             "type": "state_update",
-            "data": {
-                "mode": self.current_mode,
-                "is_playing": self.is_playing,
-                "current_time": self.current_time,
-                "volume": self.volume,
-                "playlist": [track.dict() for track in self.playlist],
-                "slides": [slide.dict() for slide in self.slides],
-                "current_track_index": self.current_track_index,
-                "current_slide_index": self.current_slide_index,
-                "current_track": self.current_track.dict() if self.current_track else None,
-                "current_slide": self.current_slide.dict() if self.current_slide else None,
-            }
+            "data": self.build_summary()
         }
         try:
-            await websocket.send_json(state)
+            await connection.send(state)
         except Exception as e:
             logger.error(f"发送状态到管理端失败: {e}")
-    
-    async def send_display_state(self, websocket: WebSocket):
+    async def send_display_state(self, connection: ClientConnection):
         """发送当前显示状态给显示端"""
         if self.current_mode == "music":
             state = {
@@ -206,7 +406,7 @@ class StateManager:
                 "data": {
                     "track": self.current_track.dict() if self.current_track else None,
                     "is_playing": self.is_playing,
-                    "current_time": self.current_time,
+                    "current_time": self.playhead(),
                     "volume": self.volume,
                 }
             }
@@ -219,119 +419,720 @@ class StateManager:
             }
         
         try:
-            await websocket.send_json(state)
+            await connection.send(state)
+            await connection.send(self.mirrored_prefetch or self.build_prefetch_command().dict())
+            announced = self.timeline.announced or self.mirrored_cue
+            if announced is not None:
+                # 提示已经提前下发，新连接的显示端也要按时执行
+                await connection.send({"type": "cue", "data": announced})
         except Exception as e:
             logger.error(f"发送状态到显示端失败: {e}")
+
+    def mirror(self, message: dict):
+        """中继模式：按主服务器发给显示端的消息更新本地的状态副本（本地显示端连接时据此发送快照）"""
+        kind = message.get("type")
+        data = message.get("data") or {}
+        if kind in ("music_state", "switch_to_music"):
+            self.current_mode = "music"
+            self.current_track = Track(**data["track"]) if data.get("track") else None
+            self.is_playing = data.get("is_playing", self.is_playing)
+            self.current_time = data.get("current_time", self.current_time)
+            self.volume = data.get("volume", self.volume)
+        elif kind in ("slide_state", "switch_to_slide"):
+            self.current_mode = "slide"
+            self.current_slide = Slide(**data["slide"]) if data.get("slide") else None
+        elif kind == "track_change":
+            self.current_track = Track(**data["track"]) if data.get("track") else None
+            self.is_playing = data.get("play", self.is_playing)
+            self.current_time = data.get("time", 0)
+        elif kind == "track_update":
+            if self.current_track and data.get("track", {}).get("id") == self.current_track.id:
+                self.current_track = Track(**data["track"])
+        elif kind == "slide_change":
+            self.current_slide = Slide(**data["slide"]) if data.get("slide") else None
+        elif kind == "play":
+            self.is_playing = True
+            self.current_time = data.get("time", self.current_time)
+        elif kind == "pause":
+            self.is_playing = False
+        elif kind == "seek":
+            self.current_time = data.get("time", self.current_time)
+        elif kind == "volume":
+            self.volume = data.get("volume", self.volume)
+        elif kind == "prefetch":
+            self.mirrored_prefetch = message
+        elif kind == "cue":
+            self.mirror_cue(data)
     
-    def add_track(self, track: Track):
-        self.playlist.append(track)
-        if len(self.playlist) == 1 and self.current_track_index == -1:
-            self.current_track_index = 0
+    def mirror_cue(self, data: dict):
+        """中继模式：记下提前下发的提示，到开始时间时把它的命令应用到状态副本（主服务器此时不再发送切换命令）"""
+        if data.get("cancel"):
+            if self.mirrored_cue is not None and self.mirrored_cue.get("id") == data.get("id"):
+                self.mirrored_cue_handle.cancel()
+                self.mirrored_cue = self.mirrored_cue_handle = None
+            return
+        if not isinstance(data.get("at"), (int, float)) or not isinstance(data.get("command"), dict):
+            return
+        if self.mirrored_cue_handle is not None:
+            self.mirrored_cue_handle.cancel()
+        self.mirrored_cue = data
+        self.mirrored_cue_handle = asyncio.get_running_loop().call_later(
+            max(0.0, data["at"] / 1000 - time.time()), self.apply_mirrored_cue, data)
+    
+    def apply_mirrored_cue(self, cue: dict):
+        if self.mirrored_cue is not cue:
+            return
+        self.mirrored_cue = self.mirrored_cue_handle = None
+        command = cue["command"]
+        if command.get("type") == "switch_to_music":
+            # 曲目提示从头开始播放
+            command = {**command, "data": {**command.get("data", {}), "current_time": 0}}
+        self.mirror(command)
+    
+    def select_track(self, track: Optional[Track]):
+        self.current_track = track
+    
+    def select_slide(self, slide: Optional[Slide]):
+        self.current_slide = slide
+    
+    def set_shuffle(self, enabled: bool, seed: Optional[int] = None):
+        """开启或关闭随机播放，从当前曲目在随机顺序中的位置往后播放（顺序只由种子决定，各进程一致）"""
+        if not enabled:
+            self.shuffle_seed = None
+            self.shuffle_order = []
+            self.shuffle_keys = []
+            return
+        self.shuffle_seed = seed if seed is not None else random.getrandbits(32)
+        entries = sorted((shuffle_key(self.shuffle_seed, track.id), track.id) for track in self.playlist)
+        self.shuffle_keys = [key for key, _ in entries]
+        self.shuffle_order = [track_id for _, track_id in entries]
+    
+    def shuffle_position(self, track_id: Optional[str]) -> int:
+        """曲目在随机顺序中的下标，不在其中时返回-1"""
+        if track_id is None:
+            return -1
+        key = shuffle_key(self.shuffle_seed, track_id)
+        index = bisect.bisect_left(self.shuffle_keys, key)
+        while index < len(self.shuffle_keys) and self.shuffle_keys[index] == key:
+            if self.shuffle_order[index] == track_id:
+                return index
+            index += 1
+        return -1
+    
+    def enqueue(self, track_id: str, front: bool = False) -> bool:
+        """加入待播队列（front=True 表示下一首就播放）"""
+        if self.playlist.get(track_id) is None:
+            return False
+        if track_id in self.up_next:
+            self.up_next.remove(track_id)
+        if front:
+            self.up_next.insert(0, track_id)
+        else:
+            self.up_next.append(track_id)
+        return True
+    
+    def iter_following(self, step: int = 1) -> Iterator[Track]:
+        """按随机顺序或列表顺序，从当前曲目往后（step=-1 往前）依次列出曲目，不含待播队列"""
+        if self.shuffle_order:
+            count = len(self.shuffle_order)
+            start = self.shuffle_position(self.current_track.id if self.current_track else None)
+            for offset in range(1, count + 1):
+                # 已删除的曲目还留在随机顺序里，跳过
+                track = self.playlist.get(self.shuffle_order[(start + step * offset) % count])
+                if track is not None:
+                    yield track
+        else:
+            count = len(self.playlist)
+            start = self.current_track_index
+            for offset in range(1, count + 1):
+                yield self.playlist[(start + step * offset) % count]
+    
+    def next_track(self) -> Optional[Track]:
+        """下一首：先取待播队列，然后按随机顺序或列表顺序"""
+        while self.up_next:
+            track = self.playlist.get(self.up_next.pop(0))
+            if track is not None:
+                return track
+        return next(self.iter_following(), None)
+    
+    def previous_track(self) -> Optional[Track]:
+        return next(self.iter_following(-1), None)
+
+    def get_upcoming_tracks(self, count: int = PREFETCH_TRACK_COUNT) -> List[Track]:
+        """接下来将要播放的曲目（待播队列、随机顺序和列表顺序），不含当前曲目"""
+        if not self.playlist or count <= 0:
+            return []
+
+        if self.timeline.running:
+            # 演出流程运行时按流程中接下来的曲目预取
+            tracks = (self.playlist.get(track_id) for track_id in self.timeline.upcoming_track_ids())
+            return [track for track in tracks if track is not None][:count]
+
+        upcoming = []
+        seen = {self.current_track.id} if self.current_track else set()
+        queued = (self.playlist.get(track_id) for track_id in self.up_next)
+        for track in itertools.chain(queued, self.iter_following()):
+            if len(upcoming) >= count:
+                break
+            if track is not None and track.id not in seen:
+                seen.add(track.id)
+                upcoming.append(track)
+        return upcoming
+
+    def build_prefetch_command(self) -> ControlCommand:
+        """生成预取清单，让显示端在当前曲目播放时提前加载下一首"""
+        items = []
+        for track in self.get_upcoming_tracks():
+            items.append({
+                "id": track.id,
+                "url": track.stream_url or track.url,
+                "cover_url": track.cover_url or DEFAULT_COVER_URL,
+                "lyrics_url": track.lyrics_url,
+                "lyrics": get_parsed_lyrics(track.lyrics_url),
+            })
+
+        return ControlCommand(
+            type="prefetch",
+            data={
+                "current_track_id": self.current_track.id if self.current_track else None,
+                "tracks": items,
+            }
+        )
+
+    async def broadcast_prefetch(self):
+        """向所有显示端推送预取清单"""
+        await self.broadcast_to_display(self.build_prefetch_command())
+    
+    def cue_command(self, cue) -> Optional[dict]:
+        """提示在显示端执行的命令；目标曲目或幻灯片已被删除时返回None"""
+        if cue.kind == "track":
+            track = self.playlist.get(cue.target_id)
+            if track is None:
+                return None
+            # 不带进度：预加载的音频从头开始播放，不再跳转
+            return {"type": "switch_to_music", "data": {"track": track.dict(), "is_playing": True}}
+        if cue.kind == "slide":
+            slide = self.slides.get(cue.target_id)
+            if slide is None:
+                return None
+            return {"type": "switch_to_slide", "data": {"slide": slide.dict()}}
+        return {"type": "pause"}
+    
+    async def apply_cue(self, cue, started_at: float):
+        """提示开始时更新服务器的播放状态（显示端已经按提前下发的提示自己切换，这里只通知管理端）"""
+        if cue.kind == "track":
+            self.current_mode = "music"
+            self.select_track(self.playlist.get(cue.target_id))
+            self.is_playing = True
+            self.current_time = 0.0
+            self.playhead_anchor = time.monotonic() - max(0.0, time.time() - started_at)
+        elif cue.kind == "slide":
+            self.current_mode = "slide"
+            self.select_slide(self.slides.get(cue.target_id))
+            self.settle_playhead()
+            self.is_playing = False
+        else:
+            self.settle_playhead()
+            self.is_playing = False
+        self.publish_state()
+        
+        await self.broadcast_to_admin(ControlCommand(
+            type="state_update",
+            data={
+                "mode": self.current_mode,
+                "current_track_index": self.current_track_index,
+                "current_track": self.current_track.dict() if self.current_track else None,
+                "current_slide_index": self.current_slide_index,
+                "current_slide": self.current_slide.dict() if self.current_slide else None,
+                "is_playing": self.is_playing,
+                "current_time": self.current_time,
+            }
+        ))
+        if cue.kind == "track":
+            await self.broadcast_prefetch()
+    
+    async def broadcast_cue(self, data: dict):
+        await self.broadcast_to_display(ControlCommand(type="cue", data=data))
+    
+    async def broadcast_timeline(self):
+        await self.broadcast_to_admin(ControlCommand(type="timeline", data=self.timeline.summary()))
+    
+    async def update_cache_progress(self, progress: dict):
+        """记录显示端上报的离线缓存进度并转发给管理端"""
+        client_id = progress.get("client_id")
+        if not isinstance(client_id, str) or not client_id:
+            return
+        try:
+            status = {
+                "client_id": client_id[:64],
+                "version": progress.get("version"),
+                "cached": int(progress.get("cached") or 0),
+                "total": int(progress.get("total") or 0),
+                "cached_bytes": int(progress.get("cached_bytes") or 0),
+                "total_bytes": int(progress.get("total_bytes") or 0),
+                "error": progress.get("error"),
+                "updated_at": time.time(),
+            }
+        except (TypeError, ValueError):
+            return
+        self.cache_status[status["client_id"]] = status
+        await self.broadcast_to_admin(ControlCommand(type="cache_status", data=status))
+    
+    def on_track_added(self, track: Track):
+        if len(self.playlist) == 1 and self.current_track is None:
             self.current_track = track
+        if self.shuffle_seed is not None and self.shuffle_position(track.id) < 0:
+            # 按排序键插入：其他进程不管曲目加入的先后，顺序都一样
+            key = shuffle_key(self.shuffle_seed, track.id)
+            index = bisect.bisect_right(self.shuffle_keys, key)
+            self.shuffle_keys.insert(index, key)
+            self.shuffle_order.insert(index, track.id)
     
-    def add_slide(self, slide: Slide):
-        self.slides.append(slide)
-        if len(self.slides) == 1 and self.current_slide_index == -1:
-            self.current_slide_index = 0
+    def on_slide_added(self, slide: Slide):
+        if len(self.slides) == 1 and self.current_slide is None:
             self.current_slide = slide
     
-    def remove_track(self, track_id: str):
-        self.playlist = [track for track in self.playlist if track.id != track_id]
+    def on_track_removed(self, track_id: str, index: int):
+        """index 为曲目删除前的下标"""
+        if track_id in self.up_next:
+            self.up_next.remove(track_id)
         if not self.playlist:
-            self.current_track_index = -1
             self.current_track = None
         elif self.current_track and self.current_track.id == track_id:
-            self.current_track_index = max(0, self.current_track_index - 1)
-            self.current_track = self.playlist[self.current_track_index] if self.playlist else None
+            # 随机播放时仍按随机顺序停在前一首
+            following = next(self.iter_following(-1), None) if self.shuffle_order else None
+            self.current_track = following or self.playlist[min(max(0, index - 1), len(self.playlist) - 1)]
     
-    def remove_slide(self, slide_id: str):
-        self.slides = [slide for slide in self.slides if slide.id != slide_id]
+    def on_slide_removed(self, slide_id: str, index: int):
         if not self.slides:
-            self.current_slide_index = -1
             self.current_slide = None
         elif self.current_slide and self.current_slide.id == slide_id:
-            self.current_slide_index = max(0, self.current_slide_index - 1)
-            self.current_slide = self.slides[self.current_slide_index] if self.slides else None
+            self.current_slide = self.slides[min(max(0, index - 1), len(self.slides) - 1)]
+
+# 全局状态管理器：共享曲库和所有房间
+class StateManager:
+    def __init__(self):
+        # 曲库在 startup() 中加载（按位置键排序）
+        self.playlist: OrderedList[Track] = OrderedList()
+        self.slides: OrderedList[Slide] = OrderedList()
+        
+        # 房间（按名称）
+        self.rooms: Dict[str, Room] = {}
+        
+        # 多进程消息总线
+        self.bus: Optional[MessageBus] = None
+        
+        # 播放状态检查点（只由修改状态的进程写入，同步来的状态不重复写）
+        self.checkpoint = PlaybackCheckpoint(persistence_manager.data_dir / "playback.jsonl")
+        
+        # 中继模式：播放状态和媒体文件来自主服务器（见 relay.py）
+        self.relay: Optional[Relay] = Relay(RELAY_UPSTREAM, UPLOAD_FOLDER) if RELAY_UPSTREAM else None
+        
+        # 热备模式：从主服务器复制曲库和播放状态，主服务器停止后接管（见 standby.py）
+        self.standby: Optional[Standby] = Standby(STANDBY_OF, UPLOAD_FOLDER, self) if STANDBY_OF else None
+        
+        # 已连接的热备：每个热备一个待发送队列
+        self.replicas: Set[asyncio.Queue] = set()
+    
+    @property
+    def role(self) -> str:
+        if self.standby is not None and not self.standby.promoted:
+            return "standby"
+        return "relay" if self.relay is not None else "primary"
+    
+    @property
+    def accepting_clients(self) -> bool:
+        """热备在接管之前不接受客户端连接"""
+        return self.standby is None or self.standby.promoted
+    
+    def startup(self):
+        """启动时调用：创建默认封面、从持久化存储加载曲库并恢复各房间的播放状态"""
+        self.create_default_cover()
+        self.load_from_persistence()
+        if self.relay is None:
+            # 中继的播放状态由主服务器推送，不从本地检查点恢复
+            self.restore_playback()
+    
+    def restore_playback(self):
+        """从检查点恢复上次运行时各房间的播放状态"""
+        records = self.checkpoint.load()
+        for name, record in records.items():
+            room = self.get_room(name)
+            room.restore(record)
+            logger.info(f"恢复房间 {room.name} 的播放状态: "
+                        f"{room.current_track.title if room.current_track else '无曲目'} "
+                        f"{'播放中' if room.is_playing else '暂停'} {room.current_time:.1f}s")
+    
+    def create_default_cover(self):
+        """创建默认封面图片"""
+        default_cover_path = UPLOAD_FOLDER / "covers" / "default-cover.jpg"
+        if not default_cover_path.exists():
+            try:
+                # 创建一个简单的默认封面
+                from PIL import Image, ImageDraw, ImageFont
+                import io
+                
+                # 创建新图片
+                img = Image.new('RGB', (800, 800), color='#667eea')
+                draw = ImageDraw.Draw(img)
+                
+                # 添加文字
+                try:
+                    font = ImageFont.truetype("arial.ttf", 60)
+                except:
+                    font = ImageFont.load_default()
+                
+                text = "元旦晚会\n音乐系统"
+                bbox = draw.textbbox((0, 0), text, font=font)
+                text_width = bbox[2] - bbox[0]
+                text_height = bbox[3] - bbox[1]
+                
+                position = ((800 - text_width) // 2, (800 - text_height) // 2)
+                draw.text(position, text, fill="white", font=font)
+                
+                # 保存图片
+                img.save(default_cover_path, "JPEG")
+                logger.info("创建默认封面成功")
+            except Exception as e:
+                logger.warning(f"创建默认封面失败: {e}")
+                # 创建一个纯色图片作为备用
+                img = Image.new('RGB', (800, 800), color='#667eea')
+                img.save(default_cover_path, "JPEG")
+    
+    def get_room(self, name: Optional[str] = None) -> Room:
+        """获取房间，不存在时创建（名称不合法时使用默认房间）"""
+        if not name or not ROOM_NAME_PATTERN.match(name):
+            name = DEFAULT_ROOM
+        room = self.rooms.get(name)
+        if room is None:
+            room = self.rooms[name] = Room(name, self)
+            logger.info(f"创建房间: {name}")
+        return room
+    
+    async def broadcast_to_display(self, command: ControlCommand):
+        """向所有房间的显示端广播（曲库变化等全局消息）"""
+        payload = command.dict()
+        for room in list(self.rooms.values()):
+            await room.send_to_local_displays(payload)
+        self.publish("broadcast", room=None, target="display", command=payload)
+    
+    async def broadcast_to_admin(self, command: ControlCommand):
+        """向所有房间的管理端广播"""
+        payload = command.dict()
+        for room in list(self.rooms.values()):
+            await room.send_to_local_admins(payload)
+        self.publish("broadcast", room=None, target="admin", command=payload)
+    
+    async def broadcast_playlist_delta(self, added: List[Track] = (), removed: List[str] = (),
+                                       updated: List[Track] = ()):
+        """曲库变化时只向管理端发送增量，不再推送整个播放列表"""
+        await self.broadcast_to_admin(ControlCommand(
+            type="playlist_delta",
+            data={
+                "added": [track.dict() for track in added],
+                "removed": list(removed),
+                "updated": [track.dict() for track in updated],
+            }
+        ))
+    
+    async def broadcast_prefetch(self):
+        """曲库变化后向每个房间推送新的预取清单"""
+        for room in list(self.rooms.values()):
+            await room.broadcast_prefetch()
+    
+    def attach_bus(self, bus: MessageBus):
+        """接入消息总线，与其他工作进程同步状态"""
+        self.bus = bus
+        bus.subscribe(self.handle_bus_message)
+    
+    def publish(self, kind: str, **payload):
+        """向总线发布消息"""
+        if self.bus is not None:
+            self.bus.publish({"kind": kind, **payload})
+        self.replicate({"kind": kind, **payload})
+    
+    def replicate(self, message: dict):
+        """把曲库修改和播放状态转发给已连接的热备（广播消息只影响本地连接，不转发）"""
+        if not self.replicas or message.get("kind") == "broadcast":
+            return
+        if message.get("kind") == "reload":
+            # 热备没有命令行工具修改后的数据库文件，重新发送完整快照
+            message = self.replication_snapshot()
+        for queue in list(self.replicas):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                logger.warning("热备跟不上复制流，断开后重新同步")
+                self.replicas.discard(queue)
+    
+    def replication_snapshot(self) -> dict:
+        """热备连接时发送的完整快照：数据库记录和各房间的播放状态"""
+        return {
+            "kind": "snapshot",
+            "tracks": list(persistence_manager.music_database),
+            "slides": list(persistence_manager.slides_database),
+            "rooms": {name: room.snapshot_state() for name, room in self.rooms.items()},
+        }
+    
+    async def handle_bus_message(self, message: dict):
+        """处理其他工作进程发来的消息"""
+        kind = message.get("kind")
+        self.replicate(message)
+        
+        if kind == "broadcast":
+            room_name = message.get("room")
+            rooms = list(self.rooms.values()) if room_name is None else \
+                [self.rooms[room_name]] if room_name in self.rooms else []
+            for room in rooms:
+                if message.get("target") == "display":
+                    await room.send_to_local_displays(message["command"])
+                else:
+                    await room.send_to_local_admins(message["command"])
+        elif kind == "state":
+            self.get_room(message.get("room")).apply_state(message["state"])
+        elif kind == "track_added":
+            self.add_track(Track(**message["track"]), replicate=False)
+        elif kind == "tracks_added":
+            self.add_tracks([Track(**track) for track in message["tracks"]], replicate=False)
+        elif kind == "track_removed":
+            self.remove_track(message["track_id"], replicate=False)
+        elif kind == "track_updated":
+            self.update_track(message["track_id"], message["updates"], replicate=False)
+        elif kind == "slide_added":
+            self.add_slide(Slide(**message["slide"]), replicate=False)
+        elif kind == "slide_removed":
+            self.remove_slide(message["slide_id"], replicate=False)
+        elif kind == "slide_updated":
+            self.update_slide(message["slide_id"], message["updates"], replicate=False)
+        elif kind == "reload":
+            self.reload_library(replicate=False)
 
     def load_from_persistence(self):
         """从持久化存储加载数据"""
         try:
             # 加载音乐
             music_data = persistence_manager.get_all_music_tracks()
-            self.playlist = [Track(**data) for data in music_data]
+            self.playlist = OrderedList(Track(**data) for data in music_data)
             
             # 加载幻灯片
             slides_data = persistence_manager.get_all_slides()
-            self.slides = [Slide(**data) for data in slides_data]
-            
-            # 设置当前曲目和幻灯片
-            if self.playlist:
-                self.current_track_index = 0
-                self.current_track = self.playlist[0]
-            
-            if self.slides:
-                self.current_slide_index = 0
-                self.current_slide = self.slides[0]
+            self.slides = OrderedList(Slide(**data) for data in slides_data)
                 
             logger.info(f"从持久化存储加载了 {len(self.playlist)} 首音乐和 {len(self.slides)} 个幻灯片")
         except Exception as e:
             logger.error(f"从持久化存储加载数据失败: {e}")
-            self.playlist = []
-            self.slides = []
+            self.playlist = OrderedList()
+            self.slides = OrderedList()
 
-    def add_track(self, track: Track):
-        """添加曲目到播放列表并持久化"""
+    def add_track(self, track: Track, replicate: bool = True):
+        """添加曲目到播放列表并持久化（replicate=False 表示来自其他进程，只更新内存）"""
         self.playlist.append(track)
         
         # 保存到持久化存储
-        persistence_manager.add_music_track(track.dict())
+        persistence_manager.add_music_track(track.dict(), save=replicate)
+        if replicate:
+            self.publish("track_added", track=track.dict())
+        search_index.schedule(search_index.add, track)
         
-        if len(self.playlist) == 1 and self.current_track_index == -1:
-            self.current_track_index = 0
-            self.current_track = track
+        for room in self.rooms.values():
+            room.on_track_added(track)
+
+    def add_tracks(self, tracks: List[Track], replicate: bool = True):
+        """批量添加曲目：只写一次数据库、只发一条总线消息"""
+        self.playlist.extend(tracks)
+        
+        if replicate:
+            persistence_manager.add_music_tracks([track.dict() for track in tracks])
+            self.publish("tracks_added", tracks=[track.dict() for track in tracks])
+        else:
+            for track in tracks:
+                persistence_manager.add_music_track(track.dict(), save=False)
+        
+        for track in tracks:
+            search_index.schedule(search_index.add, track)
+            for room in self.rooms.values():
+                room.on_track_added(track)
 
-    def add_slide(self, slide: Slide):
+    def add_slide(self, slide: Slide, replicate: bool = True):
         """添加幻灯片到列表并持久化"""
         self.slides.append(slide)
         
         # 保存到持久化存储
-        persistence_manager.add_slide(slide.dict())
+        persistence_manager.add_slide(slide.dict(), save=replicate)
+        if replicate:
+            self.publish("slide_added", slide=slide.dict())
         
-        if len(self.slides) == 1 and self.current_slide_index == -1:
-            self.current_slide_index = 0
-            self.current_slide = slide
+        for room in self.rooms.values():
+            room.on_slide_added(slide)
 
-    def remove_track(self, track_id: str):
+    def remove_track(self, track_id: str, replicate: bool = True):
         """从播放列表移除曲目并更新持久化存储"""
         # 先从播放列表移除
-        self.playlist = [track for track in self.playlist if track.id != track_id]
+        index = self.playlist.index_of(track_id)
+        self.playlist.remove(track_id)
         
         # 从持久化存储删除
-        persistence_manager.delete_music_track(track_id)
+        persistence_manager.delete_music_track(track_id, save=replicate)
+        if replicate:
+            self.publish("track_removed", track_id=track_id)
+        search_index.schedule(search_index.remove, track_id)
         
-        if not self.playlist:
-            self.current_track_index = -1
-            self.current_track = None
-        elif self.current_track and self.current_track.id == track_id:
-            self.current_track_index = max(0, self.current_track_index - 1)
-            self.current_track = self.playlist[self.current_track_index] if self.playlist else None
+        for room in self.rooms.values():
+            room.on_track_removed(track_id, index)
 
-    def remove_slide(self, slide_id: str):
+    def remove_slide(self, slide_id: str, replicate: bool = True):
         """从幻灯片列表移除并更新持久化存储"""
         # 先从列表移除
-        self.slides = [slide for slide in self.slides if slide.id != slide_id]
+        index = self.slides.index_of(slide_id)
+        self.slides.remove(slide_id)
         
         # 从持久化存储删除
-        persistence_manager.delete_slide(slide_id)
+        persistence_manager.delete_slide(slide_id, save=replicate)
+        if replicate:
+            self.publish("slide_removed", slide_id=slide_id)
         
-        if not self.slides:
-            self.current_slide_index = -1
-            self.current_slide = None
-        elif self.current_slide and self.current_slide.id == slide_id:
-            self.current_slide_index = max(0, self.current_slide_index - 1)
-            self.current_slide = self.slides[self.current_slide_index] if self.slides else None
+        for room in self.rooms.values():
+            room.on_slide_removed(slide_id, index)
+
+    def update_track(self, track_id: str, updates: dict, replicate: bool = True) -> Optional[Track]:
+        """更新曲目字段并持久化，曲目不存在时返回None"""
+        track = self.playlist.get(track_id)
+        if track is None:
+            return None
+        
+        if "position" in updates:
+            self.playlist.set_position(track_id, updates["position"])
+        for key, value in updates.items():
+            setattr(track, key, value)
+        persistence_manager.update_music_track(track_id, updates, save=replicate)
+        if replicate:
+            self.publish("track_updated", track_id=track_id, updates=updates)
+        search_index.schedule(search_index.update, track, list(updates))
+        return track
+
+    def update_slide(self, slide_id: str, updates: dict, replicate: bool = True) -> Optional[Slide]:
+        slide = self.slides.get(slide_id)
+        if slide is None:
+            return None
+        
+        if "position" in updates:
+            self.slides.set_position(slide_id, updates["position"])
+        for key, value in updates.items():
+            setattr(slide, key, value)
+        persistence_manager.update_slide(slide_id, updates, save=replicate)
+        if replicate:
+            self.publish("slide_updated", slide_id=slide_id, updates=updates)
+        return slide
+
+    def move_track(self, track_id: str, after_id: Optional[str]) -> Optional[Track]:
+        """把曲目移动到 after_id 之后（None 表示最前面），只修改这一首的位置键；位置没有变化时返回None"""
+        position = self.playlist.move(track_id, after_id)
+        if position is None:
+            return None
+        return self.update_track(track_id, {"position": position})
+
+    def move_slide(self, slide_id: str, after_id: Optional[str]) -> Optional[Slide]:
+        position = self.slides.move(slide_id, after_id)
+        if position is None:
+            return None
+        return self.update_slide(slide_id, {"position": position})
+
+    def reload_library(self, replicate: bool = True) -> Dict[str, List]:
+        """重新读取数据库文件（命令行曲库工具修改曲库后调用），返回新增、删除和更新的曲目/幻灯片"""
+        with persistence_manager.transaction():
+            music_data = persistence_manager.get_all_music_tracks()
+            slides_data = persistence_manager.get_all_slides()
+        if replicate:
+            self.publish("reload")
+        return self.apply_library(music_data, slides_data)
+
+    def apply_library(self, music_data: List[dict], slides_data: List[dict]) -> Dict[str, List]:
+        """把曲库替换为给定的记录，只对有变化的曲目和幻灯片通知各房间"""
+        changes = {"added": [], "removed": [], "updated": [], "slides_changed": []}
+        
+        records = {data['id']: data for data in music_data}
+        for track in list(self.playlist):
+            if track.id not in records:
+                index = self.playlist.index_of(track.id)
+                self.playlist.remove(track.id)
+                changes["removed"].append(track.id)
+                search_index.schedule(search_index.remove, track.id)
+                for room in self.rooms.values():
+                    room.on_track_removed(track.id, index)
+        
+        for track_id, data in records.items():
+            fresh = Track(**data)
+            track = self.playlist.get(track_id)
+            if track is None:
+                self.playlist.append(fresh)
+                changes["added"].append(fresh)
+                search_index.schedule(search_index.add, fresh)
+                for room in self.rooms.values():
+                    room.on_track_added(fresh)
+            elif track.dict() != fresh.dict():
+                # 原地更新，房间里的当前曲目引用保持有效
+                changed_fields = [key for key, value in fresh.dict().items() if getattr(track, key) != value]
+                self.playlist.set_position(track_id, fresh.position)
+                for key, value in fresh.dict().items():
+                    setattr(track, key, value)
+                changes["updated"].append(track)
+                search_index.schedule(search_index.update, track, changed_fields)
+        
+        slide_records = {data['id']: data for data in slides_data}
+        for slide in list(self.slides):
+            if slide.id not in slide_records:
+                index = self.slides.index_of(slide.id)
+                self.slides.remove(slide.id)
+                changes["slides_changed"].append(slide.id)
+                for room in self.rooms.values():
+                    room.on_slide_removed(slide.id, index)
+        for slide_id, data in slide_records.items():
+            slide = self.slides.get(slide_id)
+            if slide is None:
+                slide = Slide(**data)
+                self.slides.append(slide)
+                changes["slides_changed"].append(slide_id)
+                for room in self.rooms.values():
+                    room.on_slide_added(slide)
+            elif data.get('position') and slide.position != data['position']:
+                self.slides.set_position(slide_id, data['position'])
+                changes["slides_changed"].append(slide_id)
+        
+        logger.info(f"曲库已更新: 新增 {len(changes['added'])}，删除 {len(changes['removed'])}，"
+                    f"更新 {len(changes['updated'])}，幻灯片变化 {len(changes['slides_changed'])}")
+        return changes
 
 state_manager = StateManager()
+state_manager.attach_bus(create_bus())
+if state_manager.relay is not None:
+    app.add_middleware(MediaMirrorMiddleware, media=state_manager.relay.media)
+media_server = MediaServer(UPLOAD_FOLDER, ['music', 'variants', 'covers'])
+upload_collector = UploadCollector(UPLOAD_FOLDER)
+
+def iter_connections():
+    """遍历本进程所有房间的连接: (房间名, 类型, 连接)"""
+    for room in list(state_manager.rooms.values()):
+        for connection in list(room.display_connections):
+            yield room.name, "display", connection
+        for connection in list(room.admin_connections):
+            yield room.name, "admin", connection
+
+def collect_connection_counts():
+    counts = {}
+    for room_name, kind, _ in iter_connections():
+        counts[(room_name, kind)] = counts.get((room_name, kind), 0) + 1
+    return counts
+
+def collect_send_queue_depth():
+    depths = {}
+    for room_name, kind, connection in iter_connections():
+        depths[(room_name, kind)] = max(depths.get((room_name, kind), 0), connection.queue_depth)
+    return depths
+
+registry.gauge("pyer_connections", "当前WebSocket连接数", ["room", "target"], collect_connection_counts)
+registry.gauge("pyer_role", "实例角色（primary/standby/relay，当前角色为 1）", ["role"],
+               lambda: {(state_manager.role,): 1})
+registry.gauge("pyer_send_queue_depth_max", "各房间连接中最大的待发送消息数", ["room", "target"], collect_send_queue_depth)
 
 # 工具函数
 def allowed_file(filename: str, file_type: str) -> bool:
@@ -346,293 +1147,529 @@ def save_upload_file(file: UploadFile, subdir: str) -> str:
     filename = f"{uuid.uuid4().hex[:8]}_{file.filename}"
     file_path = UPLOAD_FOLDER / subdir / filename
     
+    start = time.perf_counter()
     with open(file_path, "wb") as buffer:
         content = file.file.read()
         buffer.write(content)
+    upload_duration.observe(time.perf_counter() - start, subdir=subdir)
+    upload_bytes.inc(len(content), subdir=subdir)
     
     return f"/uploads/{subdir}/{filename}"
 
-async def get_audio_duration(file_path: Path) -> int:
-    """使用mutagen获取音频文件时长"""
+LRC_TIME_TAG = re.compile(r'\[(\d{2}):(\d{2})(?:\.(\d{2,3}))?\]')
+
+def parse_lyrics(lyric_text: str) -> List[Dict]:
+    """解析LRC歌词，返回按时间排序的 [{time, text}] 列表（与显示端解析规则一致）"""
+    entries = []
+    lines = lyric_text.split('\n')
+
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+
+        time_tags = LRC_TIME_TAG.findall(line)
+        if time_tags:
+            text = re.sub(r'\[.*?\]', '', line).strip()
+            if not text:
+                continue
+            for minutes, seconds, millis in time_tags:
+                time = int(minutes) * 60 + int(seconds) + (int(millis.ljust(3, '0')) / 1000 if millis else 0)
+                entries.append({"time": time, "text": text})
+        elif not line.startswith(('[', '#', '//')):
+            # 没有时间标签的文本行合并到上一行
+            if entries:
+                entries[-1]["text"] += ' ' + line
+            else:
+                entries.append({"time": 0, "text": line})
+
+    # 相同时间点保留最后一条
+    unique = {}
+    for entry in sorted(entries, key=lambda e: e["time"]):
+        unique[entry["time"]] = entry["text"]
+    result = [{"time": time, "text": text} for time, text in sorted(unique.items())]
+
+    if not result:
+        text_lines = [line.strip() for line in lines
+                      if line.strip() and not line.strip().startswith(('#', '//'))]
+        if text_lines:
+            result.append({"time": 0, "text": '\n'.join(text_lines)})
+
+    return result
+
+# 已解析歌词缓存（上传文件名带随机前缀，内容不会变化）
+parsed_lyrics_cache: Dict[str, List[Dict]] = {}
+
+def get_parsed_lyrics(lyrics_url: Optional[str]) -> Optional[List[Dict]]:
+    """根据歌词URL获取解析后的歌词，失败时返回None"""
+    if not lyrics_url:
+        return None
+    if lyrics_url in parsed_lyrics_cache:
+        return parsed_lyrics_cache[lyrics_url]
+
+    lyrics_path = UPLOAD_FOLDER / "lyrics" / lyrics_url.split("/")[-1]
+    if not lyrics_path.exists():
+        return None
+
     try:
-        # 尝试使用mutagen直接打开文件
-        audio = mutagen.File(str(file_path))
-        
-        if audio is None:
-            logger.warning(f"mutagen无法识别文件格式: {file_path}")
-            return get_audio_duration_fallback(file_path)
-        
-        # 获取时长（秒）
-        duration = audio.info.length
-        
-        if duration <= 0:
-            logger.warning(f"音频时长异常: {duration} 秒, 文件: {file_path}")
-            return get_audio_duration_fallback(file_path)
-        
-        # 确保返回整数秒
-        return int(duration)
-        
+        parsed = parse_lyrics(read_lyrics_text(lyrics_path))
     except Exception as e:
-        logger.error(f"使用mutagen获取音频时长失败 {file_path}: {e}")
-        return get_audio_duration_fallback(file_path)
+        logger.warning(f"解析歌词失败 {lyrics_path}: {e}")
+        return None
+
+    parsed_lyrics_cache[lyrics_url] = parsed
+    return parsed
+
+# 后台任务引用，防止任务被垃圾回收
+background_tasks: Set[asyncio.Task] = set()
+
+def spawn_background(coro) -> asyncio.Task:
+    """启动后台任务"""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+async def analyze_track(track: Track):
+    """后台分析曲目的波形和响度，完成后更新曲目记录并通知客户端"""
+    music_path = UPLOAD_FOLDER / "music" / track.url.split("/")[-1]
+    result = await track_analyzer.analyze(music_path)
+    if not result:
+        logger.warning(f"无法分析音频: {track.title}")
+        return
+
+    # 分析期间曲目可能已被删除
+    if state_manager.playlist.get(track.id) is None:
+        return
+
+    persistence_manager.save_waveform(track.id, result["waveform"])
+    state_manager.update_track(track.id, {
+        "loudness": result["loudness"],
+        "gain_db": result["gain_db"],
+        "waveform_url": f"/api/track/{track.id}/waveform",
+    })
+    logger.info(f"音频分析完成: {track.title} 响度={track.loudness} LUFS 增益={track.gain_db} dB")
+
+    command = ControlCommand(type="track_update", data={"track": track.dict()})
+    await state_manager.broadcast_to_admin(command)
+    await state_manager.broadcast_to_display(command)
+
+async def on_variant_ready(track_id: str, stream_url: str):
+    """转码完成后更新曲目的播放地址"""
+    track = state_manager.update_track(track_id, {"stream_url": stream_url})
+    if track is None:
+        return
+
+    command = ControlCommand(type="track_update", data={"track": track.dict()})
+    await state_manager.broadcast_to_admin(command)
+    await state_manager.broadcast_to_display(command)
+    await state_manager.broadcast_prefetch()
+
+transcode_queue.on_complete = on_variant_ready
 
-def get_audio_duration_fallback(file_path: Path) -> int:
-    """备用方法获取音频时长"""
+def resume_params(websocket: WebSocket):
+    """重连时URL中带的恢复令牌和最后收到的序号"""
     try:
-        # 尝试使用文件信息估算
-        file_ext = file_path.suffix.lower()
-        file_size = file_path.stat().st_size
-        
-        # 常见音频格式的估算比特率（kbps）
-        bitrate_estimates = {
-            '.mp3': 128,      # MP3常见比特率
-            '.mp4': 128,      # MP4/AAC常见比特率
-            '.m4a': 128,
-            '.aac': 128,
-            '.flac': 1000,    # FLAC无损，比特率较高
-            '.wav': 1411,     # WAV CD质量
-            '.ogg': 160,      # OGG Vorbis
-            '.wma': 128,      # Windows Media Audio
-        }
-        
-        # 获取比特率估算值
-        bitrate = bitrate_estimates.get(file_ext, 128)  # 默认128kbps
-        
-        # 计算时长：文件大小(字节) / (比特率(kbps) * 1000 / 8)
-        # 比特率(kbps) = 千比特/秒，1字节=8比特
-        duration = file_size / (bitrate * 1000 / 8)
-        
-        # 限制在合理范围内（10秒到30分钟）
-        return max(10, min(1800, int(duration)))
-        
-    except Exception as e:
-        logger.error(f"备用方法获取时长也失败 {file_path}: {e}")
-        return 180  # 默认3分钟
+        seq = int(websocket.query_params.get("seq", ""))
+    except ValueError:
+        seq = None
+    return websocket.query_params.get("resume"), seq
 
-# WebSocket连接 - 管理端
+# WebSocket连接 - 管理端（房间通过路径 /ws/admin/{room} 或查询参数 ?room= 指定）
 @app.websocket("/ws/admin")
-async def websocket_admin(websocket: WebSocket):
-    await state_manager.connect_admin(websocket)
+@app.websocket("/ws/admin/{room_name}")
+async def websocket_admin(websocket: WebSocket, room_name: Optional[str] = None):
+    if not state_manager.accepting_clients:
+        # 热备还没有接管，客户端会换下一个服务器
+        await websocket.close(code=1013)
+        return
+    room = state_manager.get_room(room_name or websocket.query_params.get("room"))
+    connection = await room.connect_admin(websocket, *resume_params(websocket))
     try:
         while True:
-            data = await websocket.receive_json()
-            await handle_admin_command(data)
+            data = await connection.receive()
+            command_type = data.get("type")
+            with command_duration.time(command_type=command_type if command_type in TYPE_CODES else "other"):
+                await handle_admin_command(data, room)
             
     except WebSocketDisconnect:
-        state_manager.disconnect_admin(websocket)
-        logger.info("管理端WebSocket连接断开")
+        room.disconnect_admin(connection)
+        logger.info(f"管理端WebSocket连接断开 (房间: {room.name})")
     except Exception as e:
         logger.error(f"处理管理端命令时出错: {e}")
-        state_manager.disconnect_admin(websocket)
+        room.disconnect_admin(connection)
 
-async def handle_admin_command(data: dict):
+async def handle_admin_command(data: dict, room: Room):
     command_type = data.get("type")
     command_data = data.get("data", {})
     
     logger.info(f"收到管理端命令: {command_type}")
+    room.settle_playhead()
+    if command_type in OVERRIDE_COMMANDS:
+        # 操作员手动切换，停止演出流程
+        await room.timeline.stop()
     
     if command_type == "play_music":
-        state_manager.is_playing = True
+        room.is_playing = True
         # 确保发送当前时间
-        await state_manager.broadcast_to_display(ControlCommand(
+        await room.broadcast_to_display(ControlCommand(
             type="play",
             data={
-                "time": command_data.get("time", state_manager.current_time)  # 优先使用命令中的时间
+                "time": command_data.get("time", room.current_time)  # 优先使用命令中的时间
             }
         ))
-        await state_manager.broadcast_to_admin(ControlCommand(
+        await room.broadcast_to_admin(ControlCommand(
             type="state_update",
             data={
                 "is_playing": True,
-                "current_time": state_manager.current_time
+                "current_time": room.current_time
             }
         ))
         
     elif command_type == "pause_music":
-        state_manager.is_playing = False
-        await state_manager.broadcast_to_display(ControlCommand(
+        room.is_playing = False
+        await room.broadcast_to_display(ControlCommand(
             type="pause"
         ))
-        await state_manager.broadcast_to_admin(ControlCommand(
+        await room.broadcast_to_admin(ControlCommand(
             type="state_update",
             data={"is_playing": False}
         ))
         
     elif command_type == "next_track":
-        if state_manager.playlist:
-            state_manager.current_track_index = (
-                state_manager.current_track_index + 1
-            ) % len(state_manager.playlist)
-            state_manager.current_track = state_manager.playlist[state_manager.current_track_index]
-            state_manager.is_playing = True
+        track = room.next_track()
+        if track:
+            room.select_track(track)
+            room.is_playing = True
             
-            await state_manager.broadcast_to_display(ControlCommand(
+            await room.broadcast_to_display(ControlCommand(
                 type="track_change",
                 data={
-                    "track": state_manager.current_track.dict(),
+                    "track": room.current_track.dict(),
                     "play": True
                 }
             ))
             
-            await state_manager.broadcast_to_admin(ControlCommand(
+            await room.broadcast_to_admin(ControlCommand(
                 type="state_update",
                 data={
-                    "current_track_index": state_manager.current_track_index,
-                    "current_track": state_manager.current_track.dict(),
-                    "is_playing": True
+                    "current_track_index": room.current_track_index,
+                    "current_track": room.current_track.dict(),
+                    "is_playing": True,
+                    "up_next": room.up_next
                 }
             ))
+
+            await room.broadcast_prefetch()
             
     elif command_type == "prev_track":
-        if state_manager.playlist:
-            state_manager.current_track_index = (
-                state_manager.current_track_index - 1
-            ) % len(state_manager.playlist)
-            state_manager.current_track = state_manager.playlist[state_manager.current_track_index]
-            state_manager.is_playing = True
+        track = room.previous_track()
+        if track:
+            room.select_track(track)
+            room.is_playing = True
             
-            await state_manager.broadcast_to_display(ControlCommand(
+            await room.broadcast_to_display(ControlCommand(
                 type="track_change",
                 data={
-                    "track": state_manager.current_track.dict(),
+                    "track": room.current_track.dict(),
                     "play": True
                 }
             ))
             
-            await state_manager.broadcast_to_admin(ControlCommand(
+            await room.broadcast_to_admin(ControlCommand(
                 type="state_update",
                 data={
-                    "current_track_index": state_manager.current_track_index,
-                    "current_track": state_manager.current_track.dict(),
+                    "current_track_index": room.current_track_index,
+                    "current_track": room.current_track.dict(),
                     "is_playing": True
                 }
             ))
+
+            await room.broadcast_prefetch()
             
     elif command_type == "select_track":
+        # 优先按ID选择（列表顺序可能已经变化），兼容旧的按下标选择
+        track = room.playlist.get(command_data.get("track_id"))
         index = command_data.get("index")
-        if 0 <= index < len(state_manager.playlist):
-            state_manager.current_track_index = index
-            state_manager.current_track = state_manager.playlist[index]
-            state_manager.is_playing = True
-            state_manager.current_time = 0  # 选择新曲目时重置时间
+        if track is None and isinstance(index, int) and 0 <= index < len(room.playlist):
+            track = room.playlist[index]
+        if track:
+            room.select_track(track)
+            room.is_playing = True
+            room.current_time = 0  # 选择新曲目时重置时间
 
-            await state_manager.broadcast_to_display(ControlCommand(
+            await room.broadcast_to_display(ControlCommand(
                 type="track_change",
                 data={
-                    "track": state_manager.current_track.dict(),
+                    "track": room.current_track.dict(),
                     "play": True,
                     "time": 0  # 重置时间
                 }
             ))
 
-            await state_manager.broadcast_to_admin(ControlCommand(
+            await room.broadcast_to_admin(ControlCommand(
                 type="state_update",
                 data={
-                    "current_track_index": state_manager.current_track_index,
-                    "current_track": state_manager.current_track.dict(),
+                    "current_track_index": room.current_track_index,
+                    "current_track": room.current_track.dict(),
                     "is_playing": True,
                     "current_time": 0  # 重置时间
                 }
             ))
+
+            await room.broadcast_prefetch()
             
     elif command_type == "seek_music":
         time = command_data.get("time", 0)
-        state_manager.current_time = time
+        room.current_time = time
         
         # 发送给所有显示端和管理端，确保状态一致
-        await state_manager.broadcast_to_display(ControlCommand(
+        await room.broadcast_to_display(ControlCommand(
             type="seek",
             data={"time": time}
         ))
         
         # 如果当前正在播放，更新播放状态
-        if state_manager.is_playing:
-            await state_manager.broadcast_to_display(ControlCommand(
+        if room.is_playing:
+            await room.broadcast_to_display(ControlCommand(
                 type="play",
                 data={"time": time}  # 同时发送播放命令，确保时间同步
             ))
         
-        await state_manager.broadcast_to_admin(ControlCommand(
+        await room.broadcast_to_admin(ControlCommand(
             type="state_update",
             data={"current_time": time}
         ))
         
     elif command_type == "set_volume":
         volume = command_data.get("volume", 80)
-        state_manager.volume = volume
+        room.volume = volume
         
-        await state_manager.broadcast_to_display(ControlCommand(
+        await room.broadcast_to_display(ControlCommand(
             type="volume",
             data={"volume": volume}
         ))
         
-        await state_manager.broadcast_to_admin(ControlCommand(
+        await room.broadcast_to_admin(ControlCommand(
             type="state_update",
             data={"volume": volume}
         ))
         
     elif command_type == "switch_mode":
         mode = command_data.get("mode", "music")
-        state_manager.current_mode = mode
+        room.current_mode = mode
         
         if mode == "music":
-            await state_manager.broadcast_to_display(ControlCommand(
+            await room.broadcast_to_display(ControlCommand(
                 type="switch_to_music",
                 data={
-                    "track": state_manager.current_track.dict() if state_manager.current_track else None,
-                    "is_playing": state_manager.is_playing,
-                    "current_time": state_manager.current_time
+                    "track": room.current_track.dict() if room.current_track else None,
+                    "is_playing": room.is_playing,
+                    "current_time": room.current_time
                 }
             ))
         else:
-            await state_manager.broadcast_to_display(ControlCommand(
+            await room.broadcast_to_display(ControlCommand(
                 type="switch_to_slide",
                 data={
-                    "slide": state_manager.current_slide.dict() if state_manager.current_slide else None
+                    "slide": room.current_slide.dict() if room.current_slide else None
                 }
             ))
         
-        await state_manager.broadcast_to_admin(ControlCommand(
+        await room.broadcast_to_admin(ControlCommand(
             type="state_update",
             data={"mode": mode}
         ))
         
     elif command_type == "select_slide":
+        slide = room.slides.get(command_data.get("slide_id"))
         index = command_data.get("index")
-        if 0 <= index < len(state_manager.slides):
-            state_manager.current_slide_index = index
-            state_manager.current_slide = state_manager.slides[index]
+        if slide is None and isinstance(index, int) and 0 <= index < len(room.slides):
+            slide = room.slides[index]
+        if slide:
+            room.select_slide(slide)
             
-            await state_manager.broadcast_to_display(ControlCommand(
+            await room.broadcast_to_display(ControlCommand(
                 type="slide_change",
-                data={"slide": state_manager.current_slide.dict()}
+                data={"slide": room.current_slide.dict()}
             ))
             
-            await state_manager.broadcast_to_admin(ControlCommand(
+            await room.broadcast_to_admin(ControlCommand(
                 type="state_update",
                 data={
-                    "current_slide_index": state_manager.current_slide_index,
-                    "current_slide": state_manager.current_slide.dict()
+                    "current_slide_index": room.current_slide_index,
+                    "current_slide": room.current_slide.dict()
                 }
             ))
 
-# WebSocket连接 - 显示端
+    elif command_type == "move_track":
+        # 调整曲目顺序（所有房间共享），after_id 为空表示移到最前面
+        track = state_manager.move_track(command_data.get("track_id"), command_data.get("after_id"))
+        if track:
+            await state_manager.broadcast_playlist_delta(updated=[track])
+            await state_manager.broadcast_prefetch()
+
+    elif command_type == "move_slide":
+        slide = state_manager.move_slide(command_data.get("slide_id"), command_data.get("after_id"))
+        if slide:
+            await state_manager.broadcast_to_admin(ControlCommand(
+                type="slides_update",
+                data={"slides": [s.dict() for s in state_manager.slides]}
+            ))
+
+    elif command_type in ("queue_track", "dequeue_track", "clear_queue"):
+        # 待播队列（每个房间独立），play_next 为真时插到队列最前面
+        if command_type == "queue_track":
+            room.enqueue(command_data.get("track_id"), front=bool(command_data.get("play_next")))
+        elif command_type == "dequeue_track":
+            if command_data.get("track_id") in room.up_next:
+                room.up_next.remove(command_data.get("track_id"))
+        else:
+            room.up_next.clear()
+        
+        await room.broadcast_to_admin(ControlCommand(
+            type="state_update",
+            data={"up_next": room.up_next}
+        ))
+        await room.broadcast_prefetch()
+
+    elif command_type == "set_shuffle":
+        room.set_shuffle(bool(command_data.get("enabled")))
+        
+        await room.broadcast_to_admin(ControlCommand(
+            type="state_update",
+            data={"shuffle": room.shuffle_seed is not None}
+        ))
+        await room.broadcast_prefetch()
+
+    elif command_type == "set_timeline":
+        # 替换提示列表（运行中的流程先停止）
+        await room.timeline.stop()
+        ignored = room.timeline.load(command_data.get("cues") or [])
+        if ignored:
+            logger.warning(f"演出流程中有 {ignored} 个无效提示已忽略")
+        await room.broadcast_timeline()
+
+    elif command_type == "start_timeline":
+        index = command_data.get("index", 0)
+        if isinstance(index, int) and await room.timeline.start(index):
+            await room.broadcast_prefetch()
+
+    elif command_type == "stop_timeline":
+        await room.timeline.stop()
+        await room.broadcast_prefetch()
+
+    elif command_type == "timeline_next":
+        await room.timeline.advance()
+
+    if command_type in PLAYHEAD_COMMANDS:
+        await room.timeline.resync()
+
+    # 同步播放状态到其他工作进程
+    room.publish_state()
+
+# WebSocket连接 - 显示端（房间通过路径 /ws/display/{room} 或查询参数 ?room= 指定）
 @app.websocket("/ws/display")
-async def websocket_display(websocket: WebSocket):
-    await state_manager.connect_display(websocket)
+@app.websocket("/ws/display/{room_name}")
+async def websocket_display(websocket: WebSocket, room_name: Optional[str] = None):
+    if not state_manager.accepting_clients:
+        # 热备还没有接管，客户端会换下一个服务器
+        await websocket.close(code=1013)
+        return
+    room = state_manager.get_room(room_name or websocket.query_params.get("room"))
+    connection = await room.connect_display(websocket, *resume_params(websocket))
     try:
         while True:
-            data = await websocket.receive_json()
+            data = await connection.receive()
             # 处理显示端的时间更新等
             if data.get("type") == "time_update":
-                state_manager.current_time = data.get("data", {}).get("time", 0)
+                room.current_time = data.get("data", {}).get("time", 0)
+                room.playhead_anchor = None
+                room.publish_playhead()
+            elif data.get("type") == "cache_progress":
+                await room.update_cache_progress(data.get("data") or {})
+            elif data.get("type") == "clock_sync":
+                # 时钟同步：原样带回客户端时间，加上服务器时间（毫秒），不进入事件日志
+                await connection.send({"type": "clock_sync", "data": {
+                    "client": (data.get("data") or {}).get("client"), "server": time.time() * 1000}})
+            elif data.get("type") == "ack":
+                latency = room.delivery.acknowledge(connection, data.get("data") or {})
+                if latency is not None:
+                    display_ack_latency.observe(latency, room=room.name)
+            if state_manager.relay is not None:
+                await state_manager.relay.forward(room, data)
                 
     except WebSocketDisconnect:
-        state_manager.disconnect_display(websocket)
-        logger.info("显示端WebSocket连接断开")
+        room.disconnect_display(connection)
+        logger.info(f"显示端WebSocket连接断开 (房间: {room.name})")
     except Exception as e:
         logger.error(f"处理显示端消息时出错: {e}")
-        state_manager.disconnect_display(websocket)
+        room.disconnect_display(connection)
+
+# 热备复制流（只有热备会连接）
+@app.websocket("/ws/replica")
+async def websocket_replica(websocket: WebSocket):
+    await websocket.accept()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=REPLICA_QUEUE_LIMIT)
+    queue.put_nowait(state_manager.replication_snapshot())
+    state_manager.replicas.add(queue)
+    logger.info(f"热备已连接: {websocket.client}")
+    try:
+        while queue in state_manager.replicas:
+            try:
+                message = await asyncio.wait_for(queue.get(), HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                message = {"kind": "heartbeat"}
+            await websocket.send_text(json.dumps(message, ensure_ascii=False))
+        await websocket.close(code=1013)
+    except WebSocketDisconnect:
+        logger.info("热备连接断开")
+    except Exception as e:
+        logger.warning(f"向热备发送复制流失败: {e}")
+    finally:
+        state_manager.replicas.discard(queue)
+
+async def send_heartbeats():
+    """配置了服务器列表时定时向所有客户端发送心跳（不记入事件日志），客户端超时没有收到任何消息就换服务器"""
+    payload = {"type": "heartbeat"}
+    while True:
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+        connections = [connection for _, _, connection in iter_connections()]
+        if not connections:
+            continue
+        frames = encode_per_codec(connections, payload)
+        for connection in connections:
+            try:
+                await connection.send_frame(frames[connection.codec.name])
+            except Exception:
+                pass
+
+async def retransmit_unacked():
+    """定时重发超时未确认的关键命令"""
+    while True:
+        await asyncio.sleep(ACK_DEADLINE / 4)
+        for room in list(state_manager.rooms.values()):
+            try:
+                resend, dropped = room.delivery.overdue()
+                for connection, frame in resend:
+                    await connection.send_frame(frame)
+                if resend:
+                    display_retransmits.inc(len(resend), room=room.name)
+                if dropped:
+                    display_dropped.inc(dropped, room=room.name)
+                    logger.warning(f"房间 {room.name} 有 {dropped} 条关键命令重发后仍未被显示端确认")
+            except Exception as e:
+                logger.error(f"重发未确认的关键命令时出错 (房间: {room.name}): {e}")
+
+# 服务器列表（客户端连接失败或心跳中断时依次尝试）
+@app.get("/api/endpoints")
+async def get_endpoints():
+    return {
+        "endpoints": FAILOVER_ENDPOINTS,
+        "role": state_manager.role,
+        "heartbeat_interval": HEARTBEAT_INTERVAL,
+        "failover_timeout": FAILOVER_TIMEOUT,
+    }
 
 # API路由
 @app.post("/api/upload/music")
@@ -683,14 +1720,91 @@ async def upload_music(
     # 添加到播放列表
     state_manager.add_track(track)
     
+    # 后台分析波形和响度，并生成转码版本
+    spawn_background(analyze_track(track))
+    transcode_queue.enqueue(track.id, music_path)
+    
     # 广播更新
-    await state_manager.broadcast_to_admin(ControlCommand(
-        type="playlist_update",
-        data={"playlist": [t.dict() for t in state_manager.playlist]}
-    ))
+    await state_manager.broadcast_playlist_delta(added=[track])
+    await state_manager.broadcast_prefetch()
     
     return {"success": True, "track": track.dict()}
 
+def resolve_import_directory(directory: str) -> Optional[Path]:
+    """服务器端目录导入只允许 IMPORT_DIRECTORY_ROOTS 之下的目录"""
+    path = Path(directory).expanduser().resolve()
+    if not path.is_dir():
+        return None
+    for root in IMPORT_DIRECTORY_ROOTS:
+        root = Path(root).expanduser().resolve()
+        if path == root or root in path.parents:
+            return path
+    return None
+
+@app.post("/api/upload/music/batch")
+async def upload_music_batch(
+    files: List[UploadFile] = File(None),
+    directory: str = Form(""),
+    recursive: bool = Form(False),
+    skip_duplicates: bool = Form(True)
+):
+    """批量导入音乐：上传多个文件（同名的封面和歌词一起导入，文件名可以带文件夹路径），或导入服务器上的目录"""
+    batch = ImportBatch(skip_duplicates=skip_duplicates)
+    try:
+        if directory:
+            if not IMPORT_DIRECTORY_ROOTS:
+                raise HTTPException(403, "服务器端目录导入未开启（设置 PYER_IMPORT_ROOTS 指定允许导入的目录）")
+            path = resolve_import_directory(directory)
+            if path is None:
+                raise HTTPException(400, "目录不存在或不在允许导入的范围内")
+            batch.add_directory(path, recursive)
+        
+        received_bytes = 0
+        for upload in files or []:
+            if upload.filename:
+                saved = await asyncio.to_thread(batch.receive, upload.filename, upload.file)
+                if saved is not None:
+                    received_bytes += saved.stat().st_size
+        upload_bytes.inc(received_bytes, subdir="batch")
+        
+        if not batch.sources:
+            raise HTTPException(400, "没有可导入的音频文件")
+        
+        # 摘要、时长、标签和文件复制都在线程池中并行完成
+        digests = await asyncio.to_thread(library_digests) if skip_duplicates else {}
+        await asyncio.to_thread(batch.plan, set(digests.values()))
+        await asyncio.to_thread(batch.prepare)
+        
+        # 一次事务登记全部曲目
+        with persistence_manager.transaction():
+            store_digests(digests)
+            # 现场算出的摘要也记到内存中的曲目上，和数据库记录保持一致
+            for track_id, digest in digests.items():
+                track = state_manager.playlist.get(track_id)
+                if track is not None and not track.sha1:
+                    track.sha1 = digest
+            tracks = [Track(**record) for record in batch.commit(present_digests())]
+            if tracks:
+                state_manager.add_tracks(tracks)
+    finally:
+        await asyncio.to_thread(batch.discard)
+    
+    for track in tracks:
+        spawn_background(analyze_track(track))
+        transcode_queue.enqueue(track.id, UPLOAD_FOLDER / "music" / track.url.split("/")[-1])
+    
+    if tracks:
+        await state_manager.broadcast_playlist_delta(added=tracks)
+        await state_manager.broadcast_prefetch()
+    
+    logger.info(f"批量导入完成: {len(tracks)} 首，跳过重复 {len(batch.skipped)} 首")
+    return {
+        "success": True,
+        "message": f"已导入 {len(tracks)} 首，跳过重复 {len(batch.skipped)} 首",
+        "tracks": [track.dict() for track in tracks],
+        "skipped": [path.name for path in batch.skipped],
+    }
+
 @app.post("/api/upload/slide")
 async def upload_slide(
     slide_file: UploadFile = File(...),
@@ -724,10 +1838,8 @@ async def upload_slide(
 async def delete_track(track_id: str):
     state_manager.remove_track(track_id)
     
-    await state_manager.broadcast_to_admin(ControlCommand(
-        type="playlist_update",
-        data={"playlist": [t.dict() for t in state_manager.playlist]}
-    ))
+    await state_manager.broadcast_playlist_delta(removed=[track_id])
+    await state_manager.broadcast_prefetch()
     
     return {"success": True}
 
@@ -742,21 +1854,200 @@ async def delete_slide(slide_id: str):
     
     return {"success": True}
 
+def parse_fields(fields: Optional[str], model) -> Optional[Set[str]]:
+    """解析 ?fields=id,title 字段投影，未指定时返回None（全部字段），始终包含 id"""
+    if not fields:
+        return None
+    selected = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = selected - set(model.__fields__)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"未知字段: {', '.join(sorted(unknown))}")
+    return selected | {"id"}
+
+def encode_cursor(item) -> str:
+    return f"{item.position}.{item.id}"
+
+def decode_cursor(cursor: str):
+    position, _, item_id = cursor.partition(".")
+    if not position or not item_id:
+        raise HTTPException(status_code=400, detail="无效的游标")
+    return (position, item_id)
+
+def etag_response(request: Request, payload) -> Response:
+    """JSON响应加上内容摘要ETag（各工作进程算出的相同），If-None-Match 命中时返回304"""
+    body = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    etag = f'"{hashlib.sha1(body).hexdigest()[:20]}"'
+    headers = {"etag": etag, "cache-control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def list_page(request: Request, collection: OrderedList, model, cursor: Optional[str], limit: Optional[int],
+              fields: Optional[str], ids: Optional[str]) -> Response:
+    """按位置键顺序分页：游标是上一页最后一条的 (位置键, ID)，列表中间插入或删除不会跳过或重复"""
+    include = parse_fields(fields, model)
+    if ids:
+        # 按ID批量查询（例如待播队列中还没加载的曲目）
+        items = [item for item in map(collection.get, ids.split(",")[:LIST_MAX_LIMIT]) if item is not None]
+        return etag_response(request, {"items": [item.dict(include=include) for item in items]})
+    
+    limit = max(1, min(limit or LIST_PAGE_SIZE, LIST_MAX_LIMIT))
+    items = collection.window(decode_cursor(cursor) if cursor else None, limit + 1)
+    has_more = len(items) > limit
+    items = items[:limit]
+    return etag_response(request, {
+        "total": len(collection),
+        "items": [item.dict(include=include) for item in items],
+        "next_cursor": encode_cursor(items[-1]) if has_more else None,
+    })
+
 @app.get("/api/state")
-async def get_state():
+async def get_state(request: Request, room: Optional[str] = None, view: str = "full", fields: Optional[str] = None):
+    """房间状态；view=summary 只返回正在播放的摘要，fields 限定播放列表中曲目的字段"""
+    target = state_manager.get_room(room)
+    if view == "summary":
+        return etag_response(request, target.build_summary())
+    return etag_response(request, target.build_state(parse_fields(fields, Track)))
+
+@app.get("/api/library/tracks")
+async def list_tracks(request: Request, cursor: Optional[str] = None, limit: Optional[int] = None,
+                      fields: Optional[str] = None, ids: Optional[str] = None):
+    """分页列出播放列表，例如 ?fields=id,title,artist&limit=100，下一页传入返回的 next_cursor"""
+    return list_page(request, state_manager.playlist, Track, cursor, limit, fields, ids)
+
+@app.get("/api/library/slides")
+async def list_slides(request: Request, cursor: Optional[str] = None, limit: Optional[int] = None,
+                      fields: Optional[str] = None, ids: Optional[str] = None):
+    return list_page(request, state_manager.slides, Slide, cursor, limit, fields, ids)
+
+@app.get("/api/offline/manifest")
+async def get_offline_manifest(request: Request, since: Optional[str] = None):
+    """显示端离线缓存清单：播放列表和幻灯片用到的所有文件及内容摘要（since 为已同步的版本时只返回差异）"""
+    if state_manager.relay is not None:
+        # 中继没有曲库，使用主服务器的清单（文件仍从中继下载）
+        try:
+            manifest = await asyncio.to_thread(state_manager.relay.media.fetch_json,
+                                               "/api/offline/manifest" + (f"?since={since}" if since else ""))
+        except OSError as e:
+            raise HTTPException(502, f"获取主服务器清单失败: {e}")
+        return etag_response(request, manifest)
+    manifest = await asyncio.to_thread(offline_manifest.build, list(state_manager.playlist),
+                                       list(state_manager.slides), since)
+    manifest["rate_limit"] = OFFLINE_CACHE_RATE
+    return etag_response(request, manifest)
+
+@app.get("/api/search")
+async def search_tracks(q: str = "", offset: int = 0, limit: int = 20, fields: Optional[str] = None):
+    """搜索曲库（标题、艺术家、歌词，支持前缀和拼音），fields 可限定字段，如 title,artist"""
+    limit = max(1, min(limit, SEARCH_MAX_LIMIT))
+    offset = max(0, offset)
+    started = time.perf_counter()
+    total, tracks = search_index.search(q, offset, limit, fields.split(",") if fields else None)
+    took = time.perf_counter() - started
+    
+    return {
+        "query": q,
+        "total": total,
+        "offset": offset,
+        "limit": limit,
+        "items": [track.dict() for track in tracks],
+        "took_ms": round(took * 1000, 3),
+        "indexing": search_index.building,
+    }
+
+@app.get("/api/rooms")
+async def list_rooms():
+    """列出本进程已知的房间"""
     return {
-        "mode": state_manager.current_mode,
-        "is_playing": state_manager.is_playing,
-        "current_time": state_manager.current_time,
-        "volume": state_manager.volume,
-        "playlist": [track.dict() for track in state_manager.playlist],
-        "slides": [slide.dict() for slide in state_manager.slides],
-        "current_track_index": state_manager.current_track_index,
-        "current_slide_index": state_manager.current_slide_index,
-        "current_track": state_manager.current_track.dict() if state_manager.current_track else None,
-        "current_slide": state_manager.current_slide.dict() if state_manager.current_slide else None,
+        "rooms": [
+            {
+                "name": room.name,
+                "mode": room.current_mode,
+                "is_playing": room.is_playing,
+                "current_track": room.current_track.title if room.current_track else None,
+                "admin_count": len(room.admin_connections),
+                "display_count": len(room.display_connections),
+            }
+            for room in state_manager.rooms.values()
+        ]
     }
 
+@app.get("/api/track/{track_id}/waveform")
+async def get_track_waveform(track_id: str):
+    """获取曲目的峰值波形（每个点一个字节，0-255）"""
+    waveform = persistence_manager.load_waveform(track_id)
+    if waveform is None:
+        raise HTTPException(404, "波形数据不存在")
+    return Response(
+        content=waveform,
+        media_type="application/octet-stream",
+        headers={"Cache-Control": "public, max-age=86400"}
+    )
+
+@app.api_route("/media/{subdir}/{filename}", methods=["GET", "HEAD"])
+async def stream_media(subdir: str, filename: str, request: Request, client: Optional[str] = None):
+    """音频流式传输（支持Range请求），client参数用于按显示端统计流量"""
+    path = media_server.resolve(subdir, filename)
+    if path is None:
+        raise HTTPException(404, "文件不存在")
+
+    client_id = client or (request.client.host if request.client else "unknown")
+    return media_server.build_response(
+        path,
+        client_id,
+        request.headers.get("range"),
+        request.headers.get("if-none-match"),
+        request.method
+    )
+
+@app.get("/metrics")
+async def get_metrics_prometheus():
+    """Prometheus格式的运行指标"""
+    return PlainTextResponse(registry.render_prometheus(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/api/metrics")
+async def get_metrics(room: Optional[str] = None):
+    """JSON格式的运行指标（管理端显示），指定 room 时只列出该房间的连接"""
+    room_filter = state_manager.get_room(room).name if room is not None else None
+    return {
+        **registry.snapshot(),
+        "connections": [{
+            "room": room_name,
+            "target": kind,
+            "codec": connection.codec.name,
+            "queue_depth": connection.queue_depth,
+            "connected_at": connection.connected_at,
+        } for room_name, kind, connection in iter_connections() if room_filter in (None, room_name)],
+        "delivery": [{"room": room_name, **client}
+                     for room_name, room in state_manager.rooms.items() if room_filter in (None, room_name)
+                     for client in room.delivery.summary()],
+    }
+
+@app.get("/api/debug/stalls")
+async def get_loop_stalls():
+    """最近记录的事件循环卡顿及当时的调用栈"""
+    return {"threshold": loop_watchdog.threshold, "stalls": loop_watchdog.report()}
+
+@app.get("/api/debug/profile")
+async def profile_server(seconds: float = 5.0, interval_ms: float = 5.0, all_threads: bool = False):
+    """采样指定秒数的调用栈，返回折叠栈文件（可用 flamegraph.pl 或 speedscope 打开）"""
+    if sampling_profiler.busy:
+        raise HTTPException(409, "已有采样任务在运行")
+    thread_ids = None if all_threads else [threading.get_ident()]
+    try:
+        stacks = await asyncio.to_thread(sampling_profiler.sample, seconds, max(interval_ms, 1.0) / 1000, thread_ids)
+    except RuntimeError as e:
+        raise HTTPException(409, str(e))
+    filename = f"profile-{datetime.now().strftime('%Y%m%d-%H%M%S')}.folded"
+    return PlainTextResponse(sampling_profiler.render_collapsed(stacks),
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@app.get("/api/media/stats")
+async def get_media_stats():
+    """获取各客户端的媒体流量统计"""
+    return media_server.stats()
+
 @app.get("/api/lyrics/{filename}")
 async def get_lyrics(filename: str):
     """获取歌词文件内容"""
@@ -766,26 +2057,32 @@ async def get_lyrics(filename: str):
         raise HTTPException(404, "歌词文件不存在")
     
     try:
-        with open(lyrics_path, 'r', encoding='utf-8') as f:
-            content = f.read()
+        content = read_lyrics_text(lyrics_path)
         return {"content": content}
     except UnicodeDecodeError:
-        try:
-            with open(lyrics_path, 'r', encoding='gbk') as f:
-                content = f.read()
-            return {"content": content}
-        except:
-            raise HTTPException(500, "歌词文件编码不支持")
+        raise HTTPException(500, "歌词文件编码不支持")
     except Exception as e:
         logger.error(f"读取歌词文件失败: {e}")
         raise HTTPException(500, "读取歌词文件失败")
 
+@app.get("/api/maintenance/cleanup")
+async def get_cleanup_status():
+    """上传文件回收状态（候选文件数和最近一轮的报告）"""
+    return upload_collector.status()
+
 @app.post("/api/maintenance/cleanup")
-async def cleanup_orphaned_files():
-    """清理孤立的文件"""
+async def cleanup_orphaned_files(dry_run: bool = False):
+    """回收没有被引用的上传文件：dry_run 时只报告可回收的文件，否则在后台回收一轮"""
+    if state_manager.relay is not None:
+        return {"success": False, "message": "中继模式的上传目录是主服务器文件的缓存，不回收"}
     try:
-        persistence_manager.cleanup_orphaned_files()
-        return {"success": True, "message": "文件清理完成"}
+        if dry_run:
+            report = await upload_collector.collect(dry_run=True)
+            return {"success": True, "message": f"可回收 {len(report['reclaimable'])} 个文件", "report": report}
+        if upload_collector.running:
+            return {"success": True, "message": "正在回收上传文件", "status": upload_collector.status()}
+        spawn_background(upload_collector.collect())
+        return {"success": True, "message": f"已开始回收（文件需要连续 {upload_collector.grace_period:.0f} 秒没有被引用）"}
     except Exception as e:
         logger.error(f"清理文件失败: {e}")
         return {"success": False, "message": f"清理失败: {e}"}
@@ -804,12 +2101,73 @@ async def backup_database():
 async def repair_audio_durations():
     """修复所有音频文件的时长信息"""
     try:
-        repaired_count = persistence_manager.repair_music_durations()
+        repaired_count = await asyncio.to_thread(persistence_manager.repair_music_durations)
+        if repaired_count:
+            await apply_library_reload()
         return {"success": True, "message": f"已修复 {repaired_count} 个音频文件的时长", "repaired_count": repaired_count}
     except Exception as e:
         logger.error(f"修复音频时长失败: {e}")
         return {"success": False, "message": f"修复失败: {e}"}
 
+async def apply_library_reload() -> Dict[str, List]:
+    """重新读取曲库，为新曲目安排分析和转码，并通知各端"""
+    changes = state_manager.reload_library()
+    
+    for track in changes["added"]:
+        if not track.waveform_url:
+            spawn_background(analyze_track(track))
+        if not track.stream_url:
+            transcode_queue.enqueue(track.id, UPLOAD_FOLDER / "music" / track.url.split("/")[-1])
+    
+    if changes["added"] or changes["removed"] or changes["updated"]:
+        await state_manager.broadcast_playlist_delta(changes["added"], changes["removed"], changes["updated"])
+        await state_manager.broadcast_prefetch()
+    if changes["slides_changed"]:
+        await state_manager.broadcast_to_admin(ControlCommand(
+            type="slides_update",
+            data={"slides": [s.dict() for s in state_manager.slides]}
+        ))
+    return changes
+
+@app.post("/api/maintenance/reload")
+async def reload_library():
+    """重新读取数据库文件（命令行曲库工具修改曲库后调用）"""
+    try:
+        changes = await apply_library_reload()
+        return {
+            "success": True,
+            "message": f"曲库已重新加载: 新增 {len(changes['added'])} 首，删除 {len(changes['removed'])} 首，"
+                       f"更新 {len(changes['updated'])} 首",
+            "added_count": len(changes["added"]),
+            "removed_count": len(changes["removed"]),
+            "updated_count": len(changes["updated"]),
+        }
+    except Exception as e:
+        logger.error(f"重新加载曲库失败: {e}")
+        return {"success": False, "message": f"重新加载失败: {e}"}
+
+@app.post("/api/maintenance/analyze")
+async def analyze_all_tracks():
+    """为尚未分析的曲目补做波形和响度分析"""
+    pending = [track for track in state_manager.playlist if not track.waveform_url]
+    for track in pending:
+        spawn_background(analyze_track(track))
+    return {"success": True, "message": f"已安排分析 {len(pending)} 首音乐", "scheduled_count": len(pending)}
+
+@app.post("/api/maintenance/transcode")
+async def transcode_all_tracks():
+    """为尚未转码的曲目生成标准化版本"""
+    if not transcode_queue.available:
+        return {"success": False, "message": "转码不可用（未安装ffmpeg或已禁用）", "scheduled_count": 0}
+
+    scheduled = 0
+    for track in state_manager.playlist:
+        if not track.stream_url:
+            music_path = UPLOAD_FOLDER / "music" / track.url.split("/")[-1]
+            if transcode_queue.enqueue(track.id, music_path):
+                scheduled += 1
+    return {"success": True, "message": f"已安排转码 {scheduled} 首音乐", "scheduled_count": scheduled}
+
 @app.get("/api/maintenance/status")
 async def get_maintenance_status():
     """获取维护状态"""
@@ -832,18 +2190,100 @@ async def admin_page():
 async def display_page():
     return FileResponse("display/index.html")
 
+# 离线缓存的 Service Worker 需要放在根路径，才能拦截 /media/、/uploads/ 和 /api/lyrics/ 的请求
+@app.get("/sw.js")
+async def service_worker():
+    return FileResponse("display/sw.js", media_type="application/javascript", headers={"cache-control": "no-cache"})
+
+# 启动报告（各阶段耗时，秒）
+startup_report: Dict[str, float] = {}
+
+async def startup():
+    started = time.perf_counter()
+    startup_report["import"] = started - IMPORT_STARTED
+    
+    ensure_upload_dirs()
+    
+    phase_started = time.perf_counter()
+    persistence_manager.load()
+    startup_report["persistence"] = time.perf_counter() - phase_started
+    
+    phase_started = time.perf_counter()
+    state_manager.startup()
+    startup_report["state"] = time.perf_counter() - phase_started
+    
+    # 搜索索引需要读取歌词文件，在线程中建立，不推迟启动
+    spawn_background(asyncio.to_thread(search_index.rebuild, list(state_manager.playlist)))
+    
+    await state_manager.bus.start()
+    if state_manager.relay is not None:
+        # 默认房间立即开始镜像，第一个显示端连接时已经有状态和缓存
+        state_manager.relay.follow(state_manager.get_room(DEFAULT_ROOM))
+        logger.info(f"中继模式: 主服务器 {state_manager.relay.upstream}")
+    if state_manager.standby is not None:
+        await state_manager.standby.start()
+        logger.info(f"热备模式: 主服务器 {state_manager.standby.primary}")
+    if FAILOVER_ENDPOINTS:
+        spawn_background(send_heartbeats())
+    spawn_background(retransmit_unacked())
+    if state_manager.relay is None:
+        upload_collector.start(GC_INTERVAL)
+    loop_lag_monitor.start()
+    loop_watchdog.start()
+    
+    startup_report["init"] = time.perf_counter() - started
+    for phase, seconds in startup_report.items():
+        startup_duration.set(seconds, phase=phase)
+    logger.info(
+        f"启动完成: 导入 {startup_report['import'] * 1000:.0f} ms, 初始化 {startup_report['init'] * 1000:.0f} ms"
+        f"（加载数据库 {startup_report['persistence'] * 1000:.0f} ms, 加载曲库 {startup_report['state'] * 1000:.0f} ms）"
+    )
+
+async def shutdown():
+    state_manager.checkpoint.flush()
+    if state_manager.relay is not None:
+        await state_manager.relay.stop()
+    if state_manager.standby is not None:
+        await state_manager.standby.stop()
+    await upload_collector.stop()
+    await loop_lag_monitor.stop()
+    await loop_watchdog.stop()
+    await state_manager.bus.stop()
+    track_analyzer.shutdown()
+    await transcode_queue.shutdown()
+    media_server.file_cache.clear()
+
 # 健康检查端点
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "timestamp": datetime.now().isoformat()}
+    return {
+        "status": "healthy",
+        "timestamp": datetime.now().isoformat(),
+        "startup_ms": {phase: round(seconds * 1000, 1) for phase, seconds in startup_report.items()},
+    }
 
 def main():
+    import uvicorn
+    
     print(f"服务器启动中...")
     print(f"管理端地址: http://{SERVER_HOST}:{SERVER_PORT}/admin")
     print(f"显示端地址: http://{SERVER_HOST}:{SERVER_PORT}/display")
     print(f"按 Ctrl+C 停止服务器")
     
-    if DEBUG:
+    if SERVER_WORKERS > 1:
+        # 多进程模式：主进程运行总线中转，各工作进程通过Unix Socket共享状态（不支持热重载）
+        os.environ["PYER_BUS_BACKEND"] = "unix"
+        os.environ["PYER_BUS_SOCKET"] = BUS_SOCKET_PATH
+        BusHub(BUS_SOCKET_PATH).start_in_thread()
+        uvicorn.run(
+            "server:app",
+            host=SERVER_HOST,
+            port=SERVER_PORT,
+            workers=SERVER_WORKERS,
+            ws_ping_interval=WEBSOCKET_PING_INTERVAL,
+            ws_ping_timeout=WEBSOCKET_PING_TIMEOUT
+        )
+    elif DEBUG:
         # 开发模式：使用热重载
         uvicorn.run(
             "server:app",
@@ -0,0 +1,46 @@
+"""
+断线重连时的会话恢复
+
+每个房间的显示端和管理端各有一个事件日志：广播给这一类连接的每条消息都带上递增的序号，
+最近的若干条保存在环形缓冲区中。连接时服务器下发恢复令牌和当前序号，客户端重连时在URL中带上
+?resume=令牌&seq=最后收到的序号，服务器只补发缺少的消息；令牌不匹配（服务器重启、连到了其他
+工作进程）或缓冲区已经覆盖掉缺少的部分时，改为发送完整快照。
+"""
+
+import uuid
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from config import RESUME_BUFFER_SIZE
+
+
+class EventLog:
+    def __init__(self, size: int = RESUME_BUFFER_SIZE):
+        # 令牌区分不同的日志实例，序号只在同一个实例内有意义
+        self.token = uuid.uuid4().hex[:16]
+        self.seq = 0
+        self.events: Deque[Dict[str, Any]] = deque(maxlen=size)
+
+    def append(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """记录一条广播消息，返回带序号的副本（同一条消息可能同时发给多个房间）"""
+        self.seq += 1
+        event = {**payload, "seq": self.seq}
+        self.events.append(event)
+        return event
+
+    def since(self, token: Optional[str], seq: Optional[int]) -> Optional[List[Dict[str, Any]]]:
+        """序号 seq 之后的消息；无法补齐时返回None，需要发送快照"""
+        if token != self.token or seq is None or seq < 0 or seq > self.seq:
+            return None
+        if seq == self.seq:
+            return []
+        if not self.events or self.events[0]["seq"] > seq + 1:
+            return None
+        return [event for event in self.events if event["seq"] > seq]
+
+    def session(self, resumed: bool, replayed: int = 0) -> Dict[str, Any]:
+        """连接建立时发给客户端的会话信息"""
+        return {
+            "type": "session",
+            "data": {"token": self.token, "seq": self.seq, "resumed": resumed, "replayed": replayed},
+        }
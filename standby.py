@@ -0,0 +1,155 @@
+"""
+热备实例
+
+运行主服务器的电脑死机不能让演出中断。热备实例（PYER_STANDBY_OF=主服务器地址）通过主服务器的 /ws/replica 持续接收：
+- 连接时的完整快照：曲库数据库记录和各房间的播放状态
+- 之后的曲库修改和播放状态（与多进程总线上的消息相同），写入本地数据库
+- 心跳（没有其他消息时每 HEARTBEAT_INTERVAL 秒一次）
+曲库引用的媒体文件在后台逐个下载到本地上传目录。
+
+主服务器存活时热备拒绝显示端和管理端的连接，超过 FAILOVER_TIMEOUT 秒没有收到任何消息时接管：开始接受连接，
+播放进度从最后一次收到的状态按经过的时间推算（Room.playhead）。客户端从 /api/endpoints 得到服务器列表，
+连接断开或心跳中断后依次尝试列表中的服务器。原来的主服务器恢复后需要作为新主服务器的热备重新启动。
+"""
+
+import json
+import time
+import asyncio
+import logging
+from pathlib import Path
+from typing import List, Optional
+
+import websockets
+
+from config import FAILOVER_TIMEOUT, HEARTBEAT_INTERVAL, RELAY_TIMEOUT
+from persistence import persistence_manager
+from relay import UpstreamMedia, upload_path, websocket_base
+
+logger = logging.getLogger(__name__)
+
+# 修改曲库的日志消息（应用后写入本地数据库）
+LIBRARY_KINDS = {"track_added", "tracks_added", "track_removed", "track_updated",
+                 "slide_added", "slide_removed", "slide_updated"}
+
+# 曲目和幻灯片记录中引用上传文件的字段
+MEDIA_FIELDS = ("url", "stream_url", "cover_url", "lyrics_url", "thumbnail_url")
+
+
+class Standby:
+    def __init__(self, primary: str, root: Path, manager):
+        self.primary = primary.rstrip("/")
+        self.media = UpstreamMedia(self.primary, root)
+        self.manager = manager
+        self.promoted = False
+        self.synced = False
+        self.last_seen = time.monotonic()
+        self.socket = None
+        self.media_queue: Optional[asyncio.Queue] = None
+        self.tasks: List[asyncio.Task] = []
+
+    async def start(self):
+        self.last_seen = time.monotonic()
+        self.media_queue = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        self.tasks = [loop.create_task(self.follow()), loop.create_task(self.watch()),
+                      loop.create_task(self.sync_media())]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        for task in self.tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self.tasks = []
+
+    async def follow(self):
+        """订阅主服务器的复制流，断开后重连（接管后停止）"""
+        url = f"{websocket_base(self.primary)}/ws/replica"
+        attempt = 0
+        while not self.promoted:
+            try:
+                async with websockets.connect(url, max_size=None, open_timeout=RELAY_TIMEOUT) as socket:
+                    self.socket = socket
+                    attempt = 0
+                    logger.info(f"热备已连接主服务器 {self.primary}")
+                    async for raw in socket:
+                        if self.promoted:
+                            break
+                        self.last_seen = time.monotonic()
+                        await self.apply(json.loads(raw))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"热备与主服务器的连接断开: {e}")
+            finally:
+                self.socket = None
+            await asyncio.sleep(min(FAILOVER_TIMEOUT / 2, 0.25 * 2 ** attempt))
+            attempt += 1
+
+    async def watch(self):
+        """主服务器超过 FAILOVER_TIMEOUT 秒没有消息时接管"""
+        while not self.promoted:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            if time.monotonic() - self.last_seen > FAILOVER_TIMEOUT:
+                self.promote()
+
+    def promote(self):
+        self.promoted = True
+        if self.socket is not None:
+            asyncio.get_running_loop().create_task(self.socket.close())
+        for room in self.manager.rooms.values():
+            logger.info(f"房间 {room.name}: {room.current_track.title if room.current_track else '无曲目'} "
+                        f"{'播放中' if room.is_playing else '暂停'} {room.playhead():.1f}s")
+        logger.warning(f"主服务器 {FAILOVER_TIMEOUT} 秒没有心跳，热备接管"
+                       f"（{'已同步' if self.synced else '未能同步，使用本地数据'}）")
+
+    async def apply(self, message: dict):
+        kind = message.get("kind")
+        if kind == "heartbeat":
+            return
+        if kind == "snapshot":
+            self.apply_snapshot(message)
+            return
+
+        await self.manager.handle_bus_message(message)
+        if kind in LIBRARY_KINDS:
+            persistence_manager.flush()
+            for record in message.get("tracks") or [message.get("track") or message.get("slide")
+                                                    or message.get("updates") or {}]:
+                self.queue_media(record)
+        elif kind == "state":
+            self.anchor(self.manager.get_room(message.get("room")))
+
+    def apply_snapshot(self, message: dict):
+        """用主服务器的完整快照替换本地曲库和播放状态"""
+        persistence_manager.replace_all(message["tracks"], message["slides"])
+        # 媒体文件还没下载完，不能走 reload_library（会丢掉文件不存在的记录）
+        changes = self.manager.apply_library(message["tracks"], message["slides"])
+        for name, state in message["rooms"].items():
+            room = self.manager.get_room(name)
+            room.apply_state(state)
+            self.anchor(room)
+        for record in message["tracks"] + message["slides"]:
+            self.queue_media(record)
+        self.synced = True
+        logger.info(f"热备已同步主服务器快照: {len(message['tracks'])} 首音乐，{len(message['slides'])} 个幻灯片，"
+                    f"{len(message['rooms'])} 个房间（新增 {len(changes['added'])}，删除 {len(changes['removed'])}）")
+
+    def anchor(self, room):
+        """从收到状态的时刻开始推算进度，接管时显示端拿到的是推算后的位置"""
+        room.playhead_anchor = time.monotonic() if room.is_playing else None
+
+    def queue_media(self, record: dict):
+        for field in MEDIA_FIELDS:
+            relative = upload_path(record.get(field) or "")
+            if relative is not None and not (self.media.root / relative).is_file():
+                self.media_queue.put_nowait(relative)
+
+    async def sync_media(self):
+        """逐个下载曲库引用的媒体文件（同一时间只占用一条下载连接）"""
+        while True:
+            relative = await self.media_queue.get()
+            if not (self.media.root / relative).is_file():
+                await self.media.ensure(relative)
@@ -0,0 +1,303 @@
+"""
+媒体流式传输：支持HTTP Range请求的音频文件服务
+
+- 缓存常用文件的描述符（LRU），避免每个分段请求都重新打开文件
+- ASGI服务器支持 zerocopysend 扩展时使用零拷贝发送，否则用 pread 分块读取（没有 pread 的 Windows 上加锁 seek + read）
+- 按客户端统计发送的字节数（只保留最近的 MEDIA_BANDWIDTH_CLIENTS 个客户端）
+"""
+
+import os
+import time
+import threading
+import mimetypes
+import logging
+from collections import OrderedDict
+from email.utils import formatdate
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import anyio
+from starlette.responses import Response, StreamingResponse
+from starlette.types import Send
+
+from config import MEDIA_FD_CACHE_SIZE, MEDIA_CHUNK_SIZE, MEDIA_BANDWIDTH_CLIENTS
+
+logger = logging.getLogger(__name__)
+
+
+class CachedFile:
+    """已打开的文件描述符（带引用计数，被淘汰时等所有请求结束才关闭）"""
+
+    def __init__(self, path: Path, fd: int, stat: os.stat_result):
+        self.path = path
+        self.fd = fd
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        self.identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        self.refs = 0
+        self.evicted = False
+        self.lock = threading.Lock()  # 没有 pread 时 seek + read 需要互斥
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.identity[1]:x}-{self.size:x}"'
+
+    def read(self, size: int, offset: int) -> bytes:
+        """从 offset 读取最多 size 字节（在线程中调用，多个请求共用同一个描述符）"""
+        if hasattr(os, "pread"):
+            return os.pread(self.fd, size, offset)
+        with self.lock:
+            os.lseek(self.fd, offset, os.SEEK_SET)
+            return os.read(self.fd, size)
+
+    def close_if_unused(self):
+        if self.evicted and self.refs == 0:
+            try:
+                os.close(self.fd)
+            except OSError:
+                pass
+
+
+class FileHandleCache:
+    """文件描述符LRU缓存"""
+
+    def __init__(self, max_size: int = MEDIA_FD_CACHE_SIZE):
+        self.max_size = max_size
+        self.entries: "OrderedDict[Path, CachedFile]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def acquire(self, path: Path) -> CachedFile:
+        """获取文件（不存在时抛出FileNotFoundError），用完必须调用release"""
+        stat = os.stat(path)
+        entry = self.entries.get(path)
+
+        if entry is not None and entry.identity == (stat.st_ino, stat.st_mtime_ns, stat.st_size):
+            self.entries.move_to_end(path)
+            self.hits += 1
+        else:
+            if entry is not None:
+                self.evict(path)
+            fd = os.open(path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+            entry = CachedFile(path, fd, os.fstat(fd))
+            self.entries[path] = entry
+            self.misses += 1
+            while len(self.entries) > self.max_size:
+                self.evict(next(iter(self.entries)))
+
+        entry.refs += 1
+        return entry
+
+    def release(self, entry: CachedFile):
+        entry.refs -= 1
+        entry.close_if_unused()
+
+    def evict(self, path: Path):
+        entry = self.entries.pop(path, None)
+        if entry is not None:
+            entry.evicted = True
+            entry.close_if_unused()
+
+    def clear(self):
+        for path in list(self.entries):
+            self.evict(path)
+
+
+class BandwidthTracker:
+    """按客户端统计媒体流量（客户端ID来自查询参数，LRU淘汰，数量有上限）"""
+
+    def __init__(self, max_clients: int = MEDIA_BANDWIDTH_CLIENTS):
+        self.max_clients = max_clients
+        self.clients: "OrderedDict[str, Dict]" = OrderedDict()
+
+    def get_client(self, client_id: str) -> Dict:
+        client_id = client_id[:64]
+        stats = self.clients.get(client_id)
+        if stats is not None:
+            self.clients.move_to_end(client_id)
+        else:
+            while len(self.clients) >= self.max_clients:
+                self.clients.popitem(last=False)
+            stats = self.clients[client_id] = {
+                "bytes_sent": 0,
+                "requests": 0,
+                "range_requests": 0,
+                "last_seen": 0.0,
+                "last_file": None,
+            }
+        return stats
+
+    def record_request(self, client_id: str, filename: str, is_range: bool):
+        stats = self.get_client(client_id)
+        stats["requests"] += 1
+        if is_range:
+            stats["range_requests"] += 1
+        stats["last_seen"] = time.time()
+        stats["last_file"] = filename
+
+    def record_bytes(self, client_id: str, count: int):
+        stats = self.get_client(client_id)
+        stats["bytes_sent"] += count
+        stats["last_seen"] = time.time()
+
+    def snapshot(self) -> Dict:
+        clients = sorted(self.clients.items(), key=lambda item: item[1]["bytes_sent"], reverse=True)
+        return {
+            "total_bytes": sum(stats["bytes_sent"] for _, stats in clients),
+            "clients": [{"client_id": client_id, **stats} for client_id, stats in clients],
+        }
+
+
+def parse_range_header(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    解析Range头，返回闭区间(start, end)
+
+    没有Range头或是多段Range时返回None（按完整文件响应），无法满足时抛出ValueError。
+    """
+    if not range_header:
+        return None
+
+    unit, _, spec = range_header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+
+    start_str, _, end_str = spec.strip().partition('-')
+    try:
+        if start_str == '':
+            # 后缀形式: bytes=-500 表示最后500字节
+            length = int(end_str)
+            if length <= 0:
+                raise ValueError(range_header)
+            start, end = max(0, size - length), size - 1
+        else:
+            start = int(start_str)
+            end = int(end_str) if end_str else size - 1
+    except ValueError:
+        raise ValueError(range_header)
+
+    if start >= size or start > end or start < 0:
+        raise ValueError(range_header)
+    return start, min(end, size - 1)
+
+
+class RangeFileResponse(StreamingResponse):
+    """文件（或其中一段）的流式响应"""
+
+    def __init__(self, entry: CachedFile, file_cache: FileHandleCache, tracker: BandwidthTracker,
+                 client_id: str, start: int, end: int, status_code: int, headers: Dict[str, str],
+                 send_body: bool = True):
+        self.entry = entry
+        self.file_cache = file_cache
+        self.tracker = tracker
+        self.client_id = client_id
+        self.start = start
+        self.end = end
+        self.send_body = send_body
+        self.zero_copy = False
+        super().__init__(content=iter(()), status_code=status_code, headers=headers,
+                         media_type=headers.get('content-type'))
+
+    async def __call__(self, scope, receive, send):
+        self.zero_copy = "http.response.zerocopysend" in scope.get("extensions", {})
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.file_cache.release(self.entry)
+
+    async def stream_response(self, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+
+        offset = self.start
+        remaining = self.end - self.start + 1 if self.send_body else 0
+
+        if remaining and self.zero_copy:
+            await send({
+                "type": "http.response.zerocopysend",
+                "file": self.entry.fd,
+                "offset": offset,
+                "count": remaining,
+                "more_body": False,
+            })
+            self.tracker.record_bytes(self.client_id, remaining)
+            return
+
+        while remaining > 0:
+            chunk = await anyio.to_thread.run_sync(self.entry.read, min(MEDIA_CHUNK_SIZE, remaining), offset)
+            if not chunk:
+                break
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            self.tracker.record_bytes(self.client_id, len(chunk))
+            offset += len(chunk)
+            remaining -= len(chunk)
+
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+class MediaServer:
+    """媒体文件服务"""
+
+    def __init__(self, root: Path, allowed_subdirs):
+        self.root = root
+        self.allowed_subdirs = set(allowed_subdirs)
+        self.file_cache = FileHandleCache()
+        self.bandwidth = BandwidthTracker()
+
+    def resolve(self, subdir: str, filename: str) -> Optional[Path]:
+        """将请求路径映射到上传目录中的文件，非法路径返回None"""
+        if subdir not in self.allowed_subdirs or not filename or '/' in filename or '\\' in filename \
+                or filename.startswith('.'):
+            return None
+        return self.root / subdir / filename
+
+    def build_response(self, path: Path, client_id: str, range_header: Optional[str],
+                       if_none_match: Optional[str], method: str = "GET") -> Response:
+        try:
+            entry = self.file_cache.acquire(path)
+        except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+            return Response(status_code=404)
+
+        headers = {
+            "accept-ranges": "bytes",
+            "etag": entry.etag,
+            "last-modified": formatdate(entry.mtime, usegmt=True),
+            "cache-control": "public, max-age=86400",
+            "content-type": mimetypes.guess_type(path.name)[0] or "application/octet-stream",
+        }
+
+        if if_none_match and entry.etag in [tag.strip() for tag in if_none_match.split(',')]:
+            self.file_cache.release(entry)
+            return Response(status_code=304, headers={k: headers[k] for k in ("etag", "cache-control")})
+
+        try:
+            byte_range = parse_range_header(range_header, entry.size)
+        except ValueError:
+            self.file_cache.release(entry)
+            return Response(status_code=416, headers={"content-range": f"bytes */{entry.size}"})
+
+        self.bandwidth.record_request(client_id, path.name, byte_range is not None)
+
+        if entry.size == 0:
+            self.file_cache.release(entry)
+            return Response(status_code=200, headers={**headers, "content-length": "0"})
+
+        if byte_range is None:
+            start, end, status_code = 0, entry.size - 1, 200
+        else:
+            start, end = byte_range
+            status_code = 206
+            headers["content-range"] = f"bytes {start}-{end}/{entry.size}"
+        headers["content-length"] = str(end - start + 1)
+
+        return RangeFileResponse(entry, self.file_cache, self.bandwidth, client_id, start, end,
+                                 status_code, headers, send_body=method != "HEAD")
+
+    def stats(self) -> Dict:
+        return {
+            **self.bandwidth.snapshot(),
+            "fd_cache": {
+                "open": len(self.file_cache.entries),
+                "capacity": self.file_cache.max_size,
+                "hits": self.file_cache.hits,
+                "misses": self.file_cache.misses,
+            },
+        }
@@ -0,0 +1,25 @@
+"""测试从仓库根目录导入模块（模块都在顶层）；公用的假时钟"""
+
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(request, monkeypatch):
+    """替换 time 模块中测试模块 CLOCK 指定的函数（默认 time.time），通过 clock.now 拨动时间"""
+    clock = Clock()
+    monkeypatch.setattr(time, getattr(request.module, "CLOCK", "time"), clock)
+    return clock
@@ -0,0 +1,63 @@
+"""播放状态检查点：记下快照的时间、多个进程共用文件时的压缩"""
+
+import asyncio
+import json
+
+import pytest
+
+from checkpoint import PlaybackCheckpoint, extrapolate
+
+
+@pytest.fixture
+def path(tmp_path):
+    return tmp_path / "playback.jsonl"
+
+
+def test_saved_at_is_taken_when_recorded(path, clock):
+    checkpoint = PlaybackCheckpoint(path, debounce=60)
+
+    async def main():
+        checkpoint.record("main", {"is_playing": True, "current_time": 10})
+        clock.now += 0.8  # 合并等待中，进度照常在走
+        checkpoint.flush()
+
+    asyncio.run(main())
+    record = checkpoint.load()["main"]
+    assert record["saved_at"] == 1_000_000.0
+    clock.now += 5
+    assert extrapolate(record) == pytest.approx(15.8)
+
+
+def test_compact_keeps_rooms_written_by_other_processes(path, clock):
+    # 两个实例模拟两个工作进程，各自负责不同的房间
+    first = PlaybackCheckpoint(path, compact_bytes=1 << 20)
+    second = PlaybackCheckpoint(path, compact_bytes=1 << 20)
+    first.record("a", {"current_time": 1})
+    second.record("b", {"current_time": 2})
+    clock.now += 1
+    second.record("b", {"current_time": 3})
+    first.compact()
+
+    lines = path.read_text(encoding="utf-8").splitlines()
+    assert len(lines) == 2
+    records = first.load()
+    assert records["a"]["state"] == {"current_time": 1}
+    assert records["b"]["state"] == {"current_time": 3}
+
+
+def test_flush_compacts_past_threshold(path, clock):
+    checkpoint = PlaybackCheckpoint(path, compact_bytes=200)
+    for second in range(20):
+        clock.now += 1
+        checkpoint.record("main", {"current_time": second})
+    lines = path.read_text(encoding="utf-8").splitlines()
+    assert len(lines) < 20
+    assert json.loads(lines[-1])["state"] == {"current_time": 19}
+
+
+def test_load_skips_torn_line(path):
+    checkpoint = PlaybackCheckpoint(path)
+    checkpoint.record("main", {"current_time": 4})
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"room":"main","saved_at":1,"sta')
+    assert checkpoint.load()["main"]["state"] == {"current_time": 4}
@@ -0,0 +1,170 @@
+"""上传文件回收：宽限期、分代标记和删除前的重新确认"""
+
+import asyncio
+import os
+from contextlib import contextmanager
+
+import pytest
+
+import collector
+from collector import UploadCollector
+
+GRACE = 100
+
+
+class FakePersistence:
+    """referenced_files 返回当前的引用；transaction 中可以模拟其他进程刚刚登记的引用"""
+
+    def __init__(self):
+        self.referenced = set()
+        self.referenced_in_transaction = set()
+        self.in_transaction = False
+
+    def referenced_files(self):
+        if self.in_transaction:
+            return self.referenced | self.referenced_in_transaction
+        return set(self.referenced)
+
+    @contextmanager
+    def transaction(self):
+        self.in_transaction = True
+        try:
+            yield
+        finally:
+            self.in_transaction = False
+
+
+@pytest.fixture
+def persistence(monkeypatch):
+    fake = FakePersistence()
+    monkeypatch.setattr(collector, "persistence_manager", fake)
+    return fake
+
+
+@pytest.fixture
+def root(tmp_path):
+    for subdir in ("music", "covers"):
+        (tmp_path / subdir).mkdir()
+    return tmp_path
+
+
+def write(root, relative, clock, age, size=10):
+    """写一个文件，修改时间是 age 秒之前"""
+    path = root / relative
+    path.write_bytes(b"x" * size)
+    mtime = clock.now - age
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def make_collector(root, **options):
+    options = {"grace_period": GRACE, "sweep_interval": 0, **options}
+    return UploadCollector(root, subdirs=["music", "covers"], **options)
+
+
+def collect(gc, dry_run=False):
+    return asyncio.run(gc.collect(dry_run=dry_run))
+
+
+def test_first_generation_only_marks(root, clock, persistence):
+    path = write(root, "music/old.wav", clock, age=GRACE * 10)
+    gc = make_collector(root)
+    report = collect(gc)
+    assert report["deleted"] == 0 and report["waiting"] == 1
+    assert path.exists()
+
+    # 下一代：已经是候选，但还没有连续 GRACE 秒
+    clock.now += GRACE / 2
+    assert collect(gc)["deleted"] == 0
+
+    clock.now += GRACE
+    report = collect(gc)
+    assert report["deleted"] == 1 and report["deleted_bytes"] == 10
+    assert not path.exists()
+    assert gc.candidates == {}
+
+
+def test_recent_file_waits_for_its_own_grace_period(root, clock, persistence):
+    gc = make_collector(root)
+    path = write(root, "music/uploading.wav", clock, age=0)
+    collect(gc)
+    clock.now += GRACE + 1
+    # 候选时间已经够了，但文件在第一轮之后又被写入
+    os.utime(path, (clock.now - 5, clock.now - 5))
+    assert collect(gc)["deleted"] == 0
+    assert path.exists()
+
+
+def test_referenced_kept_and_special_files_skipped(root, clock, persistence):
+    kept = write(root, "music/kept.wav", clock, age=GRACE * 10)
+    cover = write(root, "covers/default-cover.jpg", clock, age=GRACE * 10)
+    partial = write(root, "music/.upload.part", clock, age=GRACE * 10)
+    (root / "music" / "folder").mkdir()
+    persistence.referenced = {"/uploads/music/kept.wav"}
+
+    gc = make_collector(root)
+    collect(gc)
+    clock.now += GRACE + 1
+    report = collect(gc)
+    assert report["deleted"] == 0 and report["waiting"] == 0
+    assert kept.exists() and cover.exists() and partial.exists()
+
+
+def test_rereferenced_file_loses_candidacy(root, clock, persistence):
+    path = write(root, "music/song.wav", clock, age=GRACE * 10)
+    gc = make_collector(root)
+    collect(gc)
+
+    clock.now += GRACE + 1
+    persistence.referenced = {"/uploads/music/song.wav"}
+    collect(gc)
+    assert gc.candidates == {}
+
+    # 再次失去引用时重新计时
+    persistence.referenced = set()
+    clock.now += 1
+    assert collect(gc)["deleted"] == 0
+    clock.now += GRACE + 1
+    assert collect(gc)["deleted"] == 1
+    assert not path.exists()
+
+
+def test_delete_batch_rechecks_references(root, clock, persistence):
+    claimed = write(root, "music/claimed.wav", clock, age=GRACE * 10)
+    orphan = write(root, "music/orphan.wav", clock, age=GRACE * 10)
+    gc = make_collector(root)
+    collect(gc)
+    clock.now += GRACE + 1
+
+    # 扫描时没有引用，删除前另一个进程登记了这个文件
+    persistence.referenced_in_transaction = {"/uploads/music/claimed.wav"}
+    report = collect(gc)
+    assert len(report["reclaimable"]) == 2
+    assert report["deleted"] == 1
+    assert claimed.exists() and not orphan.exists()
+
+
+def test_dry_run_reports_without_deleting(root, clock, persistence):
+    path = write(root, "music/orphan.wav", clock, age=GRACE * 10, size=123)
+    write(root, "music/new.wav", clock, age=0, size=7)
+    gc = make_collector(root)
+    collect(gc, dry_run=True)
+    clock.now += GRACE + 1
+    os.utime(root / "music" / "new.wav", (clock.now, clock.now))
+
+    report = collect(gc, dry_run=True)
+    assert report["dry_run"]
+    assert [item["url"] for item in report["reclaimable"]] == ["/uploads/music/orphan.wav"]
+    assert report["reclaimable_bytes"] == 123
+    assert (report["waiting"], report["waiting_bytes"]) == (1, 7)
+    assert report["deleted"] == 0 and path.exists()
+
+
+def test_sweep_in_batches(root, clock, persistence):
+    paths = [write(root, f"music/orphan{i}.wav", clock, age=GRACE * 10) for i in range(7)]
+    gc = make_collector(root, sweep_batch=3, scan_batch=2)
+    collect(gc)
+    clock.now += GRACE + 1
+    report = collect(gc)
+    assert report["checked"] == 7 and report["deleted"] == 7
+    assert not any(path.exists() for path in paths)
@@ -0,0 +1,116 @@
+"""显示端送达确认的计数：确认、超时重发、丢失和过期清理"""
+
+import pytest
+
+from config import ACK_CLIENT_TTL, ACK_DEADLINE, ACK_RETRIES
+from delivery import DeliveryTracker
+
+CLOCK = "monotonic"  # DeliveryTracker 用单调时钟计时
+
+
+@pytest.fixture
+def tracker():
+    return DeliveryTracker()
+
+
+def test_acknowledge_records_latency(tracker, clock):
+    connection = object()
+    tracker.register(connection, "d1")
+    tracker.sent(connection, 5, "frame")
+    clock.now += 0.04
+    rtt = tracker.acknowledge(connection, {"seq": 5, "received": 100, "applied": 107})
+    assert rtt == pytest.approx(0.04)
+    stats = tracker.clients["d1"]
+    assert (stats.sent, stats.acked) == (1, 1)
+    assert list(stats.apply) == [7]
+    # 重复的确认和未知的序号不计数
+    assert tracker.acknowledge(connection, {"seq": 5}) is None
+    assert tracker.acknowledge(connection, {"seq": "x"}) is None
+    assert tracker.acknowledge(object(), {"seq": 5}) is None
+    assert stats.acked == 1
+
+
+def test_unregistered_connection_is_not_tracked(tracker):
+    connection = object()
+    tracker.sent(connection, 1, "frame")
+    assert tracker.pending == {}
+
+
+def test_overdue_resends_then_drops(tracker, clock):
+    connection = object()
+    tracker.register(connection, "d1")
+    tracker.sent(connection, 1, "frame-1")
+
+    clock.now += ACK_DEADLINE / 2
+    assert tracker.overdue() == ([], 0)
+
+    for attempt in range(ACK_RETRIES):
+        clock.now += ACK_DEADLINE
+        assert tracker.overdue() == ([(connection, "frame-1")], 0)
+
+    clock.now += ACK_DEADLINE
+    assert tracker.overdue() == ([], 1)
+    stats = tracker.clients["d1"]
+    assert (stats.retransmits, stats.dropped) == (ACK_RETRIES, 1)
+    summary = tracker.summary()[0]
+    assert summary["drop_rate"] == 1.0
+    assert summary["lagging"]
+
+
+def test_ack_after_resend_counts_from_first_send(tracker, clock):
+    connection = object()
+    tracker.register(connection, "d1")
+    tracker.sent(connection, 1, "frame")
+    clock.now += ACK_DEADLINE
+    tracker.overdue()
+    clock.now += 0.1
+    assert tracker.acknowledge(connection, {"seq": 1}) == pytest.approx(ACK_DEADLINE + 0.1)
+    assert tracker.summary()[0]["drop_rate"] == 0.0
+
+
+def test_disconnect_keeps_pending_out_of_drop_count(tracker, clock):
+    connection = object()
+    tracker.register(connection, "d1")
+    tracker.sent(connection, 1, "frame")
+    tracker.unregister(connection)
+    clock.now += ACK_DEADLINE * (ACK_RETRIES + 2)
+    assert tracker.overdue() == ([], 0)
+    stats = tracker.clients["d1"]
+    assert not stats.connected and stats.dropped == 0
+
+    # 重连后继续累计同一个显示端的统计
+    reconnected = object()
+    tracker.register(reconnected, "d1")
+    assert tracker.clients["d1"] is stats and stats.connected
+
+
+def test_second_connection_keeps_client_connected(tracker, clock):
+    first, second = object(), object()
+    tracker.register(first, "d1")
+    tracker.register(second, "d1")
+    tracker.unregister(first)
+    assert tracker.clients["d1"].connected
+
+
+def test_disconnected_clients_expire(tracker, clock):
+    gone, staying = object(), object()
+    tracker.register(gone, "gone")
+    tracker.register(staying, "staying")
+    tracker.unregister(gone)
+
+    clock.now += ACK_CLIENT_TTL - 1
+    tracker.overdue()
+    assert "gone" in tracker.clients
+
+    clock.now += 2
+    tracker.overdue()
+    assert set(tracker.clients) == {"staying"}
+
+
+def test_summary_puts_lagging_clients_first(tracker, clock):
+    fast, slow = object(), object()
+    tracker.register(fast, "a-fast")
+    tracker.register(slow, "b-slow")
+    tracker.sent(slow, 1, "frame")
+    clock.now += ACK_DEADLINE * 2
+    assert [item["client_id"] for item in tracker.summary()] == ["b-slow", "a-fast"]
@@ -0,0 +1,119 @@
+"""位置键生成与 OrderedList 的排序"""
+
+import random
+
+import pytest
+
+from playlist import FIRST_KEY, OrderedList, key_between, keys_between, shuffle_key
+
+
+class Item:
+    def __init__(self, item_id, position=None):
+        self.id = item_id
+        self.position = position
+
+
+def ids(ordered):
+    return [item.id for item in ordered]
+
+
+def test_key_between_bounds():
+    assert key_between(None, None) == FIRST_KEY
+    after = key_between(FIRST_KEY, None)
+    before = key_between(None, FIRST_KEY)
+    assert before < FIRST_KEY < after
+    middle = key_between(FIRST_KEY, after)
+    assert FIRST_KEY < middle < after
+
+
+def test_key_between_rejects_bad_order():
+    with pytest.raises(ValueError):
+        key_between("a1", "a0")
+    with pytest.raises(ValueError):
+        key_between("a0", "a0")
+
+
+def test_appending_keeps_keys_short():
+    key = None
+    for _ in range(10000):
+        key = key_between(key, None)
+    assert len(key) <= 4
+
+
+def test_repeated_insert_at_front_stays_ordered():
+    keys = [key_between(None, None)]
+    for _ in range(500):
+        keys.insert(0, key_between(None, keys[0]))
+    assert keys == sorted(keys)
+    assert len(set(keys)) == len(keys)
+
+
+def test_repeated_bisection_grows_slowly():
+    lower, upper = key_between(None, None), None
+    upper = key_between(lower, None)
+    for _ in range(200):
+        upper = key_between(lower, upper)
+        assert lower < upper
+    # 每次二分大约增加 log2(62) 位，200 次后键长仍在几十个字符内
+    assert len(upper) < 60
+
+
+def test_keys_between_is_sorted_and_logarithmic():
+    lower, upper = "a0", "a1"
+    keys = keys_between(lower, upper, 1000)
+    assert keys == sorted(keys)
+    assert len(set(keys)) == 1000
+    assert all(lower < key < upper for key in keys)
+    assert max(len(key) for key in keys) <= 6
+
+
+def test_load_assigns_missing_keys_after_existing():
+    items = [Item("b", "a1"), Item("x"), Item("a", "a0"), Item("y")]
+    ordered = OrderedList()
+    assigned = ordered.load(items)
+    assert ids(ordered) == ["a", "b", "x", "y"]
+    assert set(assigned) == {"x", "y"}
+
+
+def test_moves_match_list_reference():
+    rng = random.Random(7)
+    ordered = OrderedList([Item(f"t{i}") for i in range(50)])
+    reference = ids(ordered)
+    for _ in range(2000):
+        item_id = rng.choice(reference)
+        after_id = rng.choice([None] + reference)
+        moved = ordered.move(item_id, after_id)
+        expected = [i for i in reference if i != item_id]
+        if item_id != after_id:
+            expected.insert(0 if after_id is None else expected.index(after_id) + 1, item_id)
+        else:
+            expected = reference
+        if moved is None:
+            assert expected == reference
+        reference = expected
+        assert ids(ordered) == reference
+    keys = [item.position for item in ordered]
+    assert keys == sorted(keys)
+    assert max(len(key) for key in keys) < 40
+
+
+def test_index_of_window_and_remove():
+    ordered = OrderedList([Item(f"t{i}") for i in range(10)])
+    assert ordered.index_of("t3") == 3
+    assert ordered.index_of("missing") == -1
+    cursor = (ordered.get("t3").position, "t3")
+    ordered.remove("t3")
+    # 游标指向的元素删除后从下一个继续
+    assert ids(ordered.window(cursor, 2)) == ["t4", "t5"]
+    ordered.insert_after(Item("new"), None)
+    assert ids(ordered)[0] == "new"
+    assert ordered.index_of("t4") == 4
+
+
+def test_shuffle_order_depends_only_on_seed_and_ids():
+    track_ids = [f"t{i}" for i in range(50)]
+    order = sorted(track_ids, key=lambda track_id: shuffle_key(7, track_id))
+    # 曲目加入的先后不影响顺序
+    assert sorted(reversed(track_ids), key=lambda track_id: shuffle_key(7, track_id)) == order
+    assert order != track_ids
+    assert sorted(track_ids, key=lambda track_id: shuffle_key(8, track_id)) != order
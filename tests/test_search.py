@@ -0,0 +1,82 @@
+"""搜索索引：增量增删与重新建立的结果一致"""
+
+import random
+
+import pytest
+
+from search import SearchIndex
+
+WORDS = ["sun", "star", "song", "night", "moon", "晴天", "城市", "夜曲", "青花瓷", "稻香"]
+
+
+class Track:
+    def __init__(self, track_id, title, artist):
+        self.id = track_id
+        self.title = title
+        self.artist = artist
+        self.lyrics_url = None
+        self.position = track_id
+
+
+def make_tracks(rng, count, start=0):
+    return [Track(f"t{i:04d}", " ".join(rng.choice(WORDS) for _ in range(3)), rng.choice(WORDS))
+            for i in range(start, start + count)]
+
+
+def results(index, queries):
+    found = {}
+    for query in queries:
+        total, page = index.search(query, limit=1000)
+        found[query] = (total, [track.id for track in page])
+    return found
+
+
+@pytest.fixture
+def queries():
+    return ["s", "so", "son", "song", "晴", "晴天", "青花", "n", "ni", "moon sun", "st"]
+
+
+def test_incremental_changes_match_rebuild(queries):
+    rng = random.Random(3)
+    tracks = make_tracks(rng, 300)
+    index = SearchIndex(index_lyrics=False)
+    index.rebuild(tracks)
+
+    live = {track.id: track for track in tracks}
+    for step in range(400):
+        if live and rng.random() < 0.4:
+            track_id = rng.choice(sorted(live))
+            index.remove(track_id)
+            del live[track_id]
+        elif live and rng.random() < 0.5:
+            track = live[rng.choice(sorted(live))]
+            track.title = " ".join(rng.choice(WORDS) for _ in range(2))
+            index.update(track, ["title"])
+        else:
+            track = make_tracks(rng, 1, start=1000 + step)[0]
+            index.add(track)
+            live[track.id] = track
+        if step % 50 == 0:
+            results(index, queries)  # 中途查询会合并和清理词项
+
+    fresh = SearchIndex(index_lyrics=False)
+    fresh.rebuild(list(live.values()))
+    assert results(index, queries) == results(fresh, queries)
+
+
+def test_short_and_long_prefixes_agree():
+    rng = random.Random(5)
+    index = SearchIndex(index_lyrics=False)
+    index.rebuild(make_tracks(rng, 200))
+    for token in ["s", "so", "n", "晴", "城市"[:1], "夜"]:
+        for mask in range(1, 8):
+            assert index.match_short(token, mask) == index.match_terms(token, mask)
+
+
+def test_schedule_runs_in_call_order():
+    index = SearchIndex(index_lyrics=False)
+    track = Track("t1", "sun", "moon")
+    index.schedule(index.add, track)
+    index.schedule(index.remove, "t1")
+    index.schedule(index.add, Track("t2", "song", "star")).result()
+    assert [item.id for item in index.search("s")[1]] == ["t2"]
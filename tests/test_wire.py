@@ -0,0 +1,82 @@
+"""MessagePack 编解码与二进制消息信封"""
+
+import json
+import math
+
+import pytest
+
+from wire import BINARY_CODEC, JSON_CODEC, MESSAGE_TYPES, TYPE_CODES, WireError, packb, unpackb
+
+VALUES = [
+    None, True, False,
+    0, 1, 127, 128, 255, 256, 65535, 65536, 2 ** 32 - 1, 2 ** 32, 2 ** 64 - 1,
+    -1, -32, -33, -128, -129, -32768, -32769, -2 ** 31, -2 ** 31 - 1, -2 ** 63,
+    0.0, 1.5, -2.25, 1e300,
+    "", "a", "x" * 31, "x" * 32, "y" * 255, "z" * 256, "中文歌词" * 5000,
+    b"", b"\x00\xff" * 200,
+    [], [1, [2, [3]]], list(range(20)), list(range(70000)),
+    {}, {"a": 1}, {f"k{i}": i for i in range(20)}, {f"k{i}": i for i in range(70000)},
+]
+
+
+@pytest.mark.parametrize("value", VALUES, ids=lambda value: type(value).__name__)
+def test_round_trip(value):
+    assert unpackb(packb(value)) == value
+
+
+def test_float_special_values():
+    assert math.isinf(unpackb(packb(float("inf"))))
+    assert math.isnan(unpackb(packb(float("nan"))))
+
+
+def test_integer_out_of_range():
+    with pytest.raises(WireError):
+        packb(2 ** 64)
+    with pytest.raises(WireError):
+        packb(-2 ** 63 - 1)
+
+
+def test_truncated_and_trailing_data():
+    data = packb({"track": {"title": "Song", "duration": 215}})
+    for end in range(len(data)):
+        with pytest.raises(WireError):
+            unpackb(data[:end])
+    with pytest.raises(WireError):
+        unpackb(data + b"\x00")
+
+
+def test_unsupported_type():
+    with pytest.raises(WireError):
+        packb(object())
+
+
+def test_message_types_are_unique():
+    assert len(set(MESSAGE_TYPES)) == len(MESSAGE_TYPES)
+    assert TYPE_CODES["state_update"] == 1
+
+
+def test_binary_envelope_round_trip():
+    message = {"type": "track_change", "data": {"track": {"id": "abc", "title": "晴天"}, "time": 12.5},
+               "seq": 42, "ack": True}
+    frame = BINARY_CODEC.encode(message)
+    assert isinstance(frame, bytes)
+    assert unpackb(frame)[0] == TYPE_CODES["track_change"]
+    assert BINARY_CODEC.decode(frame) == message
+
+
+def test_binary_unknown_type_kept_as_string():
+    message = {"type": "custom_event", "data": [1, 2]}
+    assert BINARY_CODEC.decode(BINARY_CODEC.encode(message)) == message
+
+
+def test_binary_codec_accepts_json_text():
+    message = {"type": "time_update", "data": {"time": 3}}
+    assert BINARY_CODEC.decode(json.dumps(message)) == message
+    assert JSON_CODEC.decode(JSON_CODEC.encode(message)) == message
+
+
+def test_binary_malformed_envelope():
+    with pytest.raises(WireError):
+        BINARY_CODEC.decode(packb({"type": "play"}))
+    with pytest.raises(WireError):
+        BINARY_CODEC.decode(packb([]))
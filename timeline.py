@@ -0,0 +1,216 @@
+"""
+演出流程（run-of-show）
+
+每个房间可以设置一个按顺序执行的提示列表：
+- track: 播放曲目，时长取曲目的 duration（提示的 duration 更短时只播前一部分）
+- slide: 切换到幻灯片，停留 duration 秒
+- pause: 停止播放，停留 duration 秒（换场）
+没有时长的提示一直停留，直到管理端手动继续（timeline_next）。
+
+服务器按权威进度算出下一个提示的开始时间，提前 CUE_LEAD_TIME 秒把提示连同开始时间（服务器时钟，毫秒）
+广播给所有显示端；显示端通过 clock_sync 估计与服务器的时钟差，换算成本地时间后预加载并到点执行，
+所有屏幕同时切换，不需要操作员点击。到点时服务器只更新自己的播放状态并通知管理端，不再向显示端发送切换命令。
+
+运行中暂停、继续、跳转时按新的进度重新计算当前曲目的结束时间（暂停时停留）；
+手动切歌、切换幻灯片或模式表示操作员接管，流程停止。
+"""
+
+import time
+import uuid
+import asyncio
+import logging
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+from config import CUE_LEAD_TIME, CUE_MANUAL_LEAD, TIMELINE_MAX_CUES
+
+logger = logging.getLogger(__name__)
+
+CUE_KINDS = ("track", "slide", "pause")
+
+# 这些管理端命令表示操作员手动接管，执行前停止流程
+OVERRIDE_COMMANDS = {"next_track", "prev_track", "select_track", "switch_mode", "select_slide"}
+
+# 这些命令改变了当前曲目的进度，执行后重新计算结束时间
+PLAYHEAD_COMMANDS = {"play_music", "pause_music", "seek_music"}
+
+
+class Cue(BaseModel):
+    id: str
+    kind: str
+    target_id: Optional[str] = None
+    duration: Optional[float] = None
+
+
+async def sleep_until(deadline: float):
+    delay = deadline - time.time()
+    if delay > 0:
+        await asyncio.sleep(delay)
+
+
+class Timeline:
+    def __init__(self, room):
+        self.room = room
+        self.cues: List[Cue] = []
+        self.index = -1  # 正在执行的提示
+        self.running = False
+        # 当前提示的结束时间（服务器时钟，秒），也就是下一个提示的开始时间；None 表示停留等待
+        self.ends_at: Optional[float] = None
+        # 已经下发给显示端、还没到开始时间的提示（新连接的显示端也要收到）
+        self.announced: Optional[dict] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def load(self, cues: List[dict]) -> int:
+        """替换提示列表（运行中不能替换），返回忽略的无效提示数"""
+        loaded = []
+        for item in cues[:TIMELINE_MAX_CUES]:
+            try:
+                cue = Cue(id=item.get("id") or uuid.uuid4().hex[:8], kind=item.get("kind"),
+                          target_id=item.get("target_id"), duration=item.get("duration") or None)
+            except Exception:
+                continue
+            if cue.kind not in CUE_KINDS or (cue.kind != "pause" and not cue.target_id):
+                continue
+            if cue.duration is not None and cue.duration <= 0:
+                cue.duration = None
+            loaded.append(cue)
+        self.cues = loaded
+        self.index = -1
+        return len(cues) - len(loaded)
+
+    def duration(self, cue: Cue) -> Optional[float]:
+        if cue.kind == "track":
+            track = self.room.playlist.get(cue.target_id)
+            length = track.duration if track is not None and track.duration else None
+            if cue.duration and length:
+                return min(cue.duration, length)
+            return cue.duration or length
+        return cue.duration
+
+    @property
+    def current(self) -> Optional[Cue]:
+        return self.cues[self.index] if self.running and 0 <= self.index < len(self.cues) else None
+
+    async def start(self, index: int = 0) -> bool:
+        """从第 index 个提示开始（短暂的提前量之后所有显示端同时开始）"""
+        if not 0 <= index < len(self.cues):
+            return False
+        await self.halt()
+        self.running = True
+        self.index = index - 1
+        self.ends_at = time.time() + CUE_MANUAL_LEAD
+        self.spawn()
+        logger.info(f"房间 {self.room.name} 开始演出流程（从第 {index + 1} 个提示）")
+        await self.room.broadcast_timeline()
+        return True
+
+    async def advance(self):
+        """手动继续：立即开始下一个提示（停留的提示只能这样结束）"""
+        if not self.running:
+            return
+        await self.halt()
+        self.ends_at = time.time() + CUE_MANUAL_LEAD
+        self.spawn()
+        await self.room.broadcast_timeline()
+
+    async def stop(self):
+        if not self.running:
+            return
+        await self.halt()
+        self.running = False
+        self.ends_at = None
+        logger.info(f"房间 {self.room.name} 停止演出流程")
+        await self.room.broadcast_timeline()
+
+    async def resync(self):
+        """暂停、继续或跳转之后按权威进度重新计算当前曲目的结束时间，暂停时停留"""
+        cue = self.current
+        if cue is None or cue.kind != "track" or cue.target_id != getattr(self.room.current_track, "id", None):
+            return
+        duration = self.duration(cue)
+        if duration is None:
+            return
+        await self.halt()
+        if self.room.is_playing:
+            self.ends_at = time.time() + max(0.0, duration - self.room.playhead())
+            self.spawn()
+        else:
+            self.ends_at = None
+        await self.room.broadcast_timeline()
+
+    def spawn(self):
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def halt(self):
+        """取消等待中的调度；已经下发但还没开始的提示通知显示端取消"""
+        task, self.task = self.task, None
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        if self.announced is not None:
+            cancelled, self.announced = self.announced, None
+            await self.room.broadcast_cue({"id": cancelled["id"], "cancel": True})
+
+    async def run(self):
+        """依次下发并开始提示；当前提示停留时结束，等待手动继续或恢复播放"""
+        while self.running and self.ends_at is not None:
+            next_index = self.index + 1
+            if next_index >= len(self.cues):
+                await sleep_until(self.ends_at)
+                self.running = False
+                self.ends_at = None
+                self.task = None
+                logger.info(f"房间 {self.room.name} 演出流程已结束")
+                await self.room.broadcast_timeline()
+                return
+
+            cue = self.cues[next_index]
+            start_at = self.ends_at
+            await sleep_until(start_at - CUE_LEAD_TIME)
+            command = self.room.cue_command(cue)
+            if command is None:
+                logger.warning(f"房间 {self.room.name} 演出流程第 {next_index + 1} 个提示的曲目或幻灯片已删除，跳过")
+                self.index = next_index
+                continue
+
+            self.announced = {"id": cue.id, "index": next_index, "at": round(start_at * 1000), "command": command}
+            await self.room.broadcast_cue(self.announced)
+            await sleep_until(start_at)
+
+            self.announced = None
+            self.index = next_index
+            duration = self.duration(cue)
+            self.ends_at = start_at + duration if duration else None
+            await self.room.apply_cue(cue, start_at)
+            await self.room.broadcast_timeline()
+        self.task = None
+
+    def upcoming_track_ids(self) -> List[str]:
+        """流程中接下来的曲目（显示端据此预取）"""
+        if not self.running:
+            return []
+        return [cue.target_id for cue in self.cues[self.index + 1:] if cue.kind == "track"]
+
+    def summary(self) -> dict:
+        """管理端显示的流程状态（剩余时间按收到时计算，避免依赖管理端的时钟）"""
+        labels = []
+        for cue in self.cues:
+            if cue.kind == "track":
+                track = self.room.playlist.get(cue.target_id)
+                labels.append(track.title if track else "（已删除的曲目）")
+            elif cue.kind == "slide":
+                slide = self.room.slides.get(cue.target_id)
+                labels.append(slide.name if slide else "（已删除的幻灯片）")
+            else:
+                labels.append("停顿")
+        return {
+            "cues": [{**cue.dict(), "label": label, "length": self.duration(cue)}
+                     for cue, label in zip(self.cues, labels)],
+            "index": self.index,
+            "running": self.running,
+            "remaining": max(0.0, self.ends_at - time.time()) if self.running and self.ends_at else None,
+        }
@@ -0,0 +1,127 @@
+"""
+音频转码：为上传的音乐生成响度标准化的压缩版本
+
+后台队列串行调用 ffmpeg，显示端播放转码后的版本，原始文件保留用于备份。
+没有安装 ffmpeg 时任务直接跳过。
+"""
+
+import os
+import shutil
+import asyncio
+import logging
+from pathlib import Path
+from typing import Awaitable, Callable, List, Optional
+
+from config import (
+    UPLOAD_FOLDER, LOUDNESS_TARGET,
+    TRANSCODE_ENABLED, TRANSCODE_FORMAT, TRANSCODE_BITRATE, TRANSCODE_WORKERS,
+)
+
+logger = logging.getLogger(__name__)
+
+# 输出格式 -> (扩展名, 封装格式, 编码参数)
+TRANSCODE_PROFILES = {
+    'mp3': ('mp3', 'mp3', ['-c:a', 'libmp3lame']),
+    'aac': ('m4a', 'mp4', ['-c:a', 'aac', '-movflags', '+faststart']),
+    'opus': ('opus', 'opus', ['-c:a', 'libopus']),
+}
+
+# 转码完成回调: (track_id, variant_url)
+CompleteCallback = Callable[[str, str], Awaitable[None]]
+
+
+class TranscodeQueue:
+    """转码任务队列"""
+
+    def __init__(self, output_format: str = TRANSCODE_FORMAT, bitrate: str = TRANSCODE_BITRATE,
+                 workers: int = TRANSCODE_WORKERS, enabled: bool = TRANSCODE_ENABLED):
+        self.output_format = output_format
+        self.bitrate = bitrate
+        self.worker_count = max(1, workers)
+        self.enabled = enabled
+        self.output_dir = UPLOAD_FOLDER / 'variants'
+
+        self.queue: Optional[asyncio.Queue] = None
+        self.workers: List[asyncio.Task] = []
+        self.on_complete: Optional[CompleteCallback] = None
+        self.ffmpeg = shutil.which('ffmpeg')
+        self.warned_unavailable = False
+
+    @property
+    def available(self) -> bool:
+        return self.enabled and self.ffmpeg is not None and self.output_format in TRANSCODE_PROFILES
+
+    def variant_url(self, track_id: str) -> str:
+        ext, _, _ = TRANSCODE_PROFILES[self.output_format]
+        return f"/uploads/variants/{track_id}.{ext}"
+
+    def enqueue(self, track_id: str, source_path: Path) -> bool:
+        """添加转码任务，转码不可用时返回False"""
+        if not self.available:
+            if self.enabled and not self.warned_unavailable:
+                logger.warning(f"转码不可用（ffmpeg: {self.ffmpeg or '未安装'}, 格式: {self.output_format}），跳过转码任务")
+                self.warned_unavailable = True
+            return False
+
+        if self.queue is None:
+            self.queue = asyncio.Queue()
+            self.workers = [asyncio.create_task(self.worker()) for _ in range(self.worker_count)]
+
+        self.queue.put_nowait((track_id, source_path))
+        return True
+
+    async def worker(self):
+        while True:
+            track_id, source_path = await self.queue.get()
+            try:
+                url = await self.transcode(track_id, source_path)
+                if url and self.on_complete:
+                    await self.on_complete(track_id, url)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"转码任务失败 {track_id}: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def transcode(self, track_id: str, source_path: Path) -> Optional[str]:
+        """执行转码（响度标准化 + 固定码率压缩），返回转码文件URL"""
+        if not source_path.exists():
+            logger.warning(f"转码源文件不存在: {source_path}")
+            return None
+
+        url = self.variant_url(track_id)
+        output_path = self.output_dir / url.split('/')[-1]
+        temp_path = output_path.with_name(f".{output_path.name}.tmp")
+        _, muxer, codec_args = TRANSCODE_PROFILES[self.output_format]
+
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        process = await asyncio.create_subprocess_exec(
+            self.ffmpeg, '-v', 'error', '-y', '-i', str(source_path),
+            '-vn', '-af', f'loudnorm=I={LOUDNESS_TARGET}:TP=-1.5:LRA=11',
+            *codec_args, '-b:a', self.bitrate, '-f', muxer, str(temp_path),
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        _, stderr = await process.communicate()
+
+        if process.returncode != 0:
+            temp_path.unlink(missing_ok=True)
+            logger.error(f"ffmpeg转码失败 {source_path}: {stderr.decode(errors='ignore').strip()}")
+            return None
+
+        # 写完再改名，避免显示端读到不完整的文件
+        os.replace(temp_path, output_path)
+        logger.info(f"转码完成: {source_path.name} -> {output_path.name}")
+        return url
+
+    async def shutdown(self):
+        for task in self.workers:
+            task.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        self.queue = None
+
+
+# 创建全局转码队列实例
+transcode_queue = TranscodeQueue()
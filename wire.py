@@ -0,0 +1,379 @@
+"""
+WebSocket 消息编码
+
+- JSON（默认，兼容旧客户端）
+- 二进制：客户端通过子协议 pyer.msgpack.v1 协商，消息为 MessagePack 数组 [类型编号, 数据]
+
+类型编号表需要与 display/wire.js 保持一致。
+"""
+
+import json
+import time
+import struct
+import asyncio
+import logging
+from typing import Any, Dict, Iterable, Optional, Union
+
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+from config import WEBSOCKET_SEND_QUEUE_LIMIT
+from metrics import encode_duration, messages_sent, send_queue_dropped
+
+logger = logging.getLogger(__name__)
+
+BINARY_SUBPROTOCOL = "pyer.msgpack.v1"
+
+# 消息类型编号（只能在末尾追加，不能调整顺序）
+MESSAGE_TYPES = [
+    "state_update", "playlist_update", "slides_update", "track_update",
+    "music_state", "slide_state", "switch_to_music", "switch_to_slide",
+    "track_change", "slide_change", "play", "pause", "seek", "volume", "prefetch",
+    "time_update",
+    "play_music", "pause_music", "next_track", "prev_track", "select_track",
+    "seek_music", "set_volume", "switch_mode", "select_slide",
+    "playlist_delta", "session", "cache_progress", "cache_status",
+    "heartbeat", "ack", "cue", "clock_sync", "timeline",
+    "set_timeline", "start_timeline", "stop_timeline", "timeline_next",
+    "move_track", "move_slide", "queue_track", "dequeue_track", "clear_queue", "set_shuffle",
+]
+TYPE_CODES = {name: code for code, name in enumerate(MESSAGE_TYPES, start=1)}
+
+
+class WireError(ValueError):
+    pass
+
+
+# ---------- MessagePack 编码 ----------
+
+def packb(obj: Any) -> bytes:
+    out = bytearray()
+    _pack(obj, out)
+    return bytes(out)
+
+
+def _pack(obj: Any, out: bytearray):
+    if obj is None:
+        out.append(0xc0)
+    elif obj is True:
+        out.append(0xc3)
+    elif obj is False:
+        out.append(0xc2)
+    elif isinstance(obj, int):
+        _pack_int(obj, out)
+    elif isinstance(obj, float):
+        out.append(0xcb)
+        out += struct.pack(">d", obj)
+    elif isinstance(obj, str):
+        data = obj.encode("utf-8")
+        size = len(data)
+        if size < 32:
+            out.append(0xa0 | size)
+        elif size < 0x100:
+            out += bytes((0xd9, size))
+        elif size < 0x10000:
+            out.append(0xda)
+            out += struct.pack(">H", size)
+        else:
+            out.append(0xdb)
+            out += struct.pack(">I", size)
+        out += data
+    elif isinstance(obj, (bytes, bytearray, memoryview)):
+        data = bytes(obj)
+        size = len(data)
+        if size < 0x100:
+            out += bytes((0xc4, size))
+        elif size < 0x10000:
+            out.append(0xc5)
+            out += struct.pack(">H", size)
+        else:
+            out.append(0xc6)
+            out += struct.pack(">I", size)
+        out += data
+    elif isinstance(obj, (list, tuple)):
+        size = len(obj)
+        if size < 16:
+            out.append(0x90 | size)
+        elif size < 0x10000:
+            out.append(0xdc)
+            out += struct.pack(">H", size)
+        else:
+            out.append(0xdd)
+            out += struct.pack(">I", size)
+        for item in obj:
+            _pack(item, out)
+    elif isinstance(obj, dict):
+        size = len(obj)
+        if size < 16:
+            out.append(0x80 | size)
+        elif size < 0x10000:
+            out.append(0xde)
+            out += struct.pack(">H", size)
+        else:
+            out.append(0xdf)
+            out += struct.pack(">I", size)
+        for key, value in obj.items():
+            _pack(str(key), out)
+            _pack(value, out)
+    else:
+        raise WireError(f"无法编码的类型: {type(obj).__name__}")
+
+
+def _pack_int(value: int, out: bytearray):
+    if 0 <= value < 0x80:
+        out.append(value)
+    elif -32 <= value < 0:
+        out.append(value & 0xff)
+    elif 0 <= value < 0x100:
+        out += bytes((0xcc, value))
+    elif 0 <= value < 0x10000:
+        out.append(0xcd)
+        out += struct.pack(">H", value)
+    elif 0 <= value < 0x100000000:
+        out.append(0xce)
+        out += struct.pack(">I", value)
+    elif 0 <= value < 0x10000000000000000:
+        out.append(0xcf)
+        out += struct.pack(">Q", value)
+    elif value >= 0:
+        raise WireError(f"整数超出范围: {value}")
+    elif -0x80 <= value:
+        out.append(0xd0)
+        out += struct.pack(">b", value)
+    elif -0x8000 <= value:
+        out.append(0xd1)
+        out += struct.pack(">h", value)
+    elif -0x80000000 <= value:
+        out.append(0xd2)
+        out += struct.pack(">i", value)
+    elif -0x8000000000000000 <= value:
+        out.append(0xd3)
+        out += struct.pack(">q", value)
+    else:
+        raise WireError(f"整数超出范围: {value}")
+
+
+# ---------- MessagePack 解码 ----------
+
+def unpackb(data: bytes) -> Any:
+    value, offset = _unpack(memoryview(data), 0)
+    if offset != len(data):
+        raise WireError("消息末尾有多余数据")
+    return value
+
+
+# 定长格式: 类型字节 -> (struct格式, 长度)
+_FIXED_FORMATS = {
+    0xca: (">f", 4), 0xcb: (">d", 8),
+    0xcc: (">B", 1), 0xcd: (">H", 2), 0xce: (">I", 4), 0xcf: (">Q", 8),
+    0xd0: (">b", 1), 0xd1: (">h", 2), 0xd2: (">i", 4), 0xd3: (">q", 8),
+}
+
+
+def _read(data: memoryview, offset: int, size: int):
+    end = offset + size
+    if end > len(data):
+        raise WireError("消息被截断")
+    return data[offset:end], end
+
+
+def _unpack(data: memoryview, offset: int):
+    if offset >= len(data):
+        raise WireError("消息被截断")
+    head = data[offset]
+    offset += 1
+
+    if head < 0x80:
+        return head, offset
+    if head >= 0xe0:
+        return head - 0x100, offset
+    if 0xa0 <= head <= 0xbf:
+        raw, offset = _read(data, offset, head & 0x1f)
+        return str(raw, "utf-8"), offset
+    if 0x90 <= head <= 0x9f:
+        return _unpack_array(data, offset, head & 0x0f)
+    if 0x80 <= head <= 0x8f:
+        return _unpack_map(data, offset, head & 0x0f)
+    if head == 0xc0:
+        return None, offset
+    if head == 0xc2:
+        return False, offset
+    if head == 0xc3:
+        return True, offset
+    if head in _FIXED_FORMATS:
+        fmt, size = _FIXED_FORMATS[head]
+        raw, offset = _read(data, offset, size)
+        return struct.unpack(fmt, raw)[0], offset
+    if head in (0xd9, 0xda, 0xdb, 0xc4, 0xc5, 0xc6):
+        length_format = {0xd9: ">B", 0xda: ">H", 0xdb: ">I", 0xc4: ">B", 0xc5: ">H", 0xc6: ">I"}[head]
+        raw, offset = _read(data, offset, struct.calcsize(length_format))
+        raw, offset = _read(data, offset, struct.unpack(length_format, raw)[0])
+        return (str(raw, "utf-8") if head in (0xd9, 0xda, 0xdb) else bytes(raw)), offset
+    if head in (0xdc, 0xdd):
+        fmt = ">H" if head == 0xdc else ">I"
+        raw, offset = _read(data, offset, struct.calcsize(fmt))
+        return _unpack_array(data, offset, struct.unpack(fmt, raw)[0])
+    if head in (0xde, 0xdf):
+        fmt = ">H" if head == 0xde else ">I"
+        raw, offset = _read(data, offset, struct.calcsize(fmt))
+        return _unpack_map(data, offset, struct.unpack(fmt, raw)[0])
+    raise WireError(f"不支持的MessagePack类型: 0x{head:02x}")
+
+
+def _unpack_array(data: memoryview, offset: int, size: int):
+    items = []
+    for _ in range(size):
+        item, offset = _unpack(data, offset)
+        items.append(item)
+    return items, offset
+
+
+def _unpack_map(data: memoryview, offset: int, size: int):
+    result = {}
+    for _ in range(size):
+        key, offset = _unpack(data, offset)
+        value, offset = _unpack(data, offset)
+        result[key] = value
+    return result, offset
+
+
+# ---------- 消息编解码器 ----------
+
+class JsonCodec:
+    name = "json"
+    binary = False
+
+    def encode(self, message: Dict[str, Any]) -> str:
+        return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+    def decode(self, raw: Union[str, bytes]) -> Dict[str, Any]:
+        return json.loads(raw)
+
+
+class BinaryCodec:
+    name = "msgpack"
+    binary = True
+
+    def encode(self, message: Dict[str, Any]) -> bytes:
+        message_type = message.get("type")
+        extra = {key: value for key, value in message.items() if key not in ("type", "data")}
+        envelope = [TYPE_CODES.get(message_type, message_type), message.get("data")]
+        if extra:
+            envelope.append(extra)
+        return packb(envelope)
+
+    def decode(self, raw: Union[str, bytes]) -> Dict[str, Any]:
+        if isinstance(raw, str):
+            return json.loads(raw)
+        envelope = unpackb(raw)
+        if not isinstance(envelope, list) or not envelope:
+            raise WireError("二进制消息格式错误")
+        code = envelope[0]
+        message = {
+            "type": MESSAGE_TYPES[code - 1] if isinstance(code, int) and 0 < code <= len(MESSAGE_TYPES) else code,
+            "data": envelope[1] if len(envelope) > 1 else None,
+        }
+        if len(envelope) > 2 and isinstance(envelope[2], dict):
+            message.update(envelope[2])
+        return message
+
+
+JSON_CODEC = JsonCodec()
+BINARY_CODEC = BinaryCodec()
+
+
+# ---------- 连接 ----------
+
+def encode_message(codec, message: Dict[str, Any]) -> Union[str, bytes]:
+    start = time.perf_counter()
+    frame = codec.encode(message)
+    encode_duration.observe(time.perf_counter() - start, codec=codec.name)
+    return frame
+
+
+class ClientConnection:
+    """WebSocket连接：协商好的编码方式 + 独立的发送队列（慢连接不会拖慢广播）"""
+
+    def __init__(self, websocket: WebSocket, codec, kind: str = "",
+                 max_queue: int = WEBSOCKET_SEND_QUEUE_LIMIT):
+        self.websocket = websocket
+        self.codec = codec
+        self.kind = kind
+        self.max_queue = max_queue
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.writer: Optional[asyncio.Task] = None
+        self.closed = False
+        self.connected_at = time.time()
+
+    @classmethod
+    async def accept(cls, websocket: WebSocket, kind: str = "") -> "ClientConnection":
+        """接受连接：客户端请求了二进制子协议时使用二进制编码，否则使用JSON"""
+        if BINARY_SUBPROTOCOL in websocket.scope.get("subprotocols", []):
+            await websocket.accept(subprotocol=BINARY_SUBPROTOCOL)
+            return cls(websocket, BINARY_CODEC, kind)
+        await websocket.accept()
+        return cls(websocket, JSON_CODEC, kind)
+
+    @property
+    def queue_depth(self) -> int:
+        return self.queue.qsize()
+
+    async def send(self, message: Dict[str, Any]):
+        await self.send_frame(encode_message(self.codec, message))
+
+    async def send_frame(self, frame: Union[str, bytes]):
+        """放入发送队列，由写任务按顺序发出"""
+        if self.closed:
+            return
+        if self.queue.qsize() >= self.max_queue:
+            logger.warning(f"连接发送队列已满（{self.queue.qsize()}条），断开{self.kind}连接")
+            send_queue_dropped.inc(target=self.kind)
+            self.close()
+            asyncio.get_running_loop().create_task(self.abort())
+            return
+        self.queue.put_nowait(frame)
+        if self.writer is None:
+            self.writer = asyncio.create_task(self.write_loop())
+
+    async def write_loop(self):
+        while True:
+            frame = await self.queue.get()
+            try:
+                if isinstance(frame, bytes):
+                    await self.websocket.send_bytes(frame)
+                else:
+                    await self.websocket.send_text(frame)
+                messages_sent.inc(target=self.kind)
+            except Exception as e:
+                logger.debug(f"发送消息失败，停止写入: {e}")
+                self.closed = True
+                return
+
+    async def abort(self):
+        try:
+            await self.websocket.close(code=1013)
+        except Exception:
+            pass
+
+    def close(self):
+        self.closed = True
+        if self.writer is not None:
+            self.writer.cancel()
+            self.writer = None
+
+    async def receive(self) -> Dict[str, Any]:
+        """接收一条消息（文本帧按JSON解析，二进制帧按MessagePack解析）"""
+        message = await self.websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000))
+        if message.get("bytes") is not None:
+            return BINARY_CODEC.decode(message["bytes"])
+        return json.loads(message["text"])
+
+
+def encode_per_codec(connections: Iterable[ClientConnection], message: Dict[str, Any]) -> Dict[str, Union[str, bytes]]:
+    """广播时每种编码只序列化一次"""
+    frames: Dict[str, Union[str, bytes]] = {}
+    for connection in connections:
+        if connection.codec.name not in frames:
+            frames[connection.codec.name] = encode_message(connection.codec, message)
+    return frames